@@ -0,0 +1,149 @@
+import argparse
+import glob
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from inference import perform_inference
+from utils import read_audio, extract_best_scores, extract_3best_labels
+
+
+def find_audio_files(directory):
+    """
+    Returns the audio files of a directory that have a metadata file next to them.
+
+    Returns:
+        list of tuple: (audio name, audio path, metadata path) of each file, sorted by name.
+    """
+    audio_files = []
+    for path_audio in sorted(glob.glob(os.path.join(directory, '*.mp3'))):
+        path_metadata = os.path.splitext(path_audio)[0] + '.csv'
+        if os.path.exists(path_metadata):
+            audio_name = os.path.splitext(os.path.basename(path_audio))[0]
+            audio_files.append((audio_name, path_audio, path_metadata))
+
+    return audio_files
+
+def _decode(path_audio, path_metadata):
+    start = time.perf_counter()
+    chunks, times = read_audio(path_audio, path_metadata, single_decode=True)
+    return chunks, times, time.perf_counter() - start
+
+# Each render process loads the emoji store once
+_visualization = None
+
+def _init_render_worker():
+    global _visualization
+    from visualization import Visualization
+    _visualization = Visualization()
+
+def _render(audio_name, best_labels, best_labels3):
+    start = time.perf_counter()
+    _visualization.create_gifs(best_labels, best_labels3, output_name=audio_name)
+    return time.perf_counter() - start
+
+def run_batch(audio_tagger, audio_files, decode_workers=2, render_workers=2, batch_size=16):
+    """
+    Runs the pipeline of main.py on several audio files, with overlapping stages: the files
+    are decoded in a process pool, the chunks are tagged by a single inference worker (this
+    process, with the model loaded once) and the GIFs are rendered in another process pool.
+
+    Args:
+        audio_tagger (AudioTagging): The audio tagging model, shared by every file.
+        audio_files (list of tuple): (audio name, audio path, metadata path) of each file,
+            as returned by `find_audio_files`.
+        decode_workers (int, optional): Number of decoding processes.
+        render_workers (int, optional): Number of rendering processes.
+        batch_size (int, optional): Batch size of the inference.
+
+    Returns:
+        dict: Per file results (number of chunks, audio duration, time spent in each stage,
+        or the error message if the file failed), by audio name.
+    """
+    from emoji_store import EmojiStore
+
+    results = {audio_name: {} for audio_name, _, _ in audio_files}
+    pending_files = list(audio_files)
+
+    # Built here on a first run, rather than by every render process at the same time
+    EmojiStore.open_or_build()
+
+    # Spawned processes, so the workers don't inherit the threads of torch
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(decode_workers, mp_context=context) as decode_pool, \
+            ProcessPoolExecutor(render_workers, mp_context=context, initializer=_init_render_worker) as render_pool:
+        decode_futures = {}
+        render_futures = {}
+
+        def submit_decodes():
+            # Decoded files waiting for the inference are bounded, to bound the memory
+            while pending_files and len(decode_futures) < 2 * decode_workers:
+                audio_name, path_audio, path_metadata = pending_files.pop(0)
+                decode_futures[decode_pool.submit(_decode, path_audio, path_metadata)] = audio_name
+
+        submit_decodes()
+        while decode_futures:
+            done, _ = wait(decode_futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                audio_name = decode_futures.pop(future)
+                submit_decodes()
+
+                try:
+                    chunks, times, decode_time = future.result()
+
+                    start = time.perf_counter()
+                    inferences = perform_inference(audio_tagger, chunks, batch_size=batch_size)
+                    _, best_labels = extract_best_scores(inferences)
+                    best_labels3 = extract_3best_labels(inferences)
+                    inference_time = time.perf_counter() - start
+                except Exception as error:
+                    results[audio_name]['error'] = repr(error)
+                    continue
+
+                results[audio_name].update({
+                    'chunks': len(chunks),
+                    'audio_duration': sum(duration for _, duration in times),
+                    'decode_time': decode_time,
+                    'inference_time': inference_time,
+                })
+                render_futures[render_pool.submit(_render, audio_name, best_labels, best_labels3)] = audio_name
+
+        for future, audio_name in render_futures.items():
+            try:
+                results[audio_name]['render_time'] = future.result()
+            except Exception as error:
+                results[audio_name]['error'] = repr(error)
+
+    return results
+
+def print_report(results, total_time):
+    print('File    Chunks    Decode (s)    Inference (s)    Render (s)    Chunks/s')
+    for audio_name, result in results.items():
+        if 'error' in result:
+            print(f'{audio_name}    failed: {result["error"]}')
+            continue
+        chunks_per_second = result['chunks'] / result['inference_time'] if result['inference_time'] else 0.
+        print(f'{audio_name}    {result["chunks"]}    {result["decode_time"]:.2f}    {result["inference_time"]:.2f}    '
+              f'{result["render_time"]:.2f}    {chunks_per_second:.1f}')
+
+    total_chunks = sum(result.get('chunks', 0) for result in results.values())
+    total_audio = sum(result.get('audio_duration', 0) for result in results.values())
+    print(f'{len(results)} files, {total_chunks} chunks in {total_time:.2f} s: '
+          f'{total_chunks / total_time:.1f} chunks/s, {total_audio / total_time:.1f} s of audio per second')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tags and renders every audio file (.mp3 + .csv) of a directory.')
+    parser.add_argument('directory', nargs='?', default='new_audios')
+    parser.add_argument('--decode-workers', type=int, default=2)
+    parser.add_argument('--render-workers', type=int, default=2)
+    parser.add_argument('--batch-size', type=int, default=16)
+    args = parser.parse_args()
+
+    from panns_inference import AudioTagging
+
+    start = time.perf_counter()
+    tagger = AudioTagging(checkpoint_path=None, device='cpu')
+    results = run_batch(tagger, find_audio_files(args.directory),
+                        args.decode_workers, args.render_workers, args.batch_size)
+    print_report(results, time.perf_counter() - start)
@@ -0,0 +1,197 @@
+import argparse
+import importlib.metadata
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+import numpy as np
+
+
+class StubTagger:
+    """
+    Stand-in for AudioTagging returning random scores, so the pipeline can be measured
+    without downloading the checkpoint. The cost of the model itself is not measured.
+    """
+    def __init__(self, classes_num=527, embedding_size=2048, seed=0):
+        self.classes_num = classes_num
+        self.embedding_size = embedding_size
+        self.rng = np.random.default_rng(seed)
+
+    def inference(self, audio):
+        batch_size = len(audio)
+        clipwise_output = self.rng.random((batch_size, self.classes_num), dtype=np.float32)
+        embedding = self.rng.random((batch_size, self.embedding_size), dtype=np.float32)
+        return clipwise_output, embedding
+
+
+def write_synthetic_audio(path, seconds, sample_rate=32000, seed=0):
+    """Writes a mono 16 bits WAV file of noise and tones."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    signal = 0.3 * np.sin(2 * np.pi * 440 * t) + 0.1 * rng.standard_normal(len(t))
+
+    with wave.open(path, 'wb') as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(sample_rate)
+        file.writeframes((np.clip(signal, -1, 1) * 32767).astype('<i2').tobytes())
+
+def write_synthetic_metadata(path, seconds, n_chunks):
+    """
+    Writes a metadata CSV of `n_chunks` adjacent chunks covering the file, plus the first
+    and last rows that `read_metadata` drops by default.
+    """
+    bounds = np.linspace(0, seconds, n_chunks + 3)
+    with open(path, 'w') as file:
+        file.write('summary_start,summary_end\n')
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            file.write(f'{time.strftime("%H:%M:%S", time.gmtime(start))}.{int(start % 1 * 1e6):06d},'
+                       f'{time.strftime("%H:%M:%S", time.gmtime(end))}.{int(end % 1 * 1e6):06d}\n')
+
+def _measure(name, function, items, unit):
+    """Runs a stage once and returns its result and measures (time, throughput, peak of traced memory)."""
+    tracemalloc.start()
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, {
+        'stage': name,
+        'seconds': elapsed,
+        'cpu_seconds': cpu,
+        'items': items,
+        'unit': unit,
+        'items_per_second': items / elapsed if elapsed else None,
+        'peak_bytes': peak,
+    }
+
+def _package_version(name):
+    """Returns the installed version of a package, without importing it (torch is slow to import)."""
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(n_chunks=200, file_seconds=600., sample_rate=32000, batch_size=16):
+    """
+    Measures every stage of the pipeline of main.py on synthetic data.
+
+    Args:
+        n_chunks (int, optional): Number of chunks in the metadata.
+        file_seconds (float, optional): Duration of the synthetic audio file.
+        sample_rate (int, optional): Sample rate of the synthetic audio file.
+        batch_size (int, optional): Batch size of the inference.
+
+    Returns:
+        dict: The configuration, the environment and the measures of each stage.
+    """
+    from emoji_store import write_synthetic_emoji_store
+    from inference import perform_inference
+    from utils import read_audio, extract_best_scores, extract_3best_labels
+    from visualization import Visualization
+
+    stages = []
+    with tempfile.TemporaryDirectory() as directory:
+        path_audio = os.path.join(directory, 'audio.wav')
+        path_metadata = os.path.join(directory, 'audio.csv')
+        store_path = os.path.join(directory, 'emoji')
+        write_synthetic_audio(path_audio, file_seconds, sample_rate)
+        write_synthetic_metadata(path_metadata, file_seconds, n_chunks)
+        write_synthetic_emoji_store(store_path)
+
+        for single_decode in (False, True):
+            (chunks, _), measure = _measure(f'read_audio(single_decode={single_decode})',
+                                            lambda: read_audio(path_audio, path_metadata, single_decode=single_decode),
+                                            file_seconds, 'audio seconds')
+            stages.append(measure)
+
+        inferences, measure = _measure('perform_inference (stub tagger)',
+                                       lambda: perform_inference(StubTagger(), chunks, batch_size=batch_size),
+                                       len(chunks), 'chunks')
+        stages.append(measure)
+
+        (_, best_labels), measure = _measure('extract_best_scores', lambda: extract_best_scores(inferences),
+                                             len(chunks), 'chunks')
+        stages.append(measure)
+
+        best_labels3, measure = _measure('extract_3best_labels', lambda: extract_3best_labels(inferences),
+                                         len(chunks), 'chunks')
+        stages.append(measure)
+
+        visu, measure = _measure('Visualization.__init__', lambda: Visualization(store_path=store_path), 1, 'instances')
+        stages.append(measure)
+
+        renderers = [
+            ('create_emoji_circle_detailled_gif', best_labels3, '_circle_detailled'),
+            ('create_emoji_gif', best_labels, ''),
+            ('create_emoji_circle_gif', best_labels, '_circle'),
+            ('create_diagonal_emoji_gif', best_labels3, '_diagonal'),
+        ]
+        for method, labels, suffix in renderers:
+            _, measure = _measure(f'Visualization.{method}',
+                                  lambda: getattr(visu, method)(labels, output_name='benchmark', output_dir=directory),
+                                  len(labels), 'frames')
+            measure['output_bytes'] = os.path.getsize(os.path.join(directory, f'benchmark{suffix}.gif'))
+            stages.append(measure)
+
+        _, measure = _measure('Visualization.create_gifs (every style)',
+                              lambda: visu.create_gifs(best_labels, best_labels3, output_name='benchmark_all',
+                                                       output_dir=directory),
+                              len(best_labels), 'chunks')
+        measure['output_bytes'] = sum(os.path.getsize(os.path.join(directory, f'benchmark_all{suffix}.gif'))
+                                      for _, _, suffix in renderers)
+        stages.append(measure)
+
+    return {
+        'config': {
+            'chunks': n_chunks,
+            'file_seconds': file_seconds,
+            'sample_rate': sample_rate,
+            'batch_size': batch_size,
+        },
+        'environment': {
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            **{package: _package_version(package) for package in ('torch', 'librosa', 'Pillow')},
+            'platform': platform.platform(),
+        },
+        'stages': stages,
+        # Kilobytes on Linux
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures each stage of the pipeline on synthetic data.')
+    parser.add_argument('--chunks', type=int, default=200)
+    parser.add_argument('--file-seconds', type=float, default=600.)
+    parser.add_argument('--sample-rate', type=int, default=32000)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--output', default=None, help='JSON file receiving the results (default: stdout)')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.chunks, args.file_seconds, args.sample_rate, args.batch_size)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,151 @@
+import numpy as np
+from inference import LABELS, TaggingResults
+
+# Sample rate and frame rate of the PANNs sound event detection model
+SED_SAMPLE_RATE = 32000
+SED_FRAMES_PER_SECOND = 100
+
+
+def _window_starts(n_samples, window_samples, hop_samples):
+    """Returns the start sample of each window, the last window ending at the end of the signal."""
+    starts = list(range(0, max(n_samples - window_samples, 0) + 1, hop_samples))
+    if starts[-1] + window_samples < n_samples:
+        starts.append(n_samples - window_samples)
+
+    return starts
+
+def perform_framewise_detection(sound_event_detector, audio, window_seconds=10., overlap_seconds=1.,
+                                batch_size=1, out=None):
+    """
+    Runs a sound event detection model over a whole signal, in fixed-size overlapping windows,
+    and returns the probability of every class at every frame. Where windows overlap, the
+    maximum of their probabilities is kept.
+
+    Only `batch_size` windows are sent to the model at once, so the memory used by the model
+    doesn't depend on the signal length. The framewise output itself grows with the signal
+    length: for long recordings, pass a disk-backed array as `out`
+    (e.g. `np.lib.format.open_memmap`, possibly float16).
+
+    Args:
+        sound_event_detector (SoundEventDetection): An instance of the SoundEventDetection
+            class from the `panns_inference` library.
+        audio (ndarray): The signal, sampled at SED_SAMPLE_RATE.
+        window_seconds (float, optional): Duration of the windows in seconds.
+        overlap_seconds (float, optional): Overlap between consecutive windows in seconds,
+            to avoid the border effects of the model at the edges of the windows.
+        batch_size (int, optional): Number of windows sent to the model at once.
+        out (ndarray, optional): (n_frames, n_classes) array receiving the output,
+            n_frames being `ceil(len(audio) / SED_SAMPLE_RATE * SED_FRAMES_PER_SECOND)`.
+
+    Returns:
+        ndarray: (n_frames, n_classes) framewise probabilities, at SED_FRAMES_PER_SECOND frames per second.
+    """
+    window_samples = int(window_seconds * SED_SAMPLE_RATE)
+    hop_samples = window_samples - int(overlap_seconds * SED_SAMPLE_RATE)
+    if hop_samples <= 0:
+        raise ValueError('The overlap must be shorter than the window')
+
+    n_frames = int(np.ceil(len(audio) / SED_SAMPLE_RATE * SED_FRAMES_PER_SECOND))
+    framewise = out if out is not None else np.zeros((n_frames, len(LABELS)), dtype=np.float32)
+    if out is not None:
+        framewise[:] = 0
+
+    starts = _window_starts(len(audio), window_samples, hop_samples)
+    for batch_start in range(0, len(starts), batch_size):
+        batch_starts = starts[batch_start:batch_start + batch_size]
+
+        # Signals shorter than a window are padded with zeros
+        batch = np.zeros((len(batch_starts), window_samples), dtype=np.float32)
+        for row, start in enumerate(batch_starts):
+            window = audio[start:start + window_samples]
+            batch[row, :len(window)] = window
+
+        framewise_output = sound_event_detector.inference(batch)
+
+        for row, start in enumerate(batch_starts):
+            first_frame = start * SED_FRAMES_PER_SECOND // SED_SAMPLE_RATE
+            frame_count = min(framewise_output.shape[1], n_frames - first_frame)
+            destination = framewise[first_frame:first_frame + frame_count]
+            np.maximum(destination, framewise_output[row, :frame_count], out=destination)
+
+    return framewise
+
+def aggregate_segments(framewise, audio_times, pooling='max'):
+    """
+    Pools framewise probabilities over arbitrary segments, e.g. the chunks of the metadata
+    (see `utils.read_metadata`). Changing the segmentation doesn't require running the model again.
+
+    Args:
+        framewise (ndarray): (n_frames, n_classes) output of `perform_framewise_detection`.
+        audio_times (list of tuples): Offsets and durations of the segments, in seconds.
+        pooling (str, optional): 'max' or 'mean'. Defaults to 'max'.
+
+    Returns:
+        TaggingResults: The pooled scores of every segment, usable like the results of `perform_inference`.
+    """
+    if pooling not in ('max', 'mean'):
+        raise ValueError(f"Unknown pooling '{pooling}', expected 'max' or 'mean'")
+
+    scores = np.zeros((len(audio_times), framewise.shape[1]), dtype=np.float32)
+    if len(framewise) == 0:
+        # Empty signal, nothing was detected in the segments
+        return TaggingResults(scores)
+
+    for i, (offset, duration) in enumerate(audio_times):
+        first_frame = min(int(np.floor(offset * SED_FRAMES_PER_SECOND)), len(framewise) - 1)
+        last_frame = int(np.ceil((offset + duration) * SED_FRAMES_PER_SECOND))
+        frames = framewise[first_frame:max(last_frame, first_frame + 1)]
+
+        scores[i] = frames.max(axis=0) if pooling == 'max' else frames.mean(axis=0)
+
+    return TaggingResults(scores)
+
+def detect_file(sound_event_detector, path_audio, audio_times, pooling='max', block_seconds=600., out=None,
+                **detection_kwargs):
+    """
+    Runs the framewise detection over an audio file and pools the result over the given
+    segments.
+
+    The file is decoded by blocks of `block_seconds`, each one with `overlap_seconds` of
+    context on both sides (the border effects of the model stay in the context), so the
+    decoded audio in memory doesn't depend on the file length.
+
+    Args:
+        sound_event_detector (SoundEventDetection): The sound event detection model.
+        path_audio (str): Path to the audio file.
+        audio_times (list of tuples): Offsets and durations of the segments, in seconds.
+        pooling (str, optional): 'max' or 'mean'. Defaults to 'max'.
+        block_seconds (float, optional): Duration of the blocks decoded at once.
+        out (ndarray, optional): (n_frames, n_classes) array receiving the framewise output,
+            see `perform_framewise_detection`.
+        **detection_kwargs: Other arguments of `perform_framewise_detection`.
+
+    Returns:
+        tuple:
+            - inferences (TaggingResults): The scores of every segment.
+            - framewise (ndarray): The framewise probabilities, to pool other segmentations.
+    """
+    import librosa as lb
+
+    n_frames = int(np.ceil(lb.get_duration(path=path_audio) * SED_FRAMES_PER_SECOND))
+    framewise = out if out is not None else np.zeros((n_frames, len(LABELS)), dtype=np.float32)
+    if out is not None:
+        framewise[:] = 0
+
+    # Whole frames, so the blocks start on a frame of the model
+    block_frames = max(int(block_seconds * SED_FRAMES_PER_SECOND), 1)
+    context_frames = int(np.ceil(detection_kwargs.get('overlap_seconds', 1.) * SED_FRAMES_PER_SECOND))
+    for block_start in range(0, n_frames, block_frames):
+        block_end = min(block_start + block_frames, n_frames)
+        context_start = max(block_start - context_frames, 0)
+        context_end = min(block_end + context_frames, n_frames)
+
+        audio, _ = lb.load(path_audio, sr=SED_SAMPLE_RATE, offset=context_start / SED_FRAMES_PER_SECOND,
+                           duration=(context_end - context_start) / SED_FRAMES_PER_SECOND)
+        block_framewise = perform_framewise_detection(sound_event_detector, audio, **detection_kwargs)
+
+        # Only the frames of the block are kept, not the ones of the context
+        kept = block_framewise[block_start - context_start:block_end - context_start]
+        framewise[block_start:block_start + len(kept)] = kept
+
+    return aggregate_segments(framewise, audio_times, pooling), framewise
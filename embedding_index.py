@@ -0,0 +1,245 @@
+import argparse
+import json
+import os
+import numpy as np
+from inference import TaggingResults
+
+DEFAULT_CORPUS_DIR = './cache/corpus'
+
+
+def _write_npy(path, array, dtype):
+    """Writes an array as a .npy file through a memory map, replacing the file at once."""
+    temporary_path = f'{path}.tmp'
+    out = np.lib.format.open_memmap(temporary_path, mode='w+', dtype=dtype, shape=array.shape)
+    out[:] = array
+    out.flush()
+    del out
+    os.replace(temporary_path, path)
+
+
+class EmbeddingStore:
+    """
+    Tagging results of a corpus of recordings, on disk.
+
+    Each recording is stored as three .npy files: the (n_chunks, n_classes) float32 scores,
+    the (n_chunks, embedding size) embeddings, in float32 or float16, and the (n_chunks, 2)
+    offsets and durations of the chunks. They are loaded memory-mapped, so only the rows
+    used are read from the disk.
+
+    Usage:
+        store = EmbeddingStore()
+        store.put('A_1', perform_inference(audio_tagger, chunks, keep_embeddings=True), times)
+        inferences, times = store.get('A_1')
+    """
+    def __init__(self, directory=DEFAULT_CORPUS_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name, kind):
+        return os.path.join(self.directory, f'{name}.{kind}.npy')
+
+    def names(self):
+        """Returns the names of the stored recordings, sorted."""
+        suffix = '.embeddings.npy'
+        return sorted(file_name[:-len(suffix)] for file_name in os.listdir(self.directory) if file_name.endswith(suffix))
+
+    def __contains__(self, name):
+        return os.path.exists(self._path(name, 'embeddings'))
+
+    def put(self, name, results, audio_times, dtype=np.float32):
+        """
+        Stores the results of a recording, replacing the previous ones.
+
+        Args:
+            name (str): Name of the recording.
+            results (TaggingResults): Its results, with the embeddings (`keep_embeddings=True`).
+            audio_times (list of tuples): Offsets and durations of the chunks.
+            dtype (numpy dtype, optional): np.float32 or np.float16 (half the size) for the embeddings.
+        """
+        if results.embeddings is None:
+            raise ValueError('The results have no embeddings, run the inference with keep_embeddings=True')
+        if len(audio_times) != len(results):
+            raise ValueError(f'{len(audio_times)} chunk times for {len(results)} chunk results')
+
+        _write_npy(self._path(name, 'scores'), results.scores, np.float32)
+        _write_npy(self._path(name, 'times'), np.asarray(audio_times, dtype=np.float64).reshape(-1, 2), np.float64)
+        # Written last, as its presence marks a complete recording
+        _write_npy(self._path(name, 'embeddings'), results.embeddings, dtype)
+
+    def get_embeddings(self, name):
+        """Returns the memory-mapped (n_chunks, embedding size) embeddings of a recording."""
+        return np.load(self._path(name, 'embeddings'), mmap_mode='r')
+
+    def get(self, name):
+        """
+        Returns the results of a recording.
+
+        Returns:
+            tuple:
+                - inferences (TaggingResults): The memory-mapped scores and embeddings.
+                - audio_times (list of tuples): The offsets and durations of the chunks.
+        """
+        scores = np.load(self._path(name, 'scores'), mmap_mode='r')
+        times = np.load(self._path(name, 'times'))
+        return TaggingResults(scores, self.get_embeddings(name)), [tuple(time) for time in times.tolist()]
+
+
+class EmbeddingIndex:
+    """
+    Nearest neighbour index over the chunk embeddings of a corpus, by cosine similarity.
+
+    The search is brute-force: the normalized embeddings of the whole corpus are a single
+    contiguous matrix (memory-mapped when saved), multiplied by the queries block by block,
+    the k best chunks being kept across the blocks.
+
+    Usage:
+        index = EmbeddingIndex.build(EmbeddingStore(), './cache/corpus/index')
+        for name, chunk, offset, duration, similarity in index.similar_chunks('A_1', 12):
+            ...
+    """
+    def __init__(self, embeddings, rows):
+        # (n_chunks, embedding size) embeddings of unit norm
+        self.embeddings = embeddings
+        # (recording name, chunk index, offset, duration) of each row
+        self.rows = rows
+        self._row_index = {(name, chunk): row for row, (name, chunk, _, _) in enumerate(rows)}
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def build(cls, store, path=None, dtype=np.float32):
+        """
+        Builds the index of every recording of a store.
+
+        Args:
+            store (EmbeddingStore): The store.
+            path (str, optional): If given, the index is written to `{path}.npy` and `{path}.json`,
+                to be opened with `load`. Otherwise it stays in memory.
+            dtype (numpy dtype, optional): np.float32 or np.float16 for the index matrix.
+
+        Returns:
+            EmbeddingIndex: The index.
+        """
+        names = store.names()
+        embeddings_by_name = {name: store.get_embeddings(name) for name in names}
+        n_rows = sum(len(embeddings) for embeddings in embeddings_by_name.values())
+        if n_rows == 0:
+            raise ValueError(f'No embeddings in {store.directory}')
+        size = next(embeddings.shape[1] for embeddings in embeddings_by_name.values() if len(embeddings))
+
+        if path is None:
+            matrix = np.empty((n_rows, size), dtype=dtype)
+        else:
+            matrix = np.lib.format.open_memmap(f'{path}.npy', mode='w+', dtype=dtype, shape=(n_rows, size))
+
+        rows = []
+        start = 0
+        for name, embeddings in embeddings_by_name.items():
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            matrix[start:start + len(embeddings)] = embeddings / np.maximum(norms, 1e-12)
+            start += len(embeddings)
+
+            _, times = store.get(name)
+            rows.extend((name, chunk, offset, duration) for chunk, (offset, duration) in enumerate(times))
+
+        if path is not None:
+            matrix.flush()
+            with open(f'{path}.json', 'w') as file:
+                json.dump(rows, file)
+
+        return cls(matrix, rows)
+
+    @classmethod
+    def load(cls, path):
+        """Opens an index written by `build`, memory-mapped."""
+        with open(f'{path}.json') as file:
+            rows = [tuple(row) for row in json.load(file)]
+        return cls(np.load(f'{path}.npy', mmap_mode='r'), rows)
+
+    @classmethod
+    def open_or_build(cls, store, path, rebuild=False):
+        """
+        Opens the index written at `path`, building it first if it does not exist, if it is
+        older than a recording of the store, or if its recordings differ from the store ones.
+        """
+        if not rebuild and os.path.exists(f'{path}.json') and os.path.exists(f'{path}.npy'):
+            with open(f'{path}.json') as file:
+                indexed_names = {row[0] for row in json.load(file)}
+            # The .json is written last, when the index is complete
+            index_time = os.path.getmtime(f'{path}.json')
+            store_names = {name for name in store.names() if len(store.get_embeddings(name))}
+            if indexed_names == store_names and all(os.path.getmtime(store._path(name, 'embeddings')) <= index_time
+                                                    for name in store_names):
+                return cls.load(path)
+
+        return cls.build(store, path)
+
+    def search(self, queries, k=10, block_rows=65536):
+        """
+        Finds the chunks whose embeddings are the most similar to the queries.
+
+        Args:
+            queries (ndarray): (embedding size,) or (n_queries, embedding size) embeddings.
+            k (int, optional): Number of chunks returned per query.
+            block_rows (int, optional): Number of index rows multiplied at once, bounding the memory.
+
+        Returns:
+            tuple:
+                - similarities (ndarray): (n_queries, k) cosine similarities, in descending order.
+                - rows (ndarray): (n_queries, k) index rows of the chunks, see `rows`.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        k = min(k, len(self))
+
+        best_similarities = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(self), block_rows):
+            block = np.asarray(self.embeddings[start:start + block_rows], dtype=np.float32)
+            similarities = queries @ block.T
+
+            best_similarities = np.concatenate([best_similarities, similarities], axis=1)
+            block_rows_index = np.broadcast_to(np.arange(start, start + len(block)), similarities.shape)
+            best_rows = np.concatenate([best_rows, block_rows_index], axis=1)
+
+            # Only the k best of the candidates are kept for the next block
+            if best_similarities.shape[1] > k:
+                partition = np.argpartition(-best_similarities, k - 1, axis=1)[:, :k]
+                best_similarities = np.take_along_axis(best_similarities, partition, axis=1)
+                best_rows = np.take_along_axis(best_rows, partition, axis=1)
+
+        order = np.argsort(-best_similarities, axis=1, kind='stable')
+        return np.take_along_axis(best_similarities, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
+
+    def similar_chunks(self, name, chunk, k=10):
+        """
+        Returns the chunks of the corpus most similar to a chunk of the index, itself excluded.
+
+        Returns:
+            list of tuple: (recording name, chunk index, offset, duration, similarity) of each chunk.
+        """
+        row = self._row_index[(name, chunk)]
+        similarities, rows = self.search(self.embeddings[row], k + 1)
+
+        return [(*self.rows[found_row], float(similarity))
+                for similarity, found_row in zip(similarities[0], rows[0]) if found_row != row][:k]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Finds the chunks of the corpus similar to a chunk.')
+    parser.add_argument('audio_name', help='recording of the chunk, stored with main.py --corpus')
+    parser.add_argument('chunk', type=int, help='index of the chunk in the recording')
+    parser.add_argument('-k', type=int, default=10, help='number of similar chunks')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_DIR)
+    parser.add_argument('--rebuild', action='store_true',
+                        help='rebuild the index even if it is up to date with the stored recordings')
+    args = parser.parse_args()
+
+    # Rebuilt when recordings were stored since the last build
+    index = EmbeddingIndex.open_or_build(EmbeddingStore(args.corpus), os.path.join(args.corpus, 'index'), args.rebuild)
+
+    print('Recording    Chunk    Offset    Duration    Similarity')
+    for name, chunk, offset, duration, similarity in index.similar_chunks(args.audio_name, args.chunk, args.k):
+        print(f'{name}    {chunk}    {offset}    {duration}    {similarity:.3f}')
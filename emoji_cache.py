@@ -0,0 +1,68 @@
+from collections import OrderedDict
+
+
+class EmojiCache:
+    """
+    Least recently used cache of emoji images, bounded by the memory used by the
+    decoded pixels rather than by a number of entries.
+
+    It keeps hit/miss statistics so it can be sized for long sessions.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _image_bytes(image):
+        return image.width * image.height * len(image.getbands())
+
+    def get(self, key, create):
+        """
+        Returns the image cached for `key`, calling `create()` to build it on a miss.
+
+        The returned image is shared: it must not be modified by the caller.
+        """
+        image = self._entries.get(key)
+        if image is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return image
+
+        self.misses += 1
+        image = create()
+
+        image_bytes = self._image_bytes(image)
+        # An image bigger than the whole cache is returned without being cached
+        if image_bytes <= self.max_bytes:
+            self._entries[key] = image
+            self.current_bytes += image_bytes
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= self._image_bytes(evicted)
+                self.evictions += 1
+
+        return image
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def stats(self):
+        """Returns the cache statistics as a dict."""
+        requests = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / requests if requests else 0.,
+        }
+
+    def __len__(self):
+        return len(self._entries)
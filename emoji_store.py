@@ -0,0 +1,161 @@
+import base64
+import json
+import mmap
+import os
+import sys
+from io import BytesIO
+import PIL.Image
+
+DEFAULT_CSV_PATH = './emojiimage-dataset/full_emoji.csv'
+DEFAULT_STORE_PATH = './emojiimage-dataset/apple_emoji'
+
+
+def write_emoji_store(images, store_path=DEFAULT_STORE_PATH):
+    """
+    Writes emoji images in a store made of a single binary blob (`<store_path>.bin`)
+    containing every PNG one after the other, and an index (`<store_path>.json`)
+    giving the offset and length of each image in the blob.
+
+    Args:
+        images (dict): Mapping from an emoji unicode (e.g. 'U+1F600') to its PNG bytes.
+        store_path (str, optional): Path of the store, without extension.
+    """
+    # Written to temporary files and moved in place, so an interrupted build or another
+    # process building the same store never leaves a partial store. The index is moved
+    # last, a store being only opened once both files exist
+    temporary_path = f'{store_path}.{os.getpid()}.tmp'
+    index = {}
+    offset = 0
+    with open(f'{temporary_path}.bin', 'wb') as blob:
+        for unicode, image_bytes in images.items():
+            blob.write(image_bytes)
+            index[unicode] = (offset, len(image_bytes))
+            offset += len(image_bytes)
+
+    with open(f'{temporary_path}.json', 'w') as file:
+        json.dump(index, file)
+
+    os.replace(f'{temporary_path}.bin', f'{store_path}.bin')
+    os.replace(f'{temporary_path}.json', f'{store_path}.json')
+
+def build_emoji_store(csv_path=DEFAULT_CSV_PATH, store_path=DEFAULT_STORE_PATH, vendor='Apple'):
+    """
+    Extracts the images of one vendor from the emojiimage-dataset CSV and writes them
+    in an emoji store (see `write_emoji_store`). This only needs to be done once.
+
+    Args:
+        csv_path (str, optional): Path to the `full_emoji.csv` file of the dataset.
+        store_path (str, optional): Path of the store, without extension.
+        vendor (str, optional): Column of the vendor whose images are extracted.
+    """
+    import pandas as pd
+
+    # Only the needed columns are parsed, the other vendors' images are never loaded
+    emoji_data = pd.read_csv(csv_path, usecols=['unicode', vendor])
+
+    images = {}
+    for unicode, data in zip(emoji_data['unicode'], emoji_data[vendor]):
+        # Missing images are not a data URI (NaN or a placeholder string)
+        if isinstance(data, str) and data.startswith('data:'):
+            # Removing the 'data:image/png;base64,' header
+            images[unicode] = base64.b64decode(data.split(',', 1)[1])
+
+    write_emoji_store(images, store_path)
+
+
+def write_synthetic_emoji_store(store_path, size=72):
+    """
+    Writes an emoji store with a plain colored image for every emoji of the mapping, to
+    benchmark or test the rendering without the dataset.
+    """
+    from mapping import CODEPOINTS_BY_LABEL
+
+    codepoints = {'U+274C'}
+    for label_codepoints in CODEPOINTS_BY_LABEL.values():
+        codepoints.update(label_codepoints)
+
+    images = {}
+    for i, codepoint in enumerate(sorted(codepoints)):
+        color = ((i * 97) % 256, (i * 57) % 256, (i * 31) % 256, 255)
+        image_bytes = BytesIO()
+        PIL.Image.new('RGBA', (size, size), color).save(image_bytes, format='PNG')
+        images[codepoint] = image_bytes.getvalue()
+
+    write_emoji_store(images, store_path)
+
+
+class EmojiStore:
+    """
+    Read access to an emoji store written by `write_emoji_store`.
+
+    The blob is memory-mapped and an image is only decoded when it is requested.
+    """
+    def __init__(self, store_path=DEFAULT_STORE_PATH):
+        self.store_path = store_path
+
+        with open(f'{store_path}.json', 'r') as file:
+            self.index = {unicode: tuple(entry) for unicode, entry in json.load(file).items()}
+
+        self._file = open(f'{store_path}.bin', 'rb')
+        # An empty file cannot be memory-mapped
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._blob = b''
+
+    @classmethod
+    def open_or_build(cls, store_path=DEFAULT_STORE_PATH, csv_path=DEFAULT_CSV_PATH, vendor='Apple'):
+        """
+        Opens the store, building it from the dataset CSV first if it does not exist. The
+        labels whose emojis are missing from a new store are reported once, when it is built.
+        """
+        if not (os.path.exists(f'{store_path}.bin') and os.path.exists(f'{store_path}.json')):
+            build_emoji_store(csv_path, store_path, vendor)
+            store = cls(store_path)
+            print_missing_codepoints(store)
+            return store
+
+        return cls(store_path)
+
+    def __contains__(self, unicode):
+        return unicode in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getstate__(self):
+        # The memory map can't be pickled, it is reopened from the path (e.g. in a worker process)
+        return {'store_path': self.store_path}
+
+    def __setstate__(self, state):
+        self.__init__(state['store_path'])
+
+    def get_bytes(self, unicode):
+        """Returns the PNG bytes of an emoji. Raises a KeyError if it is not in the store."""
+        offset, length = self.index[unicode]
+        return self._blob[offset:offset + length]
+
+    def get_image(self, unicode):
+        """Returns an emoji as a PIL image. Raises a KeyError if it is not in the store."""
+        return PIL.Image.open(BytesIO(self.get_bytes(unicode)))
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        self._file.close()
+
+def print_missing_codepoints(store):
+    """Prints the labels whose emojis are missing from a store, drawn with the default emoji."""
+    from mapping import find_missing_codepoints
+
+    for label, codepoints in find_missing_codepoints(store).items():
+        print(f'Missing emoji for {label}: {" ".join(codepoints)}')
+
+
+if __name__ == '__main__':
+    # Usage: python emoji_store.py [csv_path] [store_path] [vendor]
+    build_emoji_store(*sys.argv[1:])
+
+    store = EmojiStore(*sys.argv[2:3])
+    print(f'{len(store)} emojis written to {store.store_path}')
+    print_missing_codepoints(store)
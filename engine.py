@@ -0,0 +1,351 @@
+import argparse
+import copy
+import multiprocessing
+import queue
+import time
+import numpy as np
+
+# Model used by the worker processes. It is set before forking them, so every worker shares
+# the parent's copy of the weights (copy-on-write) instead of loading its own.
+_worker_tagger = None
+
+
+def _worker_loop(tasks, results, threads, prepare_tagger):
+    global _worker_tagger
+    prepare_error = None
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        # Not every model given to the engine is a torch one
+        pass
+
+    if prepare_tagger is not None:
+        try:
+            _worker_tagger = prepare_tagger(_worker_tagger)
+        except Exception as error:
+            # Every batch fails with it, rather than the worker dying silently
+            _worker_tagger = None
+            prepare_error = repr(error)
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        task_id, batch = task
+        if _worker_tagger is None:
+            results.put((task_id, None, None, f'preparing the model failed: {prepare_error}'))
+            continue
+        try:
+            clipwise_output, embedding = _worker_tagger.inference(batch)
+            results.put((task_id, clipwise_output, embedding, None))
+        except Exception as error:
+            results.put((task_id, None, None, repr(error)))
+
+
+class InferenceEngine:
+    """
+    Runs an AudioTagging model in several worker processes, each one using a fixed number
+    of torch threads. The model is loaded once, in this process, and shared with the
+    workers by forking.
+
+    The engine has the same `inference` method as AudioTagging, so it can be given to
+    `perform_inference` instead of the model: each batch is split between the workers.
+    It must be used from a single thread, and should be created before the model is run
+    in this process, as forking after torch started its thread pools is not always safe.
+    A model that must be run to be prepared (e.g. traced by `optimize_tagger`) is prepared
+    in each worker, after the fork, by `prepare_tagger`.
+
+    Usage:
+        with InferenceEngine(AudioTagging(checkpoint_path=None, device='cpu'), num_workers=4) as engine:
+            inferences = perform_inference(engine, chunks, batch_size=16)
+    """
+    def __init__(self, audio_tagger, num_workers=2, threads_per_worker=1, max_pending=None,
+                 result_timeout=1., close_timeout=10., prepare_tagger=None):
+        global _worker_tagger
+        _worker_tagger = audio_tagger
+
+        self.audio_tagger = audio_tagger
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        # Batches sent to the workers and not yet collected, the producer waits above it
+        self.max_pending = max_pending or 2 * num_workers
+        # Seconds between two checks that the workers are alive, while waiting for a result
+        self.result_timeout = result_timeout
+        # Seconds given to the workers to stop, they are terminated after it
+        self.close_timeout = close_timeout
+        self._next_task_id = 0
+
+        context = multiprocessing.get_context('fork')
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._workers = [
+            context.Process(target=_worker_loop, daemon=True,
+                            args=(self._tasks, self._results, threads_per_worker, prepare_tagger))
+            for _ in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def map(self, batches):
+        """
+        Runs the model on every (batch_size, samples) array of an iterable, in parallel.
+
+        At most `max_pending` batches are waiting in the workers at any time, so the
+        batches can be produced lazily (e.g. while the audio is decoded).
+
+        Yields:
+            tuple: (clipwise_output, embedding) of each batch, in the order of the batches.
+        """
+        batches = iter(batches)
+        exhausted = False
+        # The task ids keep increasing across the calls: the results of a previous call that
+        # failed or was abandoned can still arrive, and are recognized by their older ids
+        first_task_id = next_task_id = self._next_task_id
+        done = {}
+
+        while True:
+            while not exhausted and self._next_task_id - next_task_id - len(done) < self.max_pending:
+                try:
+                    batch = next(batches)
+                except StopIteration:
+                    exhausted = True
+                    break
+                self._tasks.put((self._next_task_id, batch))
+                self._next_task_id += 1
+
+            if exhausted and next_task_id == self._next_task_id:
+                return
+
+            task_id, clipwise_output, embedding, error = self._get_result()
+            if task_id < first_task_id:
+                continue
+            if error is not None:
+                raise RuntimeError(f'Inference failed in a worker: {error}')
+            done[task_id] = (clipwise_output, embedding)
+
+            while next_task_id in done:
+                yield done.pop(next_task_id)
+                next_task_id += 1
+
+    def _get_result(self):
+        # A worker killed by the system never answers, so the wait can't be endless
+        while True:
+            try:
+                return self._results.get(timeout=self.result_timeout)
+            except queue.Empty:
+                dead = [worker for worker in self._workers if not worker.is_alive()]
+                if dead:
+                    raise RuntimeError(f'Inference worker {dead[0].pid} died (exit code {dead[0].exitcode})')
+
+    def _drain_results(self):
+        try:
+            while True:
+                self._results.get_nowait()
+        except queue.Empty:
+            pass
+
+    def inference(self, audio):
+        """Same as `AudioTagging.inference`, the rows of the batch being split between the workers."""
+        parts = np.array_split(audio, min(self.num_workers, len(audio)))
+        outputs = list(self.map(parts))
+
+        clipwise_output = np.concatenate([clipwise_output for clipwise_output, _ in outputs])
+        embedding = np.concatenate([embedding for _, embedding in outputs])
+        return clipwise_output, embedding
+
+    def close(self):
+        if not self._workers:
+            return
+
+        # The batches left by a failed map are dropped, they would only delay the stop
+        try:
+            while True:
+                self._tasks.get_nowait()
+        except queue.Empty:
+            pass
+        for _ in self._workers:
+            self._tasks.put(None)
+
+        # A worker only exits once its results are flushed to the queue, so they are read
+        # (and thrown away) while waiting for it
+        deadline = time.monotonic() + self.close_timeout
+        for worker in self._workers:
+            while worker.is_alive() and time.monotonic() < deadline:
+                self._drain_results()
+                worker.join(timeout=0.05)
+        for worker in self._workers:
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+
+        # The sentinels of terminated workers are never read, which must not block the exit
+        self._tasks.cancel_join_thread()
+        self._workers = []
+
+
+def optimize_tagger(audio_tagger, quantize=True, script=False, example_seconds=10., sample_rate=32000):
+    """
+    Returns a copy of an AudioTagging model optimized for CPU inference, with the same 
+    `inference` method. The given model is left untouched, to compare both.
+
+    Args:
+        audio_tagger (AudioTagging): The float model.
+        quantize (bool, optional): If True, the linear layers are dynamically quantized to int8. 
+            The convolutions of CNN14 are not supported by dynamic quantization and stay in float,
+            and they take most of the inference time: only fc1 and fc_audioset are quantized, which
+            makes the model smaller but barely faster. `python engine.py --quantize` measures the
+            speedup over the float model on this machine.
+        script (bool, optional): If True, the model is traced into a TorchScript graph, on an 
+            example of `example_seconds` seconds.
+        example_seconds (float, optional): Duration of the example used for tracing.
+        sample_rate (int, optional): Sample rate of the model input.
+
+    Returns:
+        AudioTagging: The optimized model. Its results should be checked with `check_top_labels`.
+    """
+    import torch
+
+    class InferenceModeModel(torch.nn.Module):
+        # Replaces the no_grad of AudioTagging.inference by the cheaper inference mode
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, audio, mixup_lambda=None):
+            with torch.inference_mode():
+                return self.model(audio)
+
+    model = audio_tagger.model.eval()
+    if quantize:
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if script:
+        example = torch.zeros((1, int(example_seconds * sample_rate)), device=audio_tagger.device)
+        with torch.inference_mode():
+            # The model returns a dict, hence the non strict tracing
+            model = torch.jit.trace(model, example, strict=False)
+
+    optimized_tagger = copy.copy(audio_tagger)
+    optimized_tagger.model = InferenceModeModel(model)
+    return optimized_tagger
+
+def check_top_labels(reference_tagger, optimized_tagger, audio_chunks, batch_size=1):
+    """
+    Compares the labels chosen with an optimized model to the ones of the float model, 
+    after the blacklist filtering of `extract_3best_labels`.
+
+    Args:
+        reference_tagger (AudioTagging): The float model.
+        optimized_tagger (AudioTagging): The optimized model, e.g. from `optimize_tagger`.
+        audio_chunks (list of tuple): Reference chunks, as returned by `read_audio`.
+        batch_size (int, optional): Batch size of the inference.
+
+    Returns:
+        dict: Proportion of chunks with the same best label, and mean proportion of 
+        common labels in the top 3.
+    """
+    from inference import perform_inference
+    from utils import extract_3best_labels
+
+    reference_labels = extract_3best_labels(perform_inference(reference_tagger, audio_chunks, batch_size))
+    optimized_labels = extract_3best_labels(perform_inference(optimized_tagger, audio_chunks, batch_size))
+
+    same_best = [reference[0] == optimized[0] for reference, optimized in zip(reference_labels, optimized_labels)]
+    common_top3 = [len(set(reference) & set(optimized)) / 3 for reference, optimized in zip(reference_labels, optimized_labels)]
+    return {
+        'chunks': len(reference_labels),
+        'top1_agreement': float(np.mean(same_best)) if same_best else 1.,
+        'top3_overlap': float(np.mean(common_top3)) if common_top3 else 1.,
+    }
+
+def benchmark_engine(audio_tagger, settings, n_chunks=64, chunk_seconds=10., batch_size=4, sample_rate=32000):
+    """
+    Measures the throughput of the engine for several numbers of workers and threads,
+    on random chunks.
+
+    Args:
+        audio_tagger (AudioTagging): The audio tagging model.
+        settings (list of tuple): (number of workers, threads per worker) to measure.
+        n_chunks (int, optional): Number of chunks tagged for each setting.
+        chunk_seconds (float, optional): Duration of the chunks.
+        batch_size (int, optional): Number of chunks per batch sent to a worker.
+        sample_rate (int, optional): Sample rate of the chunks.
+
+    Returns:
+        list of dict: Workers, threads, elapsed time and chunks per second of each setting.
+    """
+    rng = np.random.default_rng(0)
+    chunks = rng.uniform(-1, 1, (n_chunks, int(chunk_seconds * sample_rate))).astype(np.float32)
+    batches = [chunks[i:i + batch_size] for i in range(0, n_chunks, batch_size)]
+
+    results = []
+    for num_workers, threads_per_worker in settings:
+        with InferenceEngine(audio_tagger, num_workers, threads_per_worker) as engine:
+            # Warming up every worker before measuring
+            for _ in engine.map(batches[:num_workers]):
+                pass
+
+            start = time.perf_counter()
+            for _ in engine.map(batches):
+                pass
+            elapsed = time.perf_counter() - start
+
+        results.append({
+            'workers': num_workers,
+            'threads': threads_per_worker,
+            'seconds': elapsed,
+            'chunks_per_second': n_chunks / elapsed,
+        })
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures the chunks/s of the inference engine.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--chunks', type=int, default=64)
+    parser.add_argument('--chunk-seconds', type=float, default=10.)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--quantize', action='store_true', help='benchmark the int8 quantized model')
+    parser.add_argument('--script', action='store_true', help='benchmark the TorchScript traced model')
+    parser.add_argument('--reference', default=None,
+                        help='audio name in new_audios/ used to check the labels of the optimized model')
+    args = parser.parse_args()
+
+    from panns_inference import AudioTagging
+
+    tagger = AudioTagging(checkpoint_path=None, device='cpu')
+    benchmarked_tagger = tagger
+    if args.quantize or args.script:
+        benchmarked_tagger = optimize_tagger(tagger, args.quantize, args.script, args.chunk_seconds)
+
+    settings = [(workers, threads) for workers in args.workers for threads in args.threads]
+
+    results = benchmark_engine(benchmarked_tagger, settings, args.chunks, args.chunk_seconds, args.batch_size)
+    if benchmarked_tagger is tagger:
+        print('Workers    Threads    Seconds    Chunks/s')
+        for result in results:
+            print(f'{result["workers"]}    {result["threads"]}    {result["seconds"]:.2f}    {result["chunks_per_second"]:.2f}')
+    else:
+        # The float model in the same settings, so the gain of the optimization is measured, not assumed
+        reference_results = benchmark_engine(tagger, settings, args.chunks, args.chunk_seconds, args.batch_size)
+        print('Workers    Threads    Seconds    Chunks/s    Float chunks/s    Speedup')
+        for result, reference in zip(results, reference_results):
+            print(f'{result["workers"]}    {result["threads"]}    {result["seconds"]:.2f}    {result["chunks_per_second"]:.2f}    '
+                  f'{reference["chunks_per_second"]:.2f}    {result["chunks_per_second"] / reference["chunks_per_second"]:.2f}x')
+
+    # After the benchmark, as it runs the models in this process
+    if args.reference and benchmarked_tagger is not tagger:
+        from utils import read_audio
+
+        chunks, _ = read_audio(f'new_audios/{args.reference}.mp3', f'new_audios/{args.reference}.csv', 
+                               single_decode=True)
+        print(check_top_labels(tagger, benchmarked_tagger, chunks))
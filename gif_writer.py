@@ -0,0 +1,178 @@
+import os
+import numpy as np
+import PIL
+import PIL.Image
+from PIL import GifImagePlugin
+
+# Palette index reserved for the transparent pixels, the 255 other ones are the shared colors
+TRANSPARENT_INDEX = 255
+
+# The frames are encoded one by one with the legacy GifImagePlugin.getheader and getdata
+# helpers, which are not part of the main Pillow API. Checked with Pillow 9.1 (the first
+# version with Image.Dither) to 12.x
+MIN_PILLOW_VERSION = (9, 1)
+MAX_TESTED_PILLOW_MAJOR = 12
+
+def _check_pillow():
+    version = tuple(int(part) for part in PIL.__version__.split('.')[:2])
+    if version < MIN_PILLOW_VERSION:
+        raise ImportError(f'gif_writer needs Pillow >= {".".join(map(str, MIN_PILLOW_VERSION))}, '
+                          f'{PIL.__version__} is installed')
+    if not (hasattr(GifImagePlugin, 'getheader') and hasattr(GifImagePlugin, 'getdata')):
+        raise ImportError(f'Pillow {PIL.__version__} has no GifImagePlugin.getheader/getdata, gif_writer '
+                          f'is tested with Pillow {".".join(map(str, MIN_PILLOW_VERSION))} to {MAX_TESTED_PILLOW_MAJOR}.x')
+
+_check_pillow()
+
+
+def build_palette(image, colors=TRANSPARENT_INDEX):
+    """
+    Quantizes an image into a palette image that can be shared by every frame of a GIF.
+
+    The image should contain the colors of the whole animation, e.g. a strip of every
+    emoji that will be drawn. The last palette entry is left for the transparency.
+
+    Returns:
+        PIL.Image: A 'P' mode image with a 256 entries palette.
+    """
+    palette_image = image.convert('RGB').quantize(colors=colors)
+    entries = palette_image.getpalette()[:colors * 3]
+    # Padding with the first color, so the transparency entry is never a better match
+    # than a real color when frames are quantized
+    entries += entries[:3] * (256 - len(entries) // 3)
+    palette_image.putpalette(entries)
+    return palette_image
+
+def index_frame(frame, palette_image, alpha_threshold=1):
+    """
+    Returns the palette indexes of a frame, with the pixels whose alpha is below
+    `alpha_threshold` set to TRANSPARENT_INDEX.
+
+    With the default threshold only the fully transparent pixels are transparent, like
+    when Pillow saves RGBA frames: the (255, 255, 255, 1) background of the frames stays
+    white. A higher threshold also makes it transparent.
+
+    Args:
+        frame (PIL.Image): The frame.
+        palette_image (PIL.Image): Palette image returned by `build_palette`.
+        alpha_threshold (int, optional): Alpha under which a pixel is transparent.
+
+    Returns:
+        ndarray: (height, width) uint8 indexes, to give to `GifStreamWriter.append_indexes`.
+    """
+    indexes = np.array(frame.convert('RGB').quantize(palette=palette_image, dither=PIL.Image.Dither.NONE))
+    # The transparency entry is a copy of the first color
+    indexes[indexes == TRANSPARENT_INDEX] = 0
+
+    if frame.mode in ('RGBA', 'LA', 'PA'):
+        indexes[np.array(frame.getchannel('A')) < alpha_threshold] = TRANSPARENT_INDEX
+
+    return indexes
+
+
+class GifStreamWriter:
+    """
+    Writes an animated GIF frame by frame, so the frames don't have to be kept in memory.
+
+    Every frame is quantized to a single palette, computed once (from `palette_source`,
+    or from the first frame). Consecutive identical frames are written as one frame
+    whose duration is the sum of their durations.
+
+    Usage:
+        with GifStreamWriter('output/out.gif', palette_source) as writer:
+            for frame in frames:
+                writer.append(frame, duration=500)
+    """
+    def __init__(self, path, palette_source=None, loop=0, alpha_threshold=1):
+        self.path = path
+        self.loop = loop
+        self.alpha_threshold = alpha_threshold
+        self.frame_count = 0
+
+        self._palette_image = build_palette(palette_source) if palette_source is not None else None
+        self._pending = None
+        self._header_written = False
+        self._file = open(path, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        # On an error, the GIF may have no frame, which must not hide the error
+        self._close(raise_if_empty=exc_type is None)
+
+    @property
+    def palette_image(self):
+        """The shared palette, None until the first frame if no `palette_source` was given."""
+        return self._palette_image
+
+    def append(self, frame, duration):
+        """
+        Adds a frame to the animation.
+
+        Args:
+            frame (PIL.Image): The frame, the pixels whose alpha is below `alpha_threshold` are transparent.
+            duration (int): Display duration of the frame in milliseconds.
+        """
+        if self._palette_image is None:
+            self._palette_image = build_palette(frame)
+
+        self.append_indexes(index_frame(frame, self._palette_image, self.alpha_threshold), duration)
+
+    def append_indexes(self, indexes, duration):
+        """
+        Adds a frame already converted to palette indexes with `index_frame`, e.g. in
+        another process. The palette must be the one of this writer.
+        """
+        if self._pending is not None and np.array_equal(self._pending[0], indexes):
+            self._pending[1] += duration
+            return
+
+        self._write_pending()
+        self._pending = [indexes, duration]
+
+    def _write_pending(self):
+        if self._pending is None:
+            return
+
+        indexes, duration = self._pending
+        image = PIL.Image.fromarray(indexes, mode='P')
+        image.putpalette(self._palette_image.getpalette())
+
+        if not self._header_written:
+            header, _ = GifImagePlugin.getheader(image, info={'loop': self.loop})
+            self._file.write(b''.join(header))
+            self._header_written = True
+
+        # Disposal 2 clears the frame before the next one, as the transparent pixels
+        # would show the previous frame otherwise
+        fragments = GifImagePlugin.getdata(image, duration=duration, disposal=2, transparency=TRANSPARENT_INDEX)
+        self._file.write(b''.join(fragments))
+
+        self.frame_count += 1
+        self._pending = None
+
+    def close(self):
+        """
+        Writes the last frame and closes the file.
+
+        Raises:
+            ValueError: If no frame was added, in which case the file is removed.
+        """
+        self._close()
+
+    def _close(self, raise_if_empty=True):
+        if self._file.closed:
+            return
+
+        self._write_pending()
+        if not self._header_written:
+            self._file.close()
+            os.remove(self.path)
+            if raise_if_empty:
+                raise ValueError(f'No frame was added to {self.path}')
+            return
+
+        # GIF trailer
+        self._file.write(b';')
+        self._file.close()
@@ -0,0 +1,68 @@
+import argparse
+import re
+import subprocess
+import sys
+import time
+
+# Modules imported by main.py before any stage runs, which must stay cheap to import
+LIGHT_MODULES = ['profiling', 'mapping', 'inference', 'utils', 'inference_cache', 'detection', 'engine', 'visualization']
+# Modules that must only be imported by the stages using them
+HEAVY_MODULES = ['torch', 'matplotlib', 'librosa', 'pandas', 'panns_inference']
+
+
+def measure_imports(modules):
+    """
+    Imports modules in a new interpreter with `-X importtime`.
+
+    Returns:
+        tuple:
+            - total_ms (float): Cumulative import time of the given modules, in milliseconds.
+            - imported (set of str): Every module imported along the way.
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {", ".join(modules)}'],
+                             capture_output=True, text=True, check=True)
+
+    total_us = 0
+    imported = set()
+    # Lines of the form "import time: self [us] | cumulative | imported package"
+    for line in process.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)', line)
+        if match is None:
+            continue
+        cumulative, indent, name = int(match.group(2)), match.group(3), match.group(4)
+        imported.add(name)
+        # The top level imports have a single space of indentation
+        if len(indent) == 1 and name in modules:
+            total_us += cumulative
+
+    return total_us / 1000, imported
+
+def measure_help(script='main.py'):
+    """Returns the wall time of `script --help` in milliseconds."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, script, '--help'], capture_output=True, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Checks that the CLI starts without importing the heavy modules.')
+    parser.add_argument('--budget-ms', type=float, default=500., help='maximum import time of the light modules')
+    parser.add_argument('--help-budget-ms', type=float, default=1000., help='maximum wall time of main.py --help')
+    args = parser.parse_args()
+
+    import_ms, imported = measure_imports(LIGHT_MODULES)
+    help_ms = measure_help()
+    leaked = sorted(module for module in HEAVY_MODULES if module in imported)
+
+    print(f'Import of {", ".join(LIGHT_MODULES)}: {import_ms:.0f} ms (budget {args.budget_ms:.0f} ms)')
+    print(f'main.py --help: {help_ms:.0f} ms (budget {args.help_budget_ms:.0f} ms)')
+
+    failed = False
+    if leaked:
+        print(f'Heavy modules imported at startup: {", ".join(leaked)}')
+        failed = True
+    if import_ms > args.budget_ms or help_ms > args.help_budget_ms:
+        print('Over budget')
+        failed = True
+
+    sys.exit(1 if failed else 0)
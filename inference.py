@@ -1,6 +1,107 @@
 import numpy as np
-from panns_inference import labels
+from mapping import retrieve_class_labels
+from profiling import profiled
 
+# Same labels as `panns_inference.labels`, read without importing torch.
+# Built once: indexing this array is much cheaper than rebuilding it from the labels list
+labels = retrieve_class_labels()
+LABELS = np.array(labels)
+LABEL_INDEX = {label: i for i, label in enumerate(labels)}
+
+
+class TaggingResults:
+    """
+    Audio tagging scores of a sequence of chunks, stored as a single (n_chunks, n_classes) 
+    float32 matrix. The columns follow the class index of the `panns_inference` labels.
+
+    Indexing the results (`results[i]`) returns the sorted list of (label, score) tuples 
+    of the i-th chunk, like `retrieve_sorted_audio_tagging_results` does, but it is 
+    only built on demand.
+
+    The (n_chunks, embedding size) embeddings of the chunks can be kept alongside the scores.
+    """
+    def __init__(self, scores, embeddings=None):
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(-1, len(LABELS))
+        self.embeddings = embeddings
+
+    @classmethod
+    def from_sorted_results(cls, inferences):
+        """
+        Builds the results from lists of (label, score) tuples, as returned by 
+        `retrieve_sorted_audio_tagging_results`.
+        """
+        if isinstance(inferences, cls):
+            return inferences
+
+        scores = np.zeros((len(inferences), len(LABELS)), dtype=np.float32)
+        for i, chunk_results in enumerate(inferences):
+            for label, score in chunk_results:
+                scores[i, LABEL_INDEX[label]] = score
+
+        return cls(scores)
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __getitem__(self, i):
+        return self.sorted_results(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.sorted_results(i)
+
+    @staticmethod
+    def label(index):
+        """Returns the label (str) of a class index."""
+        return LABELS[index]
+
+    def top_k(self, k):
+        """
+        Returns the k best classes of every chunk, sorted by score in descending order.
+        The equal scores are in the order of their class index, as with a stable sort of
+        the whole row (`np.argsort(-scores, kind='stable')`).
+
+        Only the k best scores are sorted (`np.argpartition`), not the whole row.
+
+        Returns:
+            tuple: 
+                - indexes (ndarray): (n_chunks, k) array of class indexes.
+                - scores (ndarray): (n_chunks, k) array of the corresponding scores.
+        """
+        n_chunks, n_classes = self.scores.shape
+        k = min(k, n_classes)
+        if n_chunks == 0 or k == 0:
+            return np.zeros((n_chunks, k), dtype=np.intp), np.zeros((n_chunks, k), dtype=self.scores.dtype)
+
+        # The k-th best score of each row. The partition picks any of the classes tied with it,
+        # so the ones kept are chosen here: every better class, then the tied ones by index
+        partition = np.argpartition(-self.scores, k - 1, axis=1)[:, :k]
+        kth_scores = np.take_along_axis(self.scores, partition, axis=1).min(axis=1, keepdims=True)
+        better = self.scores > kth_scores
+        tied = self.scores == kth_scores
+        tied_kept = np.cumsum(tied, axis=1) <= k - np.count_nonzero(better, axis=1, keepdims=True)
+        # Exactly k classes per row, and nonzero returns them by row, then by index
+        indexes = np.nonzero(better | (tied & tied_kept))[1].reshape(n_chunks, k)
+        scores = np.take_along_axis(self.scores, indexes, axis=1)
+
+        order = np.argsort(-scores, axis=1, kind='stable')
+        return np.take_along_axis(indexes, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+    def sorted_indexes(self, i):
+        """Returns the class indexes of the i-th chunk sorted by score in descending order, the ties by index."""
+        return np.argsort(-self.scores[i], kind='stable')
+
+    def sorted_results(self, i):
+        """Returns the list of (label, score) tuples of the i-th chunk sorted by score in descending order."""
+        indexes = self.sorted_indexes(i)
+        return list(zip(LABELS[indexes], self.scores[i, indexes]))
+
+
+# Default maximum relative length difference inside a batch: the shorter chunks get at most
+# 2% of zero padding, which barely moves the time-pooled scores
+DEFAULT_LENGTH_TOLERANCE = 0.02
+
+@profiled(count=lambda result, args, kwargs: 1)
 def retrieve_sorted_audio_tagging_results(clipwise_output):
     """
     Returns a list of tuples containing audio tagging labels and their corresponding 
@@ -16,15 +117,69 @@ def retrieve_sorted_audio_tagging_results(clipwise_output):
 
     clipwise_output = np.reshape(clipwise_output, -1)
     sorted_indexes = np.argsort(clipwise_output)[::-1]
-    sorted_indexes = np.reshape(sorted_indexes, -1)
 
-    results = []
-    for k in range(len(clipwise_output)):
-        results.append((np.array(labels)[sorted_indexes[k]], clipwise_output[sorted_indexes[k]]))
+    return list(zip(LABELS[sorted_indexes], clipwise_output[sorted_indexes]))
+
+def _make_batches(lengths, batch_size, max_batch_samples=None, length_tolerance=DEFAULT_LENGTH_TOLERANCE):
+    """
+    Groups chunks into batches of similar lengths.
 
-    return results
+    The chunks are sorted by length, then consecutive chunks are put in the same batch 
+    as long as the batch is not full, the padded batch fits in `max_batch_samples` and 
+    the longest chunk is at most `length_tolerance` (relative) longer than the shortest one.
 
-def perform_inference(audio_tagger, audio_chunks):
+    Args:
+        lengths (list of int): Number of samples of each chunk.
+        batch_size (int): Maximum number of chunks in a batch.
+        max_batch_samples (int, optional): Maximum number of samples (batch size times 
+            padded length) in a batch. A chunk longer than this is put alone in its batch.
+        length_tolerance (float, optional): Maximum relative length difference inside a batch. 
+            With 0, only chunks of the exact same length are batched together, so no padding is needed.
+
+    Returns:
+        list of list of int: Indexes of the chunks of each batch.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+
+    batches = []
+    batch = []
+    for i in order:
+        if batch:
+            # Sorted by length, so the current chunk is the longest one of the batch
+            padded_length = lengths[i]
+            fits = (
+                len(batch) < batch_size
+                and padded_length <= lengths[batch[0]] * (1 + length_tolerance)
+                and (max_batch_samples is None or padded_length * (len(batch) + 1) <= max_batch_samples)
+            )
+            if not fits:
+                batches.append(batch)
+                batch = []
+        batch.append(i)
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+def _pad_batch(chunks):
+    """
+    Stacks chunks of different lengths in a (batch_size, samples) array, padding 
+    the shorter ones with zeros. The model can't mask the padding out, which is why
+    `_make_batches` bounds it with `length_tolerance`.
+
+    Returns:
+        ndarray: Array of shape (batch_size, longest chunk length).
+    """
+    batch = np.zeros((len(chunks), max(len(chunk) for chunk in chunks)), dtype=np.float32)
+    for row, chunk in enumerate(chunks):
+        batch[row, :len(chunk)] = chunk
+
+    return batch
+
+@profiled()
+def perform_inference(audio_tagger, audio_chunks, batch_size=1, max_batch_samples=None,
+                      length_tolerance=DEFAULT_LENGTH_TOLERANCE, keep_embeddings=False):
     """
     Performs inference on an array of audio chunks using an audio tagging model 
     and returns the results sorted by score for each chunk.
@@ -34,15 +189,63 @@ def perform_inference(audio_tagger, audio_chunks):
             the `panns_inference` library, used to process audio data.
         audio_chunks (list of tuple): List of audio chunks, where each chunk is a tuple 
             containing the audio data (ndarray) and its sample rate (int).
+        batch_size (int, optional): Maximum number of chunks sent to the model at once. Defaults to 1.
+        max_batch_samples (int, optional): Maximum number of samples (after padding) in a batch, 
+            to bound the memory used by the model. Defaults to no limit.
+        length_tolerance (float, optional): Maximum relative length difference between chunks 
+            of a same batch. Shorter chunks are padded with zeros, which slightly changes 
+            their scores: the default (0.02) keeps the padding under 2% of a chunk, 0. only
+            batches chunks of the exact same length, like the unbatched inference.
+        keep_embeddings (bool, optional): If True, the embeddings computed by the model are 
+            kept in the results. Defaults to False.
 
     Returns:
-        list of list of tuple: A list of sorted inference results for each chunk. 
-        Each inner list contains tuples of labels and scores.
+        TaggingResults: The scores of every chunk. `results[i]` is the sorted list of 
+        (label, score) tuples of the i-th chunk.
+    """
+    chunks = [chunk for chunk, _ in audio_chunks]
+    lengths = [len(chunk) for chunk in chunks]
+
+    scores = np.zeros((len(chunks), len(LABELS)), dtype=np.float32)
+    embeddings = None
+    for batch_indexes in _make_batches(lengths, batch_size, max_batch_samples, length_tolerance):
+        batch = _pad_batch([chunks[i] for i in batch_indexes])
+        clipwise_output, embedding = audio_tagger.inference(batch)
+        scores[batch_indexes] = clipwise_output
+
+        if keep_embeddings:
+            if embeddings is None:
+                embeddings = np.zeros((len(chunks), embedding.shape[1]), dtype=np.float32)
+            embeddings[batch_indexes] = embedding
+
+    return TaggingResults(scores, embeddings)
+
+def iter_inference(audio_tagger, audio_chunks, batch_size=1, **inference_kwargs):
+    """
+    Same as `perform_inference`, but consumes the chunks from any iterable (e.g. 
+    `utils.iter_audio_chunks`) and yields the results of each chunk as soon as its batch 
+    is done, so neither the chunks nor the results all have to be in memory.
+
+    Args:
+        audio_tagger (AudioTagging): The audio tagging model.
+        audio_chunks (iterable of tuple): Audio chunks, tuples of the audio data and its sample rate.
+        batch_size (int, optional): Number of consecutive chunks sent to `perform_inference` at once.
+        **inference_kwargs: Other arguments of `perform_inference`.
+
+    Yields:
+        TaggingResults: The results of a single chunk, in the order of the chunks.
     """
-    inference_results = []
-    for chunk, _ in audio_chunks:
-        clipwise_output, _ = audio_tagger.inference(np.reshape(chunk, (1, -1)))
-        chunk_inference_result = retrieve_sorted_audio_tagging_results(clipwise_output)
-        inference_results.append(chunk_inference_result)
+    window = []
+    for audio_chunk in audio_chunks:
+        window.append(audio_chunk)
+        if len(window) == batch_size:
+            yield from _split_results(perform_inference(audio_tagger, window, batch_size, **inference_kwargs))
+            window = []
+
+    if window:
+        yield from _split_results(perform_inference(audio_tagger, window, batch_size, **inference_kwargs))
 
-    return inference_results
\ No newline at end of file
+def _split_results(results):
+    for i in range(len(results)):
+        embeddings = results.embeddings[i:i + 1] if results.embeddings is not None else None
+        yield TaggingResults(results.scores[i:i + 1], embeddings)
@@ -0,0 +1,259 @@
+import hashlib
+import os
+import numpy as np
+from inference import LABELS, TaggingResults, perform_inference
+from utils import read_audio, read_metadata
+
+DEFAULT_CACHE_DIR = './cache/inference'
+# Checkpoint downloaded by panns_inference when checkpoint_path is None
+DEFAULT_CHECKPOINT_ID = 'Cnn14_mAP=0.431'
+
+
+class InferenceCache:
+    """
+    On-disk cache of the model outputs of audio chunks.
+
+    The chunks of a recording are stored together, in three .npy files named after a hash
+    of the audio file content, the sample rate and the model checkpoint: the (n_chunks, 2)
+    offsets and durations, the (n_chunks, n_classes) float32 scores and, optionally, the
+    (n_chunks, embedding size) float32 embeddings (NaN rows for the chunks cached without
+    theirs). When the cache grows over `max_bytes`, the least recently used recordings are
+    removed.
+
+    Usage:
+        key = cache.key(cache.hash_file(path_audio), None, DEFAULT_CHECKPOINT_ID)
+        scores, embeddings, found = cache.get(key, audio_times)
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._file_hashes = {}
+
+        os.makedirs(cache_dir, exist_ok=True)
+        # Size and last use of each recording, listed once: put and evict keep them up to date
+        self._entries = {}
+        for file_name in os.listdir(cache_dir):
+            if not file_name.endswith('.npy'):
+                continue
+            key, kind = file_name.split('.')[:2]
+            path = os.path.join(cache_dir, file_name)
+            entry = self._entries.setdefault(key, {'bytes': 0, 'last_use': 0.})
+            entry['bytes'] += os.path.getsize(path)
+            if kind == 'times':
+                entry['last_use'] = os.path.getmtime(path)
+        self.current_bytes = sum(entry['bytes'] for entry in self._entries.values())
+
+    def _path(self, key, kind):
+        return os.path.join(self.cache_dir, f'{key}.{kind}.npy')
+
+    def hash_file(self, path, block_size=1024 * 1024):
+        """Returns the SHA-256 of a file content, computed once per file version."""
+        stat = os.stat(path)
+        file_id = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if file_id not in self._file_hashes:
+            file_hash = hashlib.sha256()
+            with open(path, 'rb') as file:
+                for block in iter(lambda: file.read(block_size), b''):
+                    file_hash.update(block)
+            self._file_hashes[file_id] = file_hash.hexdigest()
+
+        return self._file_hashes[file_id]
+
+    @staticmethod
+    def key(file_hash, sample_rate, checkpoint_id):
+        """Returns the key of a recording. A None sample rate means the native sample rate."""
+        recording_id = f'{file_hash}|{sample_rate or "native"}|{checkpoint_id}'
+        return hashlib.sha256(recording_id.encode()).hexdigest()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _load(self, key):
+        """Returns the (times, scores, embeddings) of a recording, or None if it is not cached."""
+        try:
+            times = np.load(self._path(key, 'times'))
+            scores = np.load(self._path(key, 'scores'), mmap_mode='r')
+            embeddings_path = self._path(key, 'embeddings')
+            embeddings = np.load(embeddings_path, mmap_mode='r') if os.path.exists(embeddings_path) else None
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # A write interrupted between the files leaves arrays of different lengths
+        if len(scores) != len(times) or (embeddings is not None and len(embeddings) != len(times)):
+            return None
+        return times, scores, embeddings
+
+    @staticmethod
+    def _rows(cached_times, audio_times):
+        """Returns the cached row of each chunk, -1 for the chunks not cached."""
+        row_index = {tuple(time): row for row, time in enumerate(cached_times.tolist())}
+        return np.array([row_index.get((float(offset), float(duration)), -1) for offset, duration in audio_times],
+                        dtype=np.int64)
+
+    def count(self, key, audio_times):
+        """Returns the number of chunks of a recording that are cached, without marking it as used."""
+        entry = self._load(key)
+        if entry is None:
+            return 0
+        return int(np.count_nonzero(self._rows(entry[0], audio_times) >= 0))
+
+    def get(self, key, audio_times, with_embeddings=False):
+        """
+        Returns the cached outputs of chunks of a recording.
+
+        Args:
+            key (str): Key of the recording, from `key`.
+            audio_times (list of tuples): Offsets and durations of the chunks.
+            with_embeddings (bool, optional): If True, the embeddings are returned too, and a
+                chunk cached without its embedding is a miss.
+
+        Returns:
+            tuple:
+                - scores (ndarray): (n_chunks, n_classes) scores, zeros for the chunks not found.
+                - embeddings (ndarray): (n_chunks, embedding size) embeddings, zeros for the chunks
+                  not found. None without `with_embeddings`, or if no embedding was found.
+                - found (ndarray): (n_chunks,) boolean mask of the chunks found.
+        """
+        scores = np.zeros((len(audio_times), len(LABELS)), dtype=np.float32)
+        entry = self._load(key)
+        if entry is None:
+            return scores, None, np.zeros(len(audio_times), dtype=bool)
+
+        cached_times, cached_scores, cached_embeddings = entry
+        rows = self._rows(cached_times, audio_times)
+        found = rows >= 0
+
+        embeddings = None
+        if with_embeddings:
+            if cached_embeddings is None:
+                found[:] = False
+            else:
+                found[found] &= ~np.isnan(cached_embeddings[rows[found], 0])
+                if found.any():
+                    embeddings = np.zeros((len(audio_times), cached_embeddings.shape[1]), dtype=np.float32)
+                    embeddings[found] = cached_embeddings[rows[found]]
+        scores[found] = cached_scores[rows[found]]
+
+        # Keeping track of the use, for the eviction
+        if found.any():
+            os.utime(self._path(key, 'times'))
+            self._entries[key]['last_use'] = os.path.getmtime(self._path(key, 'times'))
+        return scores, embeddings, found
+
+    def put(self, key, audio_times, scores, embeddings=None):
+        """
+        Adds the outputs of chunks to the entry of their recording, replacing the chunks
+        already cached. The entry is rewritten as a whole.
+
+        Args:
+            key (str): Key of the recording, from `key`.
+            audio_times (list of tuples): Offsets and durations of the chunks.
+            scores (ndarray): (n_chunks, n_classes) scores.
+            embeddings (ndarray, optional): (n_chunks, embedding size) embeddings.
+        """
+        times = np.asarray(audio_times, dtype=np.float64).reshape(-1, 2)
+        scores = np.asarray(scores, dtype=np.float32)
+        if embeddings is not None:
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+
+        entry = self._load(key)
+        if entry is not None:
+            cached_times, cached_scores, cached_embeddings = entry
+            rows = self._rows(cached_times, times)
+            new = rows < 0
+
+            all_times = np.concatenate([cached_times, times[new]])
+            all_scores = np.concatenate([cached_scores, scores[new]])
+            all_scores[rows[~new]] = scores[~new]
+
+            all_embeddings = None
+            if cached_embeddings is not None or embeddings is not None:
+                size = embeddings.shape[1] if embeddings is not None else cached_embeddings.shape[1]
+                all_embeddings = np.full((len(all_times), size), np.nan, dtype=np.float32)
+                if cached_embeddings is not None:
+                    all_embeddings[:len(cached_times)] = cached_embeddings
+                if embeddings is not None:
+                    all_embeddings[rows[~new]] = embeddings[~new]
+                    all_embeddings[len(cached_times):] = embeddings[new]
+            times, scores, embeddings = all_times, all_scores, all_embeddings
+
+        arrays = {'scores': scores}
+        if embeddings is not None:
+            arrays['embeddings'] = embeddings
+        # Written last, the times index the rows of the other files
+        arrays['times'] = times
+
+        previous_bytes = self._entries.get(key, {'bytes': 0})['bytes']
+        entry_bytes = 0
+        for kind, array in arrays.items():
+            path = self._path(key, kind)
+            with open(f'{path}.tmp', 'wb') as file:
+                np.save(file, array)
+            os.replace(f'{path}.tmp', path)
+            entry_bytes += os.path.getsize(path)
+
+        self._entries[key] = {'bytes': entry_bytes, 'last_use': os.path.getmtime(self._path(key, 'times'))}
+        self.current_bytes += entry_bytes - previous_bytes
+
+        if self.current_bytes > self.max_bytes:
+            self.evict(keep=key)
+
+    def evict(self, target_ratio=0.9, keep=None):
+        """
+        Removes the least recently used recordings until the cache is under `target_ratio`
+        of its maximum size. The recording `keep` is never removed.
+        """
+        for key in sorted(self._entries, key=lambda key: self._entries[key]['last_use']):
+            if self.current_bytes <= self.max_bytes * target_ratio:
+                break
+            if key == keep:
+                continue
+            for kind in ('times', 'scores', 'embeddings'):
+                if os.path.exists(self._path(key, kind)):
+                    os.remove(self._path(key, kind))
+            self.current_bytes -= self._entries.pop(key)['bytes']
+
+
+def cached_inference(cache, load_audio_tagger, path_audio, path_metadata, desired_sample_rate=None,
+                     checkpoint_id=DEFAULT_CHECKPOINT_ID, keep_embeddings=False, metadata_kwargs=None, **inference_kwargs):
+    """
+    Same as reading the audio with `read_audio` and calling `perform_inference`, but the
+    outputs of the chunks already in the cache are reused. The audio is only decoded, and
+    the model only loaded, if some chunks are missing from the cache.
+
+    Args:
+        cache (InferenceCache): The cache.
+        load_audio_tagger (callable): Function without argument returning the audio tagging model.
+        path_audio (str): Path to the audio file.
+        path_metadata (str): Path to the metadata CSV file.
+        desired_sample_rate (int, optional): Desired sample rate for the audio. Defaults to the native sample rate.
+        checkpoint_id (str, optional): Identifier of the model checkpoint, part of the cache key.
+        keep_embeddings (bool, optional): If True, the embeddings are kept in the results (and in the cache).
+        metadata_kwargs (dict, optional): Options of `read_metadata`.
+        **inference_kwargs: Other arguments of `perform_inference` (e.g. batch_size).
+
+    Returns:
+        tuple:
+            - inferences (TaggingResults): The scores of every chunk.
+            - audio_times (list of tuples): The offsets and durations of the chunks.
+    """
+    metadata_kwargs = metadata_kwargs or {}
+    audio_times = read_metadata(path_metadata, **metadata_kwargs)
+    key = cache.key(cache.hash_file(path_audio), desired_sample_rate, checkpoint_id)
+
+    scores, embeddings, found = cache.get(key, audio_times, with_embeddings=keep_embeddings)
+    missing = np.flatnonzero(~found)
+
+    if len(missing):
+        audio_chunks, _ = read_audio(path_audio, path_metadata, desired_sample_rate, single_decode=True, **metadata_kwargs)
+        results = perform_inference(load_audio_tagger(), [audio_chunks[i] for i in missing],
+                                    keep_embeddings=keep_embeddings, **inference_kwargs)
+
+        scores[missing] = results.scores
+        if keep_embeddings:
+            if embeddings is None:
+                embeddings = np.zeros((len(audio_times), results.embeddings.shape[1]), dtype=np.float32)
+            embeddings[missing] = results.embeddings
+        cache.put(key, [audio_times[i] for i in missing], results.scores, results.embeddings)
+
+    return TaggingResults(scores, embeddings), audio_times
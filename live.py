@@ -0,0 +1,300 @@
+import argparse
+import sys
+import threading
+import time
+from collections import deque
+import numpy as np
+from inference import LABEL_INDEX, TaggingResults
+from utils import extract_3best_labels
+
+# Sample rate expected by AudioTagging
+LIVE_SAMPLE_RATE = 32000
+
+
+class RingBuffer:
+    """
+    Last `capacity` samples of a stream, in a fixed-size circular array. The samples are
+    addressed by their absolute position in the stream.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=np.float32)
+        # Number of samples written since the start of the stream
+        self.written = 0
+
+    def write(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        length = len(block)
+        # Only the end of a block longer than the buffer is kept
+        block = block[-self.capacity:]
+
+        start = (self.written + length - len(block)) % self.capacity
+        first_part = min(len(block), self.capacity - start)
+        self.buffer[start:start + first_part] = block[:first_part]
+        self.buffer[:len(block) - first_part] = block[first_part:]
+        self.written += length
+
+    def read(self, start, length):
+        """
+        Returns a copy of `length` samples from the absolute position `start`.
+
+        Raises:
+            ValueError: If the samples were not written yet, or were already overwritten.
+        """
+        if start < self.written - self.capacity or start + length > self.written:
+            raise ValueError(f'Samples {start} to {start + length} are not in the buffer '
+                             f'({max(self.written - self.capacity, 0)} to {self.written})')
+
+        index = start % self.capacity
+        if index + length <= self.capacity:
+            return self.buffer[index:index + length].copy()
+        return np.concatenate([self.buffer[index:], self.buffer[:index + length - self.capacity]])
+
+
+def file_source(path, block_seconds=0.1, realtime=True, sample_rate=LIVE_SAMPLE_RATE):
+    """
+    Yields the blocks of an audio file, as a stand-in for a live stream.
+
+    Args:
+        path (str): Path to the audio file.
+        block_seconds (float, optional): Duration of the blocks.
+        realtime (bool, optional): If True, each block is yielded when it would have been
+            recorded. Otherwise the blocks come as fast as they are consumed, which shows
+            how the tagger behaves when it falls behind.
+        sample_rate (int, optional): Sample rate of the blocks.
+    """
+    import librosa as lb
+
+    audio, _ = lb.load(path, sr=sample_rate)
+    block_samples = int(block_seconds * sample_rate)
+    start_time = time.perf_counter()
+    for start in range(0, len(audio), block_samples):
+        if realtime:
+            delay = start_time + (start + block_samples) / sample_rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield audio[start:start + block_samples]
+
+def pipe_source(stream, block_seconds=0.1, sample_rate=LIVE_SAMPLE_RATE):
+    """
+    Yields the blocks of a raw mono 16 bits PCM stream, e.g. the standard input fed by
+    `arecord -f S16_LE -c 1 -r 32000` (microphone) or `ffmpeg -i URL -f s16le -ac 1 -ar 32000 -`.
+
+    Args:
+        stream (file): Binary stream, read until its end.
+        block_seconds (float, optional): Duration of the blocks.
+        sample_rate (int, optional): Sample rate of the stream.
+    """
+    block_bytes = int(block_seconds * sample_rate) * 2
+    while True:
+        data = stream.read(block_bytes)
+        if not data:
+            return
+        # An odd number of bytes can only happen at the end of the stream
+        data = data[:len(data) // 2 * 2]
+        yield np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768
+
+
+class LiveTagger:
+    """
+    Tags a live audio stream on overlapping windows.
+
+    A thread reads the blocks of the source into a ring buffer, while `run` tags the last
+    `window_seconds` of audio every `hop_seconds`. When the inference is slower than the
+    hop, the windows that became due in the meantime are either dropped, only the most
+    recent one being tagged ('drop' policy), or tagged together in a single batch
+    ('coalesce' policy, at most `max_batch` windows, the older ones being dropped).
+    Either way, the latency stays bounded.
+
+    The latency of a window is the time between the arrival of its last block and
+    the call of `on_result` with its labels.
+
+    Usage:
+        live = LiveTagger(AudioTagging(checkpoint_path=None, device='cpu'), on_result=print)
+        live.run(file_source('new_audios/A_1.mp3'))
+        print(live.metrics())
+    """
+    def __init__(self, audio_tagger, window_seconds=5., hop_seconds=1., policy='drop', max_batch=4,
+                 buffer_seconds=60., sample_rate=LIVE_SAMPLE_RATE, on_result=None):
+        if policy not in ('drop', 'coalesce'):
+            raise ValueError(f"Unknown policy '{policy}', expected 'drop' or 'coalesce'")
+        if policy == 'coalesce' and max_batch < 1:
+            raise ValueError(f'max_batch must be at least 1, got {max_batch}')
+        # The oldest window of a batch starts (max_batch - 1) hops before the last one, which
+        # can itself end up to a hop before the last sample written
+        batch_windows = max_batch if policy == 'coalesce' else 1
+        if buffer_seconds < window_seconds + batch_windows * hop_seconds:
+            raise ValueError(f'The buffer ({buffer_seconds} s) must hold a window and {batch_windows} hops '
+                             f'({window_seconds + batch_windows * hop_seconds} s)')
+
+        self.audio_tagger = audio_tagger
+        self.sample_rate = sample_rate
+        self.window_samples = int(window_seconds * sample_rate)
+        self.hop_samples = int(hop_seconds * sample_rate)
+        self.policy = policy
+        self.max_batch = batch_windows
+        self.on_result = on_result
+        self.ring_buffer = RingBuffer(int(buffer_seconds * sample_rate))
+
+        self._condition = threading.Condition()
+        # (position of the end, arrival time) of the blocks not yet tagged
+        self._arrivals = deque()
+        self._finished = False
+        self._error = None
+
+        self.windows = 0
+        self.dropped = 0
+        self.latencies = deque(maxlen=1000)
+        self.inference_times = deque(maxlen=1000)
+
+    def _read(self, source):
+        try:
+            for block in source:
+                with self._condition:
+                    self.ring_buffer.write(block)
+                    self._arrivals.append((self.ring_buffer.written, time.perf_counter()))
+                    self._condition.notify()
+        except Exception as error:
+            self._error = error
+        finally:
+            with self._condition:
+                self._finished = True
+                self._condition.notify()
+
+    def _arrival_time(self, position):
+        """Returns the arrival time of the block containing a sample position, positions being asked in order."""
+        while len(self._arrivals) > 1 and self._arrivals[0][0] < position:
+            self._arrivals.popleft()
+        return self._arrivals[0][1]
+
+    def _tag(self, batch, window_ends, arrival_times):
+        start = time.perf_counter()
+        clipwise_output, _ = self.audio_tagger.inference(batch)
+        self.inference_times.append(time.perf_counter() - start)
+
+        results = TaggingResults(clipwise_output)
+        for scores, labels3, window_end, arrival_time in zip(results.scores, extract_3best_labels(results),
+                                                             window_ends, arrival_times):
+            latency = time.perf_counter() - arrival_time
+            self.windows += 1
+            self.latencies.append(latency)
+
+            if self.on_result is not None:
+                self.on_result({
+                    'offset': (window_end - self.window_samples) / self.sample_rate,
+                    'duration': self.window_samples / self.sample_rate,
+                    'labels': labels3,
+                    'scores': [float(scores[LABEL_INDEX[label]]) for label in labels3],
+                    'latency': latency,
+                })
+
+    def run(self, source):
+        """
+        Tags the stream of a source until its end. The results are given to `on_result`
+        from this thread, so the display can be updated from it.
+
+        Args:
+            source (iterable): Blocks of float32 samples at `sample_rate`, e.g. from
+                `file_source` or `pipe_source`.
+
+        Returns:
+            dict: The metrics, see `metrics`.
+        """
+        reader = threading.Thread(target=self._read, args=(source,), daemon=True)
+        reader.start()
+
+        next_end = self.window_samples
+        while True:
+            with self._condition:
+                while self.ring_buffer.written < next_end and not self._finished:
+                    self._condition.wait()
+                written = self.ring_buffer.written
+                if written < next_end:
+                    break
+
+                due_ends = list(range(next_end, written + 1, self.hop_samples))
+                window_ends = due_ends[-self.max_batch:]
+                self.dropped += len(due_ends) - len(window_ends)
+
+                # Read under the lock, as the reader could overwrite the oldest samples
+                batch = np.stack([self.ring_buffer.read(end - self.window_samples, self.window_samples)
+                                  for end in window_ends])
+                arrival_times = [self._arrival_time(end) for end in window_ends]
+
+            next_end = due_ends[-1] + self.hop_samples
+            self._tag(batch, window_ends, arrival_times)
+
+        reader.join()
+        if self._error is not None:
+            raise self._error
+        return self.metrics()
+
+    def metrics(self):
+        """
+        Returns the number of tagged and dropped windows, and the statistics in seconds of
+        the latency and of the inference time of the last 1000 windows.
+        """
+        latencies = np.array(self.latencies)
+        inference_times = np.array(self.inference_times)
+        return {
+            'windows': self.windows,
+            'dropped': self.dropped,
+            'latency_mean': float(latencies.mean()) if len(latencies) else None,
+            'latency_p50': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'latency_p95': float(np.percentile(latencies, 95)) if len(latencies) else None,
+            'latency_max': float(latencies.max()) if len(latencies) else None,
+            'inference_mean': float(inference_times.mean()) if len(inference_times) else None,
+        }
+
+
+def visugaspard_display(min_value=10, max_value=40, visualization=None):
+    """
+    Returns an `on_result` callback showing the labels of the last window in the
+    visuGaspard display, the emoji size following the score.
+    """
+    from visuGaspard import LiveDisplay
+
+    display = LiveDisplay(visualization, full_value=max_value)
+
+    def on_result(result):
+        display.update({label: min_value + (max_value - min_value) * score
+                        for label, score in zip(result['labels'], result['scores'])})
+
+    return on_result
+
+def print_result(result):
+    print(f'{result["offset"]:.1f}    {result["latency"] * 1000:.0f}    '
+          f'{result["labels"][0]}    {result["labels"][1]}    {result["labels"][2]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tags a live audio stream on overlapping windows.')
+    parser.add_argument('source', help="audio file, or '-' for raw mono 16 bits PCM at 32 kHz on the standard input "
+                                       "(e.g. arecord -f S16_LE -c 1 -r 32000 | python live.py -)")
+    parser.add_argument('--window', type=float, default=5., help='duration of the windows in seconds')
+    parser.add_argument('--hop', type=float, default=1., help='time between two windows in seconds')
+    parser.add_argument('--policy', choices=['drop', 'coalesce'], default='drop',
+                        help='what to do with the windows that became due while the model was busy')
+    parser.add_argument('--max-batch', type=int, default=4, help='maximum windows tagged together with coalesce')
+    parser.add_argument('--fast', action='store_true', help='read the audio file as fast as possible, not in real time')
+    parser.add_argument('--display', action='store_true', help='show the labels in the visuGaspard display')
+    args = parser.parse_args()
+
+    from panns_inference import AudioTagging
+
+    tagger = AudioTagging(checkpoint_path=None, device='cpu')
+
+    if args.display:
+        display = visugaspard_display()
+        def on_result(result):
+            print_result(result)
+            display(result)
+    else:
+        on_result = print_result
+
+    source = pipe_source(sys.stdin.buffer) if args.source == '-' else file_source(args.source, realtime=not args.fast)
+    live = LiveTagger(tagger, args.window, args.hop, args.policy, args.max_batch, on_result=on_result)
+
+    print('Offset    Latency (ms)    Label1    Label2    Label3')
+    metrics = live.run(source)
+    print(metrics)
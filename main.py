@@ -1,32 +1,226 @@
-from inference import perform_inference
-from utils import read_audio
-from visualization import Visualization
-from panns_inference import AudioTagging
-from utils import extract_best_scores, extract_3best_labels
-import sys
+import argparse
+import os
+from contextlib import ExitStack
 
-audio_name = sys.argv[1] if len(sys.argv) > 1 else 'A_1'
-path_metadata = f'new_audios/{audio_name}.csv'
-path_audio = f'new_audios/{audio_name}.mp3'
+# The arguments are parsed before anything else is imported: the heavy modules (torch,
+# librosa, pandas) are only imported by the stages that use them, so --help, --dry-run
+# and a fully cached run never load them. The guard keeps the GIF rendering processes,
+# which import this module, from running it.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tags the chunks of an audio file and renders them as emoji GIFs.')
+    parser.add_argument('audio_name', nargs='?', default='A_1', help='name of the .mp3 and .csv files in new_audios/')
+    parser.add_argument('--no-cache', action='store_true', help='always decode the audio and run the model')
+    parser.add_argument('--cache-dir', default='./cache/inference')
+    parser.add_argument('--stream', action='store_true', 
+                        help='decode, tag and print the chunks one by one (bounded memory, no cache). The GIFs '
+                             'are still rendered once the whole recording is tagged, from the labels kept')
+    parser.add_argument('--framewise', action='store_true', 
+                        help='run the sound event detection model once over the whole file and pool it over the chunks')
+    parser.add_argument('--time-format', default=None, help="format of the metadata times, e.g. '%%H:%%M:%%S'")
+    parser.add_argument('--keep-edges', action='store_true', help='also tag the first and last rows of the metadata')
+    parser.add_argument('--workers', type=int, default=1, help='number of inference processes')
+    parser.add_argument('--threads', type=int, default=None, help='torch threads of each inference process')
+    parser.add_argument('--quantize', action='store_true',
+                        help='quantize the linear layers to int8, the convolutions stay float (measure the gain '
+                             'and check the labels with engine.py --quantize --reference first)')
+    parser.add_argument('--script', action='store_true', help='use the TorchScript traced model')
+    parser.add_argument('--profile', metavar='TRACE_PATH', default=None,
+                        help='time each stage, print a summary and write a Chrome trace (speedscope compatible) JSON')
+    parser.add_argument('--render-workers', type=int, default=1,
+                        help='number of processes drawing the frames of long GIFs')
+    parser.add_argument('--corpus', metavar='DIR', default=None,
+                        help='also store the scores and embeddings of the chunks in a corpus, searched with embedding_index.py')
+    parser.add_argument('--segments', action='store_true',
+                        help='smooth the scores and render one frame per segment of the same label, not per chunk')
+    parser.add_argument('--smooth-window', type=int, default=5, help='odd number of chunks of the median filter')
+    parser.add_argument('--min-dwell', type=float, default=0., help='minimum duration of a segment in seconds')
+    parser.add_argument('--results', metavar='DIR', default=None,
+                        help='write the results of the chunks in a columnar file in DIR instead of printing them')
+    parser.add_argument('--results-format', choices=['parquet', 'columns'], default=None,
+                        help='parquet (needs pyarrow, the default when it is installed) or a directory of raw columns')
+    parser.add_argument('--full-scores', action='store_true', help='also write the score of every class')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print the chunks to tag and how many are cached, without loading the model or rendering')
+    args = parser.parse_args()
+    if args.segments and args.stream:
+        parser.error('--segments needs the scores of every chunk, it cannot be used with --stream')
+    if args.corpus and args.stream:
+        parser.error('--corpus stores the embeddings of every chunk, it cannot be used with --stream')
+    if args.framewise and args.stream:
+        parser.error('--framewise runs the detection model over the whole file, it cannot be used with --stream')
+    if args.framewise:
+        # These options are the ones of the audio tagging model, the detection model runs in this process
+        tagging_options = {'--workers': args.workers > 1, '--threads': args.threads is not None,
+                           '--quantize': args.quantize, '--script': args.script}
+        tagging_options = [option for option, used in tagging_options.items() if used]
+        if tagging_options:
+            parser.error(f'{", ".join(tagging_options)} cannot be used with --framewise')
 
-chunks, times = read_audio(path_audio, path_metadata)
+    import profiling
+    from inference_cache import InferenceCache, cached_inference, DEFAULT_CHECKPOINT_ID
+    from utils import read_metadata, extract_best_scores, extract_3best_labels
 
-tagger = AudioTagging(checkpoint_path=None, device='cpu')
+    if args.profile:
+        profiling.enable()
 
-inferences = perform_inference(tagger, chunks)
-visu = Visualization()
+    audio_name = args.audio_name
+    path_metadata = f'new_audios/{audio_name}.csv'
+    path_audio = f'new_audios/{audio_name}.mp3'
+    metadata_kwargs = {'time_format': args.time_format, 'drop_edges': not args.keep_edges}
+    # The optimized models don't give exactly the scores of the float one, so they have their own cache entries
+    checkpoint_id = DEFAULT_CHECKPOINT_ID + ('+int8' if args.quantize else '') + ('+traced' if args.script else '')
 
-duration = [duration for _, duration in times]
-offsets = [offset for offset, _ in times]
+    def load_tagger():
+        from panns_inference import AudioTagging
+        from engine import InferenceEngine, optimize_tagger
 
-scores, best_labels = extract_best_scores(inferences)
-best_labels3 = extract_3best_labels(inferences)
+        tagger = AudioTagging(checkpoint_path=None, device='cpu')
+        if args.workers > 1:
+            # Without an explicit thread count, the cores are split between the processes.
+            # Tracing runs the model, so the optimization is done by each worker after the fork
+            threads = args.threads or max(1, os.cpu_count() // args.workers)
+            prepare_tagger = None
+            if args.quantize or args.script:
+                prepare_tagger = lambda worker_tagger: optimize_tagger(worker_tagger, args.quantize, args.script)
+            return resources.enter_context(InferenceEngine(tagger, args.workers, threads, prepare_tagger=prepare_tagger))
+        if args.quantize or args.script:
+            tagger = optimize_tagger(tagger, args.quantize, args.script)
+        return tagger
 
-print('Offset    Duration    Score    Label1    Label2    Label3')
-for i in range(len(best_labels)):
-    print(f'{offsets[i]}    {duration[i]}    {scores[i]}    {best_labels3[i][0]}    {best_labels3[i][1]}    {best_labels3[i][2]}')
+    def print_row(offset, duration, score, labels3):
+        print(f'{offset}    {duration}    {score}    {labels3[0]}    {labels3[1]}    {labels3[2]}')
 
-visu.create_emoji_circle_detailled_gif(best_labels3, output_name=audio_name)
-visu.create_emoji_gif(best_labels, output_name=audio_name)
-visu.create_emoji_circle_gif(best_labels, output_name=audio_name)
-visu.create_diagonal_emoji_gif(best_labels3, output_name=audio_name)
+    if args.dry_run:
+        times = read_metadata(path_metadata, **metadata_kwargs)
+        mode = 'stream' if args.stream else 'framewise' if args.framewise else 'no cache' if args.no_cache else 'cache'
+        print(f'{audio_name}: {len(times)} chunks, mode: {mode}')
+
+        if mode == 'cache':
+            cache = InferenceCache(args.cache_dir)
+            cached = cache.count(cache.key(cache.hash_file(path_audio), None, checkpoint_id), times)
+            print(f'{cached} chunks cached, {len(times) - cached} to decode and tag')
+
+        raise SystemExit
+
+    # Closes the inference processes and the results file, even if a stage fails
+    with ExitStack() as resources:
+        from visualization import Visualization
+
+        results_writer = None
+        if args.results:
+            from results_writer import ResultsWriter, results_path
+
+            os.makedirs(args.results, exist_ok=True)
+            # Closed on an error too, so the rows written stay readable (Parquet footer, manifest)
+            results_writer = resources.enter_context(
+                ResultsWriter(results_path(args.results, audio_name, args.results_format),
+                              args.results_format, full_scores=args.full_scores))
+
+        if args.stream:
+            import numpy as np
+            from inference import TaggingResults, iter_inference
+            from utils import iter_audio_chunks
+
+            tagger = load_tagger()
+            visu = Visualization(render_workers=args.render_workers)
+
+            if results_writer is None:
+                print('Offset    Duration    Score    Label1    Label2    Label3')
+
+            # Only the times and the labels are kept, the chunks and scores are dropped once printed.
+            # The GIFs are rendered from the labels at the end: their palette is made of the emojis
+            # drawn, and the circle styles place each emoji from the number of frames
+            times = []
+            def stream_chunks():
+                for audio_chunk, audio_time in iter_audio_chunks(path_audio, path_metadata, **metadata_kwargs):
+                    times.append(audio_time)
+                    yield audio_chunk
+
+            best_labels = []
+            best_labels3 = []
+            # Scores of the chunks not yet given to the results writer, appended by 256 chunks
+            # rather than one by one
+            pending_scores = []
+            for i, result in enumerate(iter_inference(tagger, stream_chunks(), batch_size=16)):
+                (score,), (label,) = extract_best_scores(result)
+                (labels3,) = extract_3best_labels(result)
+                best_labels.append(label)
+                best_labels3.append(labels3)
+                if results_writer is not None:
+                    pending_scores.append(result.scores)
+                    if len(pending_scores) == 256:
+                        results_writer.append(TaggingResults(np.concatenate(pending_scores)), times[i + 1 - 256:i + 1])
+                        pending_scores = []
+                else:
+                    print_row(*times[i], score, labels3)
+
+            if pending_scores:
+                results_writer.append(TaggingResults(np.concatenate(pending_scores)), times[-len(pending_scores):])
+
+        else:
+            if args.framewise:
+                from detection import detect_file
+                from panns_inference import SoundEventDetection
+
+                times = read_metadata(path_metadata, **metadata_kwargs)
+
+                detector = SoundEventDetection(checkpoint_path=None, device='cpu', interpolate_mode='nearest')
+
+                inferences, _ = detect_file(detector, path_audio, times, batch_size=4)
+            elif args.no_cache:
+                from inference import perform_inference
+                from utils import read_audio
+
+                chunks, times = read_audio(path_audio, path_metadata, single_decode=True, **metadata_kwargs)
+
+                tagger = load_tagger()
+
+                inferences = perform_inference(tagger, chunks, batch_size=16, keep_embeddings=args.corpus is not None)
+            else:
+                # The audio is only decoded, and the model only loaded, if some chunks are not cached
+                inferences, times = cached_inference(InferenceCache(args.cache_dir),
+                                                     load_tagger,
+                                                     path_audio, path_metadata, checkpoint_id=checkpoint_id,
+                                                     keep_embeddings=args.corpus is not None,
+                                                     metadata_kwargs=metadata_kwargs, batch_size=16)
+
+            # The sound event detection model has no chunk embeddings
+            if args.corpus is not None and not args.framewise:
+                from embedding_index import EmbeddingStore
+                EmbeddingStore(args.corpus).put(audio_name, inferences, times)
+
+            visu = Visualization(render_workers=args.render_workers)
+
+            scores, best_labels = extract_best_scores(inferences)
+            best_labels3 = extract_3best_labels(inferences)
+
+            if results_writer is not None:
+                results_writer.append(inferences, times)
+            else:
+                print('Offset    Duration    Score    Label1    Label2    Label3')
+                for i in range(len(best_labels)):
+                    print_row(*times[i], scores[i], best_labels3[i])
+
+            if args.segments:
+                from smoothing import extract_segments, segment_top_labels
+
+                segments = extract_segments(inferences, times, window=args.smooth_window, min_dwell=args.min_dwell)
+                segment_labels3 = segment_top_labels(inferences, segments)
+
+                print('Start    End    Label    Mean score')
+                for start, end, label, mean_score, _, _ in segments:
+                    print(f'{start}    {end}    {label}    {mean_score}')
+
+        if results_writer is not None:
+            results_writer.close()
+            print(f'{results_writer.rows} chunks written to {results_writer.path}')
+
+        if args.segments:
+            visu.create_segment_gifs(segments, segment_labels3, output_name=audio_name)
+        else:
+            # Every style in a single pass over the labels
+            visu.create_gifs(best_labels, best_labels3, output_name=audio_name)
+
+    if args.profile:
+        profiling.print_summary()
+        profiling.export_chrome_trace(args.profile)
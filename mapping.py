@@ -1,4 +1,10 @@
 import csv
+import os
+from functools import lru_cache
+import numpy as np
+
+# Next to this file, so it is found whatever the working directory
+CLASS_LABELS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'class_labels_indices_blacklisted.csv')
 
 LABELS_MAPPING = {
     "Speech": "-U+1F5E3",
@@ -530,14 +536,111 @@ LABELS_MAPPING = {
     "Field recording": "-U+1F4A4"
 }
 
-def retrieve_blacklist(blacklist_path='./class_labels_indices_blacklisted.csv'):
+ZERO_WIDTH_JOINER = 'U+200D'
+
+def _compile_codepoints(emoji_unicode):
+    """
+    Parses a LABELS_MAPPING string into a tuple of emoji store keys.
+
+    The codepoints are normalized to the 'U+XXXX' form and the sequences joined by a zero 
+    width joiner are kept together as a single key, as they are one emoji in the store:
+    '-U+1F3B6-U+1F469-u200D-U+1F3A4' gives ('U+1F3B6', 'U+1F469 U+200D U+1F3A4').
+    """
+    codepoints = []
+    join_next = False
+    for part in emoji_unicode.split('-')[1:]:
+        codepoint = 'U+' + part.upper().lstrip('U').lstrip('+')
+        if codepoint == ZERO_WIDTH_JOINER:
+            join_next = bool(codepoints)
+        elif join_next:
+            codepoints[-1] = f'{codepoints[-1]} {ZERO_WIDTH_JOINER} {codepoint}'
+            join_next = False
+        else:
+            codepoints.append(codepoint)
+
+    return tuple(codepoints)
+
+# Compiled once at import, so the renderers don't parse the mapping strings
+CODEPOINTS_BY_LABEL = {label: _compile_codepoints(emoji_unicode) for label, emoji_unicode in LABELS_MAPPING.items()}
+
+def find_missing_codepoints(available_codepoints, codepoints_by_label=CODEPOINTS_BY_LABEL):
+    """
+    Returns the labels whose emojis are not all available (e.g. in an EmojiStore).
+
+    Args:
+        available_codepoints (container of str): Emoji keys that can be rendered.
+        codepoints_by_label (dict, optional): Compiled mapping to check.
+
+    Returns:
+        dict: Mapping from each broken label to the list of its missing codepoints.
+    """
+    missing = {}
+    for label, codepoints in codepoints_by_label.items():
+        label_missing = [codepoint for codepoint in codepoints if codepoint not in available_codepoints]
+        if label_missing:
+            missing[label] = label_missing
+
+    return missing
+
+@lru_cache(maxsize=None)
+def _read_class_labels(blacklist_path):
+    """
+    Parses the class labels CSV once per process.
+
+    Returns:
+        tuple: 
+            - labels (tuple of str): Display name of each class, in class index order.
+            - blacklisted (tuple of bool): Whether each class is blacklisted.
+    """
     with open(blacklist_path, 'r') as file:
         reader = csv.reader(file)
 
         next(reader) # skipping header
-        blacklist = []
-        for row in reader:
-            if row[3] == 'x':
-                blacklist.append(row[2])
+        rows = sorted((int(row[0]), row[2], row[3] == 'x') for row in reader)
+
+    labels = tuple(label for _, label, _ in rows)
+    blacklisted = tuple(is_blacklisted for _, _, is_blacklisted in rows)
+    return labels, blacklisted
+
+def retrieve_class_labels(blacklist_path=CLASS_LABELS_PATH):
+    """
+    Returns the labels of the audio tagging model (AudioSet classes) in class index order. 
+    Unlike `panns_inference.labels`, this doesn't import torch.
+    """
+    labels, _ = _read_class_labels(blacklist_path)
+    return labels
+
+def retrieve_blacklist(blacklist_path=CLASS_LABELS_PATH):
+    labels, blacklisted = _read_class_labels(blacklist_path)
+    return [label for label, is_blacklisted in zip(labels, blacklisted) if is_blacklisted]
+
+@lru_cache(maxsize=None)
+def retrieve_blacklist_set(blacklist_path=CLASS_LABELS_PATH):
+    """Returns the blacklisted labels as a frozenset, for constant time lookups."""
+    return frozenset(retrieve_blacklist(blacklist_path))
+
+@lru_cache(maxsize=None)
+def retrieve_whitelist_set(blacklist_path=CLASS_LABELS_PATH):
+    """Returns the labels that are not blacklisted as a frozenset."""
+    labels, blacklisted = _read_class_labels(blacklist_path)
+    return frozenset(label for label, is_blacklisted in zip(labels, blacklisted) if not is_blacklisted)
+
+@lru_cache(maxsize=None)
+def retrieve_blacklist_mask(blacklist_path=CLASS_LABELS_PATH):
+    """
+    Returns a boolean array aligned to the class index of the audio tagging model, 
+    True for the blacklisted classes. The array is shared, so it is read only.
+    """
+    _, blacklisted = _read_class_labels(blacklist_path)
+    mask = np.array(blacklisted, dtype=bool)
+    mask.flags.writeable = False
+    return mask
 
-    return blacklist
+@lru_cache(maxsize=None)
+def retrieve_class_codepoints(blacklist_path=CLASS_LABELS_PATH):
+    """
+    Returns the compiled emoji codepoints of every class, aligned to the class index of 
+    the audio tagging model. Classes without emoji get an empty tuple.
+    """
+    labels, _ = _read_class_labels(blacklist_path)
+    return tuple(CODEPOINTS_BY_LABEL.get(label, ()) for label in labels)
@@ -0,0 +1,130 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# Checked at every call of a profiled function: when it is False, the only overhead
+# is this check and one function call
+_enabled = False
+_records = []
+
+
+def enable(track_memory=True):
+    """
+    Starts recording the calls of the profiled functions. With `track_memory`, the change of
+    the traced memory during each call is measured too (the bytes still allocated at its end,
+    not the peak or the total allocated), which slows the allocations down.
+    """
+    global _enabled
+    _enabled = True
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable():
+    global _enabled
+    _enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def is_enabled():
+    return _enabled
+
+def clear():
+    _records.clear()
+
+
+def _count_items(result):
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+def profiled(stage=None, count=None):
+    """
+    Decorator recording the wall time, CPU time, number of items and net traced memory
+    (bytes still allocated at the end minus at the start) of each call of a function, when
+    profiling is enabled.
+
+    Args:
+        stage (str, optional): Name of the stage. Defaults to the qualified name of the function.
+        count (callable, optional): Function of (result, args, kwargs) returning the number of
+            items processed by the call. Defaults to the length of the result, if any.
+    """
+    def decorator(function):
+        name = stage or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+
+            track_memory = tracemalloc.is_tracing()
+            memory_before = tracemalloc.get_traced_memory()[0] if track_memory else None
+            start_cpu = time.process_time_ns()
+            start = time.perf_counter_ns()
+
+            result = function(*args, **kwargs)
+
+            end = time.perf_counter_ns()
+            end_cpu = time.process_time_ns()
+            _records.append({
+                'stage': name,
+                'start_ns': start,
+                'wall_ns': end - start,
+                'cpu_ns': end_cpu - start_cpu,
+                'items': count(result, args, kwargs) if count is not None else _count_items(result),
+                'net_traced_bytes': tracemalloc.get_traced_memory()[0] - memory_before if track_memory else None,
+                'thread': threading.get_ident(),
+            })
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def export_chrome_trace(path):
+    """
+    Writes the recorded calls in the Chrome trace event format, which can be opened in
+    chrome://tracing, Perfetto or speedscope.
+    """
+    events = []
+    for record in _records:
+        events.append({
+            'name': record['stage'],
+            'cat': 'pipeline',
+            'ph': 'X',
+            'ts': record['start_ns'] / 1000,
+            'dur': record['wall_ns'] / 1000,
+            'pid': os.getpid(),
+            'tid': record['thread'],
+            'args': {
+                'cpu_ms': record['cpu_ns'] / 1e6,
+                'items': record['items'],
+                'net_traced_bytes': record['net_traced_bytes'],
+            },
+        })
+
+    with open(path, 'w') as file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+def summary():
+    """Returns the recorded calls aggregated by stage, in the order of their first call."""
+    stages = {}
+    for record in _records:
+        stage = stages.setdefault(record['stage'], {'calls': 0, 'wall_ns': 0, 'cpu_ns': 0, 'items': 0, 'net_traced_bytes': 0})
+        stage['calls'] += 1
+        stage['wall_ns'] += record['wall_ns']
+        stage['cpu_ns'] += record['cpu_ns']
+        stage['items'] += record['items'] or 0
+        stage['net_traced_bytes'] += record['net_traced_bytes'] or 0
+
+    return stages
+
+def print_summary():
+    print('Stage    Calls    Wall (s)    CPU (s)    Items    Net traced memory (MB)')
+    for name, stage in summary().items():
+        print(f'{name}    {stage["calls"]}    {stage["wall_ns"] / 1e9:.3f}    {stage["cpu_ns"] / 1e9:.3f}    '
+              f'{stage["items"]}    {stage["net_traced_bytes"] / 1e6:.1f}')
@@ -0,0 +1,253 @@
+import json
+import os
+import numpy as np
+from inference import LABELS, LABEL_INDEX, TaggingResults
+from utils import extract_best_scores, extract_3best_labels
+
+# Columns of the chosen labels, stored as ids in the LABELS dictionary
+LABEL_COLUMNS = ['label1', 'label2', 'label3']
+
+
+def _pyarrow_available():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return False
+    return True
+
+def results_path(directory, name, format=None):
+    """Returns the path of the results of a recording: {name}.parquet, or {name}.columns for the columns format."""
+    format = format or ('parquet' if _pyarrow_available() else 'columns')
+    return os.path.join(directory, f'{name}.parquet' if format == 'parquet' else f'{name}.columns')
+
+
+class ResultsWriter:
+    """
+    Writes the results of the chunks of a recording in a columnar file, row group by row
+    group, so the chunks can be appended as they are tagged.
+
+    Columns:
+        - offset, duration (float64): Times of the chunks in seconds.
+        - score (float32): Best score of the chunk.
+        - label1, label2, label3 (dictionary-encoded): The 3 best non blacklisted labels,
+          as int16 ids in the LABELS dictionary.
+        - top_indexes (int16), top_scores (float32): The k best classes and their scores
+          (blacklist included), k values per chunk.
+        - scores (float32): The score of every class, only with `full_scores`.
+
+    Two formats:
+        - 'parquet': a Parquet file, written with pyarrow (optional dependency). The label
+          columns are Arrow dictionary columns, the top-k ones fixed-size lists.
+        - 'columns': a directory with a raw little endian file per column and a
+          manifest.json (dtypes, shapes, number of rows, label dictionary), read memory-mapped.
+
+    Usage:
+        with ResultsWriter('output/A_1.parquet') as writer:
+            writer.append(perform_inference(audio_tagger, chunks), times)
+        columns = read_results('output/A_1.parquet')
+    """
+    def __init__(self, path, format=None, k=5, full_scores=False, row_group_size=4096):
+        if format is None:
+            format = 'parquet' if _pyarrow_available() else 'columns'
+        if format not in ('parquet', 'columns'):
+            raise ValueError(f"Unknown format '{format}', expected 'parquet' or 'columns'")
+        if format == 'parquet' and not _pyarrow_available():
+            raise ImportError("The 'parquet' format needs pyarrow, use the 'columns' format without it")
+
+        self.path = path
+        self.format = format
+        self.k = k
+        self.full_scores = full_scores
+        self.row_group_size = row_group_size
+        self.rows = 0
+
+        self._pending = []
+        self._pending_rows = 0
+        self._parquet_writer = None
+        self._closed = False
+
+        self.column_shapes = {
+            'offset': ('<f8', ()),
+            'duration': ('<f8', ()),
+            'score': ('<f4', ()),
+            **{column: ('<i2', ()) for column in LABEL_COLUMNS},
+            'top_indexes': ('<i2', (k,)),
+            'top_scores': ('<f4', (k,)),
+        }
+        if full_scores:
+            self.column_shapes['scores'] = ('<f4', (len(LABELS),))
+
+        if format == 'columns':
+            os.makedirs(path, exist_ok=True)
+            # Emptied, the rows are appended to the files
+            for column in self.column_shapes:
+                open(os.path.join(path, f'{column}.bin'), 'wb').close()
+            self._write_manifest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def append(self, inferences, audio_times):
+        """
+        Adds the results of chunks, written once `row_group_size` chunks are pending.
+
+        Args:
+            inferences (TaggingResults or list of list of tuple): Results of the chunks.
+            audio_times (list of tuples): Offsets and durations of the chunks.
+        """
+        results = TaggingResults.from_sorted_results(inferences)
+        if len(audio_times) != len(results):
+            raise ValueError(f'{len(audio_times)} chunk times for {len(results)} chunk results')
+        if len(results) == 0:
+            return
+
+        times = np.asarray(audio_times, dtype=np.float64).reshape(-1, 2)
+        scores, _ = extract_best_scores(results)
+        label_ids = np.array([[LABEL_INDEX[label] for label in labels3] for labels3 in extract_3best_labels(results)],
+                             dtype=np.int16)
+        top_indexes, top_scores = results.top_k(self.k)
+
+        columns = {
+            'offset': times[:, 0],
+            'duration': times[:, 1],
+            'score': np.array(scores, dtype=np.float32),
+            **{column: label_ids[:, i] for i, column in enumerate(LABEL_COLUMNS)},
+            'top_indexes': top_indexes.astype(np.int16),
+            'top_scores': top_scores,
+        }
+        if self.full_scores:
+            columns['scores'] = results.scores
+
+        self._pending.append(columns)
+        self._pending_rows += len(results)
+        if self._pending_rows >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the pending chunks as a row group."""
+        if not self._pending:
+            return
+
+        columns = {column: np.concatenate([pending[column] for pending in self._pending]).astype(dtype, copy=False)
+                   for column, (dtype, _) in self.column_shapes.items()}
+        if self.format == 'parquet':
+            self._write_parquet_row_group(columns)
+        else:
+            for column, values in columns.items():
+                with open(os.path.join(self.path, f'{column}.bin'), 'ab') as file:
+                    file.write(np.ascontiguousarray(values).tobytes())
+
+        self.rows += self._pending_rows
+        self._pending = []
+        self._pending_rows = 0
+
+        if self.format == 'columns':
+            # Rewritten after every row group, so the rows written stay readable if the run stops
+            self._write_manifest()
+
+    def _write_parquet_row_group(self, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        label_dictionary = pa.array(LABELS.tolist())
+        arrays = {}
+        for column, values in columns.items():
+            if column in LABEL_COLUMNS:
+                arrays[column] = pa.DictionaryArray.from_arrays(pa.array(values, pa.int16()), label_dictionary)
+            elif values.ndim == 2:
+                arrays[column] = pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), values.shape[1])
+            else:
+                arrays[column] = pa.array(values)
+        table = pa.table(arrays)
+
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+        self._parquet_writer.write_table(table, row_group_size=max(len(table), 1))
+
+    def _write_manifest(self):
+        manifest = {
+            'rows': self.rows,
+            'columns': {column: {'dtype': dtype, 'shape': list(shape)} for column, (dtype, shape) in self.column_shapes.items()},
+            'dictionaries': {column: 'labels' for column in LABEL_COLUMNS},
+            'labels': LABELS.tolist(),
+        }
+        temporary_path = os.path.join(self.path, 'manifest.json.tmp')
+        with open(temporary_path, 'w') as file:
+            json.dump(manifest, file)
+        os.replace(temporary_path, os.path.join(self.path, 'manifest.json'))
+
+    def close(self):
+        if self._closed:
+            return
+
+        self.flush()
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        elif self.format == 'parquet':
+            # No row at all, an empty file with the schema is still written
+            self._write_parquet_row_group({column: np.zeros((0, *shape), dtype=dtype)
+                                           for column, (dtype, shape) in self.column_shapes.items()})
+            self._parquet_writer.close()
+        self._closed = True
+
+
+def read_results(path):
+    """
+    Reads a results file written by ResultsWriter. The columns format is memory-mapped.
+    The Parquet file is read from a memory map, but its columns are decoded and
+    concatenated across the row groups into new arrays, so they are in memory.
+
+    Returns:
+        dict: The columns as arrays (the label columns as ids), and the 'labels'
+        dictionary of the ids: `columns['labels'][columns['label1']]` gives the best labels.
+    """
+    if os.path.isdir(path):
+        with open(os.path.join(path, 'manifest.json')) as file:
+            manifest = json.load(file)
+
+        columns = {}
+        for column, description in manifest['columns'].items():
+            shape = (manifest['rows'], *description['shape'])
+            if manifest['rows'] == 0:
+                columns[column] = np.zeros(shape, dtype=description['dtype'])
+            else:
+                columns[column] = np.memmap(os.path.join(path, f'{column}.bin'), dtype=description['dtype'],
+                                            mode='r', shape=shape)
+        columns['labels'] = np.array(manifest['labels'])
+        return columns
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path, memory_map=True)
+    columns = {}
+    labels = None
+    for column in table.column_names:
+        chunked = table.column(column)
+        if pa.types.is_dictionary(chunked.type):
+            # Every row group has the same dictionary, so the ids of the chunks can be concatenated
+            columns[column] = np.concatenate([np.zeros(0, dtype=np.int16)] +
+                                             [chunk.indices.to_numpy(zero_copy_only=False) for chunk in chunked.chunks])
+            if chunked.num_chunks:
+                labels = np.array(chunked.chunk(0).dictionary.to_pylist())
+        elif pa.types.is_fixed_size_list(chunked.type):
+            values = np.concatenate([np.zeros(0)] + [chunk.flatten().to_numpy(zero_copy_only=False) for chunk in chunked.chunks])
+            columns[column] = values.astype(chunked.type.value_type.to_pandas_dtype()).reshape(-1, chunked.type.list_size)
+        else:
+            columns[column] = chunked.to_numpy()
+
+    columns['labels'] = labels if labels is not None else LABELS
+    return columns
+
+def read_corpus(directory):
+    """Reads every results file of a directory, by recording name."""
+    corpus = {}
+    for file_name in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(file_name)
+        if extension in ('.parquet', '.columns'):
+            corpus[name] = read_results(os.path.join(directory, file_name))
+    return corpus
@@ -0,0 +1,179 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from inference import LABELS, LABEL_INDEX, TaggingResults
+from mapping import retrieve_blacklist_mask
+from profiling import profiled
+
+
+def smooth_scores(scores, window=5, method='median'):
+    """
+    Filters the scores of every class along the chunks, the edges being padded with the
+    first and last chunks.
+
+    Args:
+        scores (ndarray): (n_chunks, n_classes) scores.
+        window (int, optional): Odd number of chunks of the filter. 1 returns the scores unchanged.
+        method (str, optional): 'median' (removes isolated flips) or 'mean' (moving average).
+
+    Returns:
+        ndarray: (n_chunks, n_classes) float32 smoothed scores.
+    """
+    if method not in ('median', 'mean'):
+        raise ValueError(f"Unknown method '{method}', expected 'median' or 'mean'")
+    if window % 2 == 0:
+        raise ValueError(f'The window must be odd, got {window}')
+    if window == 1 or len(scores) == 0:
+        return np.asarray(scores, dtype=np.float32)
+
+    half = window // 2
+    padded = np.pad(scores, ((half, half), (0, 0)), mode='edge')
+
+    if method == 'mean':
+        cumulative = np.concatenate([np.zeros((1, padded.shape[1])), np.cumsum(padded, axis=0, dtype=np.float64)])
+        return ((cumulative[window:] - cumulative[:-window]) / window).astype(np.float32)
+
+    # (n_chunks, n_classes, window) view, without copying the scores
+    return np.median(sliding_window_view(padded, window, axis=0), axis=-1).astype(np.float32)
+
+def hysteresis_labels(scores, margin=0.05, blacklist_mask=None):
+    """
+    Returns the class index of each chunk, the label only changing when another one
+    scores above it by more than `margin`.
+
+    Args:
+        scores (ndarray): (n_chunks, n_classes) scores, e.g. from `smooth_scores`.
+        margin (float, optional): Score difference needed to change the label.
+        blacklist_mask (ndarray, optional): (n_classes,) boolean mask of the classes never chosen.
+
+    Returns:
+        ndarray: (n_chunks,) class indexes.
+    """
+    if blacklist_mask is not None:
+        scores = np.where(blacklist_mask, -np.inf, scores)
+
+    rows = np.arange(len(scores))
+    best = scores.argmax(axis=1)
+    best_scores = scores[rows, best]
+
+    labels = np.empty(len(scores), dtype=np.int64)
+    current = best[0] if len(scores) else 0
+    # Sequential by nature, but only scalar operations per chunk
+    for i in rows:
+        if best[i] != current and best_scores[i] > scores[i, current] + margin:
+            current = best[i]
+        labels[i] = current
+
+    return labels
+
+def run_lengths(labels):
+    """
+    Returns the bounds of the runs of identical labels.
+
+    Returns:
+        tuple:
+            - starts (ndarray): Index of the first chunk of each run.
+            - ends (ndarray): Index after the last chunk of each run.
+    """
+    changes = np.flatnonzero(labels[1:] != labels[:-1]) + 1
+    return np.concatenate([[0], changes]), np.concatenate([changes, [len(labels)]])
+
+def enforce_min_dwell(labels, scores, durations, min_dwell):
+    """
+    Relabels the runs shorter than `min_dwell` seconds with the label of the previous or
+    next run, whichever has the higher mean score over the run.
+
+    Args:
+        labels (ndarray): (n_chunks,) class indexes.
+        scores (ndarray): (n_chunks, n_classes) scores.
+        durations (ndarray): (n_chunks,) durations of the chunks in seconds.
+        min_dwell (float): Minimum duration of a run in seconds.
+
+    Returns:
+        ndarray: (n_chunks,) class indexes.
+    """
+    labels = labels.copy()
+    if min_dwell <= 0 or len(labels) == 0:
+        return labels
+
+    starts, ends = run_lengths(labels)
+    cumulative = np.concatenate([[0.], np.cumsum(durations)])
+    short_runs = np.flatnonzero(cumulative[ends] - cumulative[starts] < min_dwell)
+
+    # From left to right, so a short run can join the run its predecessor joined
+    for run in short_runs:
+        start, end = starts[run], ends[run]
+        candidates = []
+        if start > 0:
+            candidates.append(labels[start - 1])
+        if end < len(labels):
+            candidates.append(labels[end])
+        if candidates:
+            labels[start:end] = max(candidates, key=lambda label: scores[start:end, label].mean())
+
+    return labels
+
+@profiled(count=lambda result, args, kwargs: len(result))
+def extract_segments(inferences, audio_times, window=5, method='median', margin=0.05, min_dwell=0.):
+    """
+    Segments the chunks into runs of the same label: the scores are smoothed along the
+    chunks, the label of each chunk is chosen with hysteresis (blacklisted labels excluded),
+    and the runs shorter than `min_dwell` are merged into their neighbours.
+
+    Args:
+        inferences (TaggingResults or list of list of tuple): Inference results, as returned by `perform_inference`.
+        audio_times (list of tuples): Offsets and durations of the chunks, sorted by offset.
+        window (int, optional): Odd number of chunks of the smoothing filter.
+        method (str, optional): 'median' or 'mean' smoothing.
+        margin (float, optional): Score difference needed to change the label.
+        min_dwell (float, optional): Minimum duration of a segment in seconds.
+
+    Returns:
+        list of tuple: (start, end, label, mean score, first chunk, end chunk) of each segment:
+        the times in seconds, the mean of the raw scores of the label over the chunks of the
+        segment, and the index of its first chunk and the index after its last chunk.
+    """
+    results = TaggingResults.from_sorted_results(inferences)
+    if len(audio_times) != len(results):
+        raise ValueError(f'{len(audio_times)} chunk times for {len(results)} chunk results')
+    if len(results) == 0:
+        return []
+
+    times = np.asarray(audio_times, dtype=np.float64).reshape(-1, 2)
+    smoothed = smooth_scores(results.scores, window, method)
+    labels = hysteresis_labels(smoothed, margin, retrieve_blacklist_mask())
+    labels = enforce_min_dwell(labels, smoothed, times[:, 1], min_dwell)
+
+    starts, ends = run_lengths(labels)
+    label_scores = results.scores[np.arange(len(labels)), labels]
+    mean_scores = np.add.reduceat(label_scores, starts) / (ends - starts)
+
+    return [(float(times[start, 0]), float(times[end - 1, 0] + times[end - 1, 1]), str(LABELS[labels[start]]), float(score),
+             int(start), int(end))
+            for start, end, score in zip(starts, ends, mean_scores)]
+
+def segment_top_labels(inferences, segments, k=3):
+    """
+    Returns the k best labels of each segment, by mean score over its chunks: the label
+    of the segment first, then the best other non blacklisted labels.
+
+    Args:
+        inferences (TaggingResults or list of list of tuple): Inference results.
+        segments (list of tuple): Segments returned by `extract_segments`.
+        k (int, optional): Number of labels per segment.
+
+    Returns:
+        list of list of str: The labels of each segment.
+    """
+    results = TaggingResults.from_sorted_results(inferences)
+
+    # Mean scores of the chunks of each segment, from a cumulative sum
+    firsts = np.array([first for *_, first, _ in segments], dtype=np.int64)
+    ends = np.array([end for *_, end in segments], dtype=np.int64)
+    cumulative = np.concatenate([np.zeros((1, results.scores.shape[1])), np.cumsum(results.scores, axis=0, dtype=np.float64)])
+    means = (cumulative[ends] - cumulative[firsts]) / np.maximum(ends - firsts, 1)[:, None]
+
+    means[:, retrieve_blacklist_mask()] = -np.inf
+    means[np.arange(len(segments)), [LABEL_INDEX[label] for _, _, label, *_ in segments]] = np.inf
+
+    best_indexes, _ = TaggingResults(means).top_k(k)
+    return [list(labels) for labels in results.label(best_indexes)]
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from inference import LABELS
+from detection import SED_SAMPLE_RATE, aggregate_segments, detect_file, perform_framewise_detection
+
+HOP_SAMPLES = SED_SAMPLE_RATE // 100
+
+
+class _LocalDetector:
+    """Stand-in for SoundEventDetection: the probability of the first class is the peak of each frame."""
+    def inference(self, batch):
+        frames = batch.reshape(len(batch), -1, HOP_SAMPLES)
+        output = np.zeros((len(batch), frames.shape[1], len(LABELS)), dtype=np.float32)
+        output[:, :, 0] = np.abs(frames).max(axis=2)
+        return output
+
+def test_aggregate_segments_empty():
+    scores = aggregate_segments(np.zeros((0, len(LABELS)), dtype=np.float32), [(0., 1.), (1., 1.)]).scores
+    np.testing.assert_array_equal(scores, np.zeros((2, len(LABELS))))
+
+def test_aggregate_segments_pooling():
+    framewise = np.zeros((300, len(LABELS)), dtype=np.float32)
+    framewise[50:150, 0] = 1.
+    framewise[100, 0] = 3.
+    results = aggregate_segments(framewise, [(0., 1.), (1., 1.), (2., 1.)], 'mean')
+    np.testing.assert_allclose(results.scores[:, 0], [0.5, 0.5 + 2 / 100, 0.])
+    results = aggregate_segments(framewise, [(0., 1.), (1., 1.), (2., 1.)])
+    np.testing.assert_allclose(results.scores[:, 0], [1., 3., 0.])
+
+def test_detect_file_blocks(tmp_path):
+    soundfile = pytest.importorskip('soundfile')
+    pytest.importorskip('librosa')
+
+    audio = np.random.default_rng(0).uniform(-0.5, 0.5, 25 * SED_SAMPLE_RATE).astype(np.float32)
+    path = tmp_path / 'audio.wav'
+    soundfile.write(path, audio, SED_SAMPLE_RATE, subtype='FLOAT')
+
+    expected = perform_framewise_detection(_LocalDetector(), audio, window_seconds=2., overlap_seconds=0.5)
+    _, framewise = detect_file(_LocalDetector(), str(path), [(0., 5.)], block_seconds=7.,
+                               window_seconds=2., overlap_seconds=0.5)
+    np.testing.assert_allclose(framewise, expected)
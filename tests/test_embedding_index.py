@@ -0,0 +1,59 @@
+import numpy as np
+from inference import LABELS, TaggingResults
+from embedding_index import EmbeddingIndex, EmbeddingStore
+
+
+def _put(store, name, n_chunks, seed):
+    rng = np.random.default_rng(seed)
+    results = TaggingResults(rng.random((n_chunks, len(LABELS)), dtype=np.float32),
+                             rng.standard_normal((n_chunks, 16)).astype(np.float32))
+    store.put(name, results, [(i * 2., 2.) for i in range(n_chunks)])
+    return results.embeddings
+
+def test_search_matches_brute_force(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    embeddings = np.concatenate([_put(store, 'A', 30, 0), _put(store, 'B', 45, 1)])
+    index = EmbeddingIndex.build(store)
+
+    queries = np.random.default_rng(2).standard_normal((4, 16)).astype(np.float32)
+    # Blocks smaller than k and not dividing the index, so the candidates are merged across blocks
+    similarities, rows = index.search(queries, k=7, block_rows=4)
+
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    expected = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ normalized.T
+    expected_rows = np.argsort(-expected, axis=1, kind='stable')[:, :7]
+    np.testing.assert_array_equal(rows, expected_rows)
+    np.testing.assert_allclose(similarities, np.take_along_axis(expected, expected_rows, axis=1), rtol=1e-5)
+    assert index.rows[rows[0, 0]][0] in ('A', 'B')
+
+def test_search_k_larger_than_index(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    _put(store, 'A', 3, 0)
+    similarities, rows = EmbeddingIndex.build(store).search(np.ones(16), k=10)
+    assert similarities.shape == rows.shape == (1, 3)
+    assert np.all(np.diff(similarities[0]) <= 0)
+
+def test_similar_chunks_excludes_itself(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    _put(store, 'A', 10, 0)
+    similar = EmbeddingIndex.build(store).similar_chunks('A', 4, k=3)
+    assert len(similar) == 3
+    assert all((name, chunk) != ('A', 4) for name, chunk, _, _, _ in similar)
+
+def test_open_or_build_rebuilds_stale_index(tmp_path, monkeypatch):
+    store = EmbeddingStore(str(tmp_path / 'corpus'))
+    path = str(tmp_path / 'index')
+    _put(store, 'A', 5, 0)
+    assert len(EmbeddingIndex.open_or_build(store, path)) == 5
+
+    # A recording stored after the build is added
+    _put(store, 'B', 4, 1)
+    index = EmbeddingIndex.open_or_build(store, path)
+    assert len(index) == 9
+    assert index.similar_chunks('B', 0, k=2)
+
+    # Up to date, opened as is
+    def build(*args, **kwargs):
+        raise AssertionError('The index was rebuilt')
+    monkeypatch.setattr(EmbeddingIndex, 'build', build)
+    assert len(EmbeddingIndex.open_or_build(store, path)) == 9
@@ -0,0 +1,45 @@
+import PIL.Image
+from emoji_cache import EmojiCache
+
+
+def _image(size):
+    return PIL.Image.new('RGBA', (size, size))
+
+def test_emoji_cache_lru_eviction():
+    # Room for three 4x4 RGBA images
+    cache = EmojiCache(max_bytes=3 * 4 * 4 * 4)
+    created = []
+    def create(key):
+        created.append(key)
+        return _image(4)
+
+    for key in 'abc':
+        cache.get(key, lambda key=key: create(key))
+    # 'a' is used again, so 'b' is the least recently used when 'd' comes in
+    first = cache.get('a', lambda: create('a'))
+    cache.get('d', lambda: create('d'))
+
+    assert created == ['a', 'b', 'c', 'd']
+    assert len(cache) == 3
+    assert cache.get('a', lambda: create('a')) is first
+    cache.get('b', lambda: create('b'))
+    assert created == ['a', 'b', 'c', 'd', 'b']
+
+    stats = cache.stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 5
+    # 'b' was evicted by 'd', then 'c' by 'b'
+    assert stats['evictions'] == 2
+    assert stats['entries'] == 3
+    assert stats['bytes'] == 3 * 4 * 4 * 4
+    assert stats['hit_rate'] == 2 / 7
+
+def test_emoji_cache_too_big_image():
+    cache = EmojiCache(max_bytes=10)
+    image = cache.get('big', lambda: _image(4))
+
+    assert image.size == (4, 4)
+    assert len(cache) == 0
+    assert cache.stats()['bytes'] == 0
+    cache.get('big', lambda: _image(4))
+    assert cache.stats()['misses'] == 2
@@ -0,0 +1,23 @@
+import os
+from emoji_store import EmojiStore, write_emoji_store
+
+
+def test_write_emoji_store(tmp_path):
+    store_path = str(tmp_path / 'store')
+    images = {'U+1F600': b'first', 'U+1F436': b'second image'}
+    write_emoji_store(images, store_path)
+
+    # Only the store itself is left, the temporary files were moved in place
+    assert sorted(os.listdir(tmp_path)) == ['store.bin', 'store.json']
+    store = EmojiStore(store_path)
+    assert len(store) == 2
+    assert store.get_bytes('U+1F436') == b'second image'
+
+def test_write_emoji_store_replaces(tmp_path):
+    store_path = str(tmp_path / 'store')
+    write_emoji_store({'U+1F600': b'old'}, store_path)
+    write_emoji_store({'U+1F436': b'new'}, store_path)
+
+    store = EmojiStore.open_or_build(store_path)
+    assert 'U+1F600' not in store
+    assert store.get_bytes('U+1F436') == b'new'
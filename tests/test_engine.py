@@ -0,0 +1,123 @@
+import os
+import time
+import numpy as np
+import pytest
+
+from engine import InferenceEngine, check_top_labels, optimize_tagger
+
+SAMPLE_RATE = 32000
+CHECKPOINT_PATH = os.path.join(os.path.expanduser('~'), 'panns_data', 'Cnn14_mAP=0.431.pth')
+
+
+class StubTagger:
+    """Same interface as AudioTagging: the 'scores' are the mean of each row."""
+    def inference(self, audio):
+        if np.isnan(audio).any():
+            raise ValueError('bad batch')
+        if np.isinf(audio).any():
+            # A worker killed by the system
+            os._exit(1)
+        return audio.mean(axis=1, keepdims=True), audio[:, :2].copy()
+
+def _batches(n_batches=6, batch_size=3):
+    rng = np.random.default_rng(0)
+    return [rng.uniform(-1, 1, (batch_size, 16)).astype(np.float32) for _ in range(n_batches)]
+
+def test_engine_keeps_batch_order():
+    batches = _batches()
+    with InferenceEngine(StubTagger(), num_workers=3, max_pending=2) as engine:
+        outputs = list(engine.map(batches))
+        # A second call, its task ids follow the ones of the first
+        clipwise_output, embedding = engine.inference(np.concatenate(batches))
+
+    assert len(outputs) == len(batches)
+    for batch, (scores, _) in zip(batches, outputs):
+        np.testing.assert_allclose(scores, batch.mean(axis=1, keepdims=True))
+    np.testing.assert_allclose(clipwise_output, np.concatenate(batches).mean(axis=1, keepdims=True))
+    np.testing.assert_array_equal(embedding, np.concatenate(batches)[:, :2])
+
+def test_engine_closes_after_failed_batch():
+    batches = _batches(n_batches=12)
+    batches[1] = np.full_like(batches[1], np.nan)
+
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match='bad batch'):
+        with InferenceEngine(StubTagger(), num_workers=2, close_timeout=5.) as engine:
+            list(engine.map(batches))
+    assert time.monotonic() - start < 5.
+
+def test_engine_is_reusable_after_failed_map():
+    batches = _batches()
+    bad = [np.full_like(batches[0], np.nan)] + batches
+
+    with InferenceEngine(StubTagger(), num_workers=2) as engine:
+        with pytest.raises(RuntimeError):
+            list(engine.map(bad))
+        # The results of the failed call still arriving are not taken for these ones
+        outputs = list(engine.map(batches))
+
+    for batch, (scores, _) in zip(batches, outputs):
+        np.testing.assert_allclose(scores, batch.mean(axis=1, keepdims=True))
+
+def test_engine_detects_dead_worker():
+    batches = _batches()
+    batches[0] = np.full_like(batches[0], np.inf)
+
+    with InferenceEngine(StubTagger(), num_workers=2, result_timeout=0.1, close_timeout=2.) as engine:
+        with pytest.raises(RuntimeError, match='died'):
+            list(engine.map(batches))
+
+def test_engine_prepares_tagger_in_workers():
+    class ScaledTagger(StubTagger):
+        def inference(self, audio):
+            clipwise_output, embedding = super().inference(audio)
+            return 2 * clipwise_output, embedding
+
+    batches = _batches()
+    with InferenceEngine(StubTagger(), num_workers=2, prepare_tagger=lambda _: ScaledTagger()) as engine:
+        outputs = list(engine.map(batches))
+
+    for batch, (scores, _) in zip(batches, outputs):
+        np.testing.assert_allclose(scores, 2 * batch.mean(axis=1, keepdims=True), rtol=1e-6)
+
+def test_engine_reports_failed_preparation():
+    def prepare_tagger(_):
+        raise ValueError('no trace')
+
+    with InferenceEngine(StubTagger(), num_workers=2, prepare_tagger=prepare_tagger) as engine:
+        with pytest.raises(RuntimeError, match='no trace'):
+            list(engine.map(_batches()))
+
+
+@pytest.fixture(scope='module')
+def tagger():
+    pytest.importorskip('torch')
+    panns_inference = pytest.importorskip('panns_inference')
+    # AudioTagging downloads the checkpoint when it is missing, which a test shouldn't do
+    if not os.path.exists(CHECKPOINT_PATH):
+        pytest.skip(f'No checkpoint at {CHECKPOINT_PATH}')
+    return panns_inference.AudioTagging(checkpoint_path=CHECKPOINT_PATH, device='cpu')
+
+def _chunks(n_chunks=8, seconds=5.):
+    """Deterministic chunks: tones, chirps and noise, which the model labels with confidence."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    chunks = []
+    for i in range(n_chunks):
+        if i % 3 == 0:
+            chunk = 0.5 * np.sin(2 * np.pi * 220 * (i + 1) * t)
+        elif i % 3 == 1:
+            chunk = 0.5 * np.sin(2 * np.pi * (200 + 400 * (i + 1) * t) * t)
+        else:
+            chunk = rng.uniform(-0.5, 0.5, len(t))
+        chunks.append((chunk.astype(np.float32), SAMPLE_RATE))
+    return chunks
+
+@pytest.mark.parametrize('quantize, script', [(True, False), (False, True)])
+def test_optimized_top_labels(tagger, quantize, script):
+    optimized = optimize_tagger(tagger, quantize, script, example_seconds=5.)
+    agreement = check_top_labels(tagger, optimized, _chunks(), batch_size=4)
+
+    assert agreement['chunks'] == 8
+    assert agreement['top1_agreement'] >= 0.85
+    assert agreement['top3_overlap'] >= 0.75
@@ -0,0 +1,41 @@
+import PIL.Image
+import pytest
+from gif_writer import GifStreamWriter
+
+
+def _frame(color):
+    frame = PIL.Image.new('RGBA', (20, 20), (255, 255, 255, 1))
+    frame.paste(PIL.Image.new('RGBA', (5, 5), color), (3, 3))
+    return frame
+
+def test_background_stays_white(tmp_path):
+    path = tmp_path / 'out.gif'
+    palette_source = _frame((255, 0, 0, 255))
+    palette_source.paste(PIL.Image.new('RGBA', (5, 5), (0, 0, 255, 255)), (10, 10))
+    with GifStreamWriter(path, palette_source) as writer:
+        writer.append(_frame((255, 0, 0, 255)), 100)
+        writer.append(_frame((255, 0, 0, 255)), 100)
+        writer.append(_frame((0, 0, 255, 255)), 100)
+
+    # The identical frames are coalesced
+    assert writer.frame_count == 2
+    with PIL.Image.open(path) as image:
+        assert image.n_frames == 2
+        assert image.info['duration'] == 200
+        frame = image.convert('RGBA')
+        assert frame.getpixel((0, 0)) == (255, 255, 255, 255)
+        assert frame.getpixel((4, 4)) == (255, 0, 0, 255)
+
+def test_empty_gif(tmp_path):
+    path = tmp_path / 'out.gif'
+    with pytest.raises(ValueError):
+        with GifStreamWriter(path):
+            pass
+    assert not path.exists()
+
+def test_error_not_hidden(tmp_path):
+    path = tmp_path / 'out.gif'
+    with pytest.raises(KeyError):
+        with GifStreamWriter(path):
+            raise KeyError('original')
+    assert not path.exists()
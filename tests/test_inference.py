@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from inference import LABELS, TaggingResults, _make_batches, _pad_batch, perform_inference
+
+
+class _MeanTagger:
+    """Stand-in for AudioTagging: the score of the first class is the mean of the samples."""
+    def inference(self, batch):
+        scores = np.zeros((len(batch), len(LABELS)), dtype=np.float32)
+        scores[:, 0] = batch.mean(axis=1)
+        return scores, np.repeat(batch.sum(axis=1, keepdims=True), 4, axis=1)
+
+def test_make_batches_tolerance():
+    lengths = [100, 101, 100, 150, 100]
+    assert _make_batches(lengths, 8, length_tolerance=0.) == [[0, 2, 4], [1], [3]]
+    assert _make_batches(lengths, 8, length_tolerance=0.02) == [[0, 2, 4, 1], [3]]
+    assert _make_batches(lengths, 2, length_tolerance=0.02) == [[0, 2], [4, 1], [3]]
+
+def test_make_batches_max_samples():
+    assert _make_batches([10, 10, 10], 8, max_batch_samples=20) == [[0, 1], [2]]
+
+def test_pad_batch():
+    batch = _pad_batch([np.ones(3), np.ones(2)])
+    np.testing.assert_array_equal(batch, [[1, 1, 1], [1, 1, 0]])
+
+def test_perform_inference_order():
+    chunks = [(np.full(length, value, dtype=np.float32), 32000) for length, value in [(4, 1.), (2, 2.), (4, 3.)]]
+    results = perform_inference(_MeanTagger(), chunks, batch_size=4, keep_embeddings=True)
+    np.testing.assert_allclose(results.scores[:, 0], [1., 2., 3.])
+    np.testing.assert_allclose(results.embeddings[:, 0], [4., 4., 12.])
+
+@pytest.mark.parametrize('levels', [None, 4, 2])
+@pytest.mark.parametrize('k', [1, 3, 10, len(LABELS)])
+def test_top_k_matches_full_sort(levels, k):
+    rng = np.random.default_rng(k)
+    scores = rng.random((50, len(LABELS))).astype(np.float32)
+    if levels is not None:
+        # Few distinct scores, so many ties, also across the k-th score
+        scores = np.floor(scores * levels) / levels
+
+    indexes, top_scores = TaggingResults(scores).top_k(k)
+
+    expected = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+    np.testing.assert_array_equal(indexes, expected)
+    np.testing.assert_array_equal(top_scores, np.take_along_axis(scores, expected, axis=1))
+    np.testing.assert_array_equal(TaggingResults(scores).sorted_indexes(0), np.argsort(-scores[0], kind='stable'))
+
+def test_top_k_empty():
+    indexes, scores = TaggingResults(np.zeros((0, len(LABELS)), dtype=np.float32)).top_k(3)
+    assert indexes.shape == (0, 3) and scores.shape == (0, 3)
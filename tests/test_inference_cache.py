@@ -0,0 +1,48 @@
+import numpy as np
+from inference import LABELS
+from inference_cache import InferenceCache
+
+
+def _scores(n, value):
+    return np.full((n, len(LABELS)), value, dtype=np.float32)
+
+def test_get_put_merge(tmp_path):
+    cache = InferenceCache(str(tmp_path))
+    key = cache.key('file', None, 'checkpoint')
+    times = [(0., 2.), (2., 2.), (4., 2.)]
+
+    _, _, found = cache.get(key, times)
+    assert not found.any()
+
+    cache.put(key, times[:2], _scores(2, 1.))
+    # Added to the entry of the recording, the first chunk replaced
+    cache.put(key, [times[2], times[0]], _scores(2, 2.), np.ones((2, 4), dtype=np.float32))
+
+    scores, embeddings, found = cache.get(key, times)
+    assert found.all() and embeddings is None
+    np.testing.assert_array_equal(scores[:, 0], [2., 1., 2.])
+
+    # The chunk cached without its embedding is a miss
+    _, embeddings, found = cache.get(key, times, with_embeddings=True)
+    np.testing.assert_array_equal(found, [True, False, True])
+    np.testing.assert_array_equal(embeddings[:, 0], [1., 0., 1.])
+    assert cache.count(key, times + [(6., 2.)]) == 3
+
+def test_size_and_eviction(tmp_path):
+    cache = InferenceCache(str(tmp_path))
+    keys = [cache.key(f'file{i}', None, 'checkpoint') for i in range(3)]
+    cache.put(keys[0], [(0., 1.)], _scores(1, 1.))
+    entry_bytes = cache.current_bytes
+
+    # Same size, read again from the disk
+    assert InferenceCache(str(tmp_path)).current_bytes == entry_bytes
+
+    cache.max_bytes = int(entry_bytes * 2.5)
+    cache.put(keys[1], [(0., 1.)], _scores(1, 1.))
+    cache.get(keys[0], [(0., 1.)])
+    cache._entries[keys[1]]['last_use'] = 0.
+    cache.put(keys[2], [(0., 1.)], _scores(1, 1.))
+
+    # The least recently used recording is removed
+    assert keys[1] not in cache and keys[0] in cache and keys[2] in cache
+    assert cache.current_bytes == 2 * entry_bytes == InferenceCache(str(tmp_path)).current_bytes
@@ -0,0 +1,70 @@
+import time
+import numpy as np
+import pytest
+from inference import LABELS
+from live import LiveTagger, RingBuffer
+
+
+def test_ring_buffer_read_write():
+    ring_buffer = RingBuffer(8)
+    ring_buffer.write(np.arange(5))
+    np.testing.assert_array_equal(ring_buffer.read(1, 3), [1, 2, 3])
+
+    # Wraps around the end of the array
+    ring_buffer.write(np.arange(5, 11))
+    assert ring_buffer.written == 11
+    np.testing.assert_array_equal(ring_buffer.read(3, 8), np.arange(3, 11))
+    np.testing.assert_array_equal(ring_buffer.read(6, 4), [6, 7, 8, 9])
+
+def test_ring_buffer_block_longer_than_capacity():
+    ring_buffer = RingBuffer(4)
+    ring_buffer.write(np.arange(10))
+    assert ring_buffer.written == 10
+    np.testing.assert_array_equal(ring_buffer.read(6, 4), [6, 7, 8, 9])
+
+def test_ring_buffer_out_of_range():
+    ring_buffer = RingBuffer(4)
+    ring_buffer.write(np.arange(10))
+    with pytest.raises(ValueError):
+        ring_buffer.read(5, 2)
+    with pytest.raises(ValueError):
+        ring_buffer.read(8, 3)
+
+
+class _SlowTagger:
+    """Stand-in for AudioTagging, slower than the hop so the windows pile up."""
+    def __init__(self, delay):
+        self.delay = delay
+        self.batch_sizes = []
+
+    def inference(self, batch):
+        time.sleep(self.delay)
+        self.batch_sizes.append(len(batch))
+        scores = np.zeros((len(batch), len(LABELS)), dtype=np.float32)
+        scores[:, 0] = batch.mean(axis=1)
+        return scores, None
+
+def test_buffer_validation():
+    with pytest.raises(ValueError):
+        LiveTagger(_SlowTagger(0), window_seconds=5., hop_seconds=1., policy='coalesce', max_batch=4, buffer_seconds=8.)
+    LiveTagger(_SlowTagger(0), window_seconds=5., hop_seconds=1., policy='coalesce', max_batch=4, buffer_seconds=9.)
+    LiveTagger(_SlowTagger(0), window_seconds=5., hop_seconds=1., policy='drop', max_batch=4, buffer_seconds=6.)
+
+@pytest.mark.parametrize('policy', ['drop', 'coalesce'])
+def test_run_smallest_buffer(policy):
+    sample_rate = 1000
+    tagger = _SlowTagger(0.02)
+    results = []
+    live = LiveTagger(tagger, window_seconds=0.5, hop_seconds=0.1, policy=policy, max_batch=4,
+                      buffer_seconds=0.5 + 0.1 * (4 if policy == 'coalesce' else 1),
+                      sample_rate=sample_rate, on_result=results.append)
+
+    # As fast as they are consumed, faster than the tagger
+    blocks = (np.full(50, i, dtype=np.float32) for i in range(100))
+    metrics = live.run(blocks)
+
+    assert metrics['windows'] == len(results) > 0
+    assert metrics['windows'] + metrics['dropped'] == (5000 - 500) // 100 + 1
+    assert max(tagger.batch_sizes) <= live.max_batch
+    offsets = [result['offset'] for result in results]
+    assert offsets == sorted(offsets)
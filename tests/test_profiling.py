@@ -0,0 +1,65 @@
+import json
+import pytest
+import profiling
+
+
+@pytest.fixture
+def profiler():
+    profiling.clear()
+    profiling.enable(track_memory=False)
+    yield profiling
+    profiling.disable()
+    profiling.clear()
+
+@profiling.profiled()
+def _make_list(n):
+    return list(range(n))
+
+@profiling.profiled(stage='counted', count=lambda result, args, kwargs: args[0] * 2)
+def _counted(n):
+    return None
+
+def test_profiled_disabled():
+    profiling.clear()
+    assert _make_list(3) == [0, 1, 2]
+    assert profiling.summary() == {}
+
+def test_profiled_counts(profiler):
+    _make_list(3)
+    _make_list(4)
+    _counted(5)
+
+    stages = profiler.summary()
+    assert list(stages) == ['_make_list', 'counted']
+    assert stages['_make_list']['calls'] == 2
+    assert stages['_make_list']['items'] == 7
+    assert stages['counted']['calls'] == 1
+    assert stages['counted']['items'] == 10
+    assert stages['counted']['wall_ns'] >= 0
+
+def test_profiled_memory():
+    profiling.clear()
+    profiling.enable(track_memory=True)
+    try:
+        _make_list(10000)
+    finally:
+        profiling.disable()
+    assert profiling.summary()['_make_list']['net_traced_bytes'] > 0
+    profiling.clear()
+
+def test_export_chrome_trace(profiler, tmp_path):
+    _make_list(3)
+    _counted(1)
+    path = tmp_path / 'trace.json'
+    profiler.export_chrome_trace(path)
+
+    events = json.loads(path.read_text())['traceEvents']
+    assert [event['name'] for event in events] == ['_make_list', 'counted']
+    for event in events:
+        assert event['ph'] == 'X'
+        assert isinstance(event['ts'], (int, float)) and isinstance(event['dur'], (int, float))
+        assert event['dur'] >= 0
+        assert {'pid', 'tid', 'args'} <= set(event)
+    assert events[0]['args']['items'] == 3
+    assert events[1]['args']['items'] == 2
+    assert events[1]['ts'] >= events[0]['ts'] + events[0]['dur']
@@ -0,0 +1,67 @@
+import importlib.util
+import numpy as np
+import pytest
+from inference import LABELS, TaggingResults
+from results_writer import ResultsWriter, read_corpus, read_results, results_path
+from utils import extract_best_scores, extract_3best_labels
+
+FORMATS = ['columns', pytest.param('parquet', marks=pytest.mark.skipif(importlib.util.find_spec('pyarrow') is None,
+                                                                      reason='pyarrow is not installed'))]
+
+
+def _results(n_chunks, seed=0):
+    rng = np.random.default_rng(seed)
+    return TaggingResults(rng.random((n_chunks, len(LABELS)), dtype=np.float32))
+
+@pytest.mark.parametrize('format', FORMATS)
+def test_round_trip(tmp_path, format):
+    results = _results(10)
+    times = [(i * 2., 2.) for i in range(10)]
+    path = results_path(str(tmp_path), 'A_1', format)
+
+    # Several row groups, the last one partial
+    with ResultsWriter(path, format, k=5, full_scores=True, row_group_size=4) as writer:
+        writer.append(TaggingResults(results.scores[:3]), times[:3])
+        writer.append(TaggingResults(results.scores[3:]), times[3:])
+    assert writer.rows == 10
+
+    columns = read_results(path)
+    np.testing.assert_array_equal(columns['offset'], [offset for offset, _ in times])
+    np.testing.assert_array_equal(columns['duration'], [duration for _, duration in times])
+    np.testing.assert_allclose(columns['scores'], results.scores)
+
+    scores, best_labels = extract_best_scores(results)
+    np.testing.assert_allclose(columns['score'], scores)
+    assert list(columns['labels'][columns['label1']]) == list(best_labels)
+    labels3 = extract_3best_labels(results)
+    assert [list(labels) for labels in zip(*(columns['labels'][columns[f'label{i}']] for i in (1, 2, 3)))] == \
+        [list(labels) for labels in labels3]
+
+    top_indexes, top_scores = results.top_k(5)
+    np.testing.assert_array_equal(columns['top_indexes'], top_indexes)
+    np.testing.assert_allclose(columns['top_scores'], top_scores)
+
+    assert list(read_corpus(str(tmp_path))) == ['A_1']
+
+@pytest.mark.parametrize('format', FORMATS)
+def test_empty(tmp_path, format):
+    path = results_path(str(tmp_path), 'empty', format)
+    with ResultsWriter(path, format):
+        pass
+    columns = read_results(path)
+    assert len(columns['offset']) == 0
+    assert columns['top_indexes'].shape == (0, 5)
+
+def test_closed_on_error(tmp_path):
+    path = results_path(str(tmp_path), 'A_1', 'columns')
+    with pytest.raises(KeyError):
+        with ResultsWriter(path, 'columns', row_group_size=100) as writer:
+            writer.append(_results(3), [(0., 1.), (1., 1.), (2., 1.)])
+            raise KeyError('failure')
+    # The pending rows were written
+    assert len(read_results(path)['offset']) == 3
+
+def test_mismatched_times(tmp_path):
+    with ResultsWriter(results_path(str(tmp_path), 'A_1', 'columns'), 'columns') as writer:
+        with pytest.raises(ValueError):
+            writer.append(_results(2), [(0., 1.)])
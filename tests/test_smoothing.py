@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from inference import LABELS, LABEL_INDEX, TaggingResults
+from smoothing import smooth_scores, enforce_min_dwell, extract_segments, segment_top_labels
+
+
+def _scores(labels, score=0.9):
+    """Scores of chunks where only the given label of each chunk scores."""
+    scores = np.zeros((len(labels), len(LABELS)), dtype=np.float32)
+    scores[np.arange(len(labels)), [LABEL_INDEX[label] for label in labels]] = score
+    return scores
+
+def test_smooth_scores_median_removes_isolated_flip():
+    scores = np.array([[0.], [0.], [1.], [0.], [0.]])
+    np.testing.assert_array_equal(smooth_scores(scores, 3), np.zeros((5, 1)))
+
+def test_smooth_scores_mean_pads_edges():
+    scores = np.array([[0.], [3.], [6.]])
+    np.testing.assert_allclose(smooth_scores(scores, 3, 'mean')[:, 0], [1., 3., 5.])
+
+def test_smooth_scores_window_one_unchanged():
+    scores = np.random.default_rng(0).random((4, 3))
+    np.testing.assert_allclose(smooth_scores(scores, 1), scores.astype(np.float32))
+
+def test_smooth_scores_invalid():
+    with pytest.raises(ValueError):
+        smooth_scores(np.zeros((3, 2)), 2)
+    with pytest.raises(ValueError):
+        smooth_scores(np.zeros((3, 2)), 3, 'max')
+
+def test_enforce_min_dwell_merges_short_run():
+    labels = np.array([0, 0, 1, 0, 0])
+    scores = np.array([[0.9, 0.1]] * 5)
+    durations = np.ones(5)
+    np.testing.assert_array_equal(enforce_min_dwell(labels, scores, durations, 2.), [0, 0, 0, 0, 0])
+    # Long enough, kept
+    np.testing.assert_array_equal(enforce_min_dwell(labels, scores, durations, 1.), labels)
+
+def test_enforce_min_dwell_picks_best_neighbour():
+    labels = np.array([0, 0, 1, 2, 2])
+    scores = np.zeros((5, 3))
+    scores[2] = [0.2, 0.5, 0.4]
+    durations = np.ones(5)
+    np.testing.assert_array_equal(enforce_min_dwell(labels, scores, durations, 2.), [0, 0, 2, 2, 2])
+
+def test_extract_segments():
+    labels = ['Speech'] * 4 + ['Cough'] * 3
+    times = [(i * 2., 2.) for i in range(len(labels))]
+    segments = extract_segments(TaggingResults(_scores(labels)), times, window=1)
+
+    assert [segment[:3] for segment in segments] == [(0., 8., 'Speech'), (8., 14., 'Cough')]
+    assert [segment[4:] for segment in segments] == [(0, 4), (4, 7)]
+    assert segments[0][3] == pytest.approx(0.9)
+
+def test_extract_segments_empty():
+    assert extract_segments(TaggingResults(np.zeros((0, len(LABELS)), dtype=np.float32)), [], window=1) == []
+
+def test_segment_top_labels_duplicate_offsets():
+    # Overlapping chunks with the same offsets, the chunks of each segment come from its indexes
+    labels = ['Speech', 'Speech', 'Cough', 'Cough']
+    scores = _scores(labels)
+    scores[:2, LABEL_INDEX['Walk, footsteps']] = 0.5
+    scores[2:, LABEL_INDEX['Run']] = 0.3
+    times = [(0., 4.), (0., 4.), (2., 4.), (2., 4.)]
+    results = TaggingResults(scores)
+    segments = extract_segments(results, times, window=1)
+
+    labels3 = segment_top_labels(results, segments)
+    assert [labels[:2] for labels in labels3] == [['Speech', 'Walk, footsteps'], ['Cough', 'Run']]
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+import utils
+from inference import LABELS, TaggingResults
+from mapping import retrieve_blacklist_mask
+from utils import _merge_segments, _select_best_labels, extract_3best_labels, extract_best_scores, iter_audio_chunks
+
+
+def test_merge_segments_overlapping_and_adjacent():
+    audio_times = [(0., 2.), (1., 2.), (3., 1.), (5., 1.)]
+    assert _merge_segments(audio_times) == [[0., 4., [0, 1, 2]], [5., 6., [3]]]
+
+def test_merge_segments_max_span_duration():
+    audio_times = [(0., 2.), (2., 2.), (4., 2.)]
+    assert _merge_segments(audio_times, max_span_duration=4) == [[0., 4., [0, 1]], [4., 6., [2]]]
+
+def test_merge_segments_unsorted():
+    audio_times = [(5., 1.), (0., 2.), (1.5, 1.)]
+    spans = _merge_segments(audio_times)
+    assert spans == [[0., 2.5, [1, 2]], [5., 6., [0]]]
+    # Every chunk starts inside its span
+    for span_start, span_end, indexes in spans:
+        for i in indexes:
+            offset, duration = audio_times[i]
+            assert span_start <= offset and offset + duration <= span_end
+
+def test_merge_segments_empty():
+    assert _merge_segments([]) == []
+
+def test_chunks_match_seek_based_load(tmp_path):
+    soundfile = pytest.importorskip('soundfile')
+    lb = pytest.importorskip('librosa')
+
+    sample_rate = 22050
+    audio = np.random.default_rng(0).uniform(-0.5, 0.5, 12 * sample_rate).astype(np.float32)
+    path_audio = tmp_path / 'audio.wav'
+    soundfile.write(path_audio, audio, sample_rate, subtype='FLOAT')
+
+    # Times whose sample indexes are not integers, and truncate differently from a rounding
+    path_metadata = tmp_path / 'audio.csv'
+    path_metadata.write_text('summary_start,summary_end\n'
+                             '00:00:00.123,00:00:03.981\n'
+                             '00:00:01.237,00:00:05.191\n'
+                             '00:00:06.077,00:00:09.999\n'
+                             '00:00:08.501,00:00:11.003\n')
+    metadata_kwargs = {'time_format': '%H:%M:%S.%f', 'drop_edges': False}
+
+    for single_decode in [True, False]:
+        for (chunk, sr), (offset, duration) in iter_audio_chunks(str(path_audio), str(path_metadata),
+                                                                 single_decode=single_decode, **metadata_kwargs):
+            expected, _ = lb.load(str(path_audio), sr=None, offset=offset, duration=duration)
+            assert sr == sample_rate
+            np.testing.assert_array_equal(chunk, expected)
+
+def test_blacklisted_labels_never_selected():
+    blacklist_mask = retrieve_blacklist_mask()
+    rng = np.random.default_rng(0)
+    scores = rng.random((20, len(LABELS))).astype(np.float32)
+    # The blacklisted classes have the best scores of every row
+    scores[:, blacklist_mask] += 1.
+
+    best_indexes = _select_best_labels(TaggingResults(scores), 3)
+    assert not blacklist_mask[best_indexes].any()
+
+    allowed = np.flatnonzero(~blacklist_mask)
+    expected = allowed[np.argsort(-scores[:, allowed], axis=1, kind='stable')[:, :3]]
+    np.testing.assert_array_equal(best_indexes, expected)
+
+    _, best_labels = extract_best_scores(TaggingResults(scores))
+    assert best_labels == list(LABELS[expected[:, 0]])
+    assert extract_3best_labels(TaggingResults(scores)) == [list(LABELS[row]) for row in expected]
+
+def test_all_blacklisted_row():
+    blacklist_mask = retrieve_blacklist_mask()
+    scores = np.zeros((2, len(LABELS)), dtype=np.float32)
+    # Only blacklisted classes have a score in the first row, the allowed ones tie at 0
+    scores[0, blacklist_mask] = 1.
+
+    best_indexes = _select_best_labels(TaggingResults(scores), 3)
+    np.testing.assert_array_equal(best_indexes[0], np.flatnonzero(~blacklist_mask)[:3])
+
+def test_select_best_labels_too_few_allowed(monkeypatch):
+    mask = np.ones(len(LABELS), dtype=bool)
+    mask[:2] = False
+    monkeypatch.setattr(utils, 'retrieve_blacklist_mask', lambda: mask)
+    scores = TaggingResults(np.zeros((1, len(LABELS)), dtype=np.float32))
+
+    assert _select_best_labels(scores, 2).tolist() == [[0, 1]]
+    with pytest.raises(ValueError, match='Only 2 labels'):
+        _select_best_labels(scores, 3)
+
+    mask[:] = True
+    with pytest.raises(ValueError, match='Only 0 labels'):
+        _select_best_labels(scores, 1)
@@ -0,0 +1,54 @@
+import os
+import PIL.Image
+import pytest
+from emoji_store import write_synthetic_emoji_store
+from visualization import Visualization
+
+
+@pytest.fixture(scope='module')
+def visualization(tmp_path_factory):
+    store_path = str(tmp_path_factory.mktemp('emoji') / 'emoji')
+    write_synthetic_emoji_store(store_path, size=16)
+    return Visualization(store_path=store_path)
+
+def test_create_gifs(visualization, tmp_path):
+    labels = ['Speech', 'Speech', 'Music', 'Dog']
+    labels3 = [[label, 'Music', 'Dog'] for label in labels]
+    visualization.create_gifs(labels, labels3, output_name='A_1', output_dir=str(tmp_path))
+
+    for suffix, frames in [('', 3), ('_circle', 4), ('_circle_detailled', 4), ('_diagonal', 3)]:
+        with PIL.Image.open(tmp_path / f'A_1{suffix}.gif') as image:
+            # The identical consecutive frames are merged
+            assert image.n_frames == frames
+
+def test_circle_without_emoji_skipped(visualization, tmp_path):
+    labels = ['Not a label', 'Not a label either']
+    visualization.create_gifs(labels, output_name='A_1', output_dir=str(tmp_path))
+
+    # The unmapped labels get the default emoji in the emoji style, but are not drawn in the circle
+    assert os.path.exists(tmp_path / 'A_1.gif')
+    assert not os.path.exists(tmp_path / 'A_1_circle.gif')
+
+def test_parallel_render_identical(tmp_path):
+    store_path = str(tmp_path / 'emoji')
+    write_synthetic_emoji_store(store_path, size=16)
+
+    # Runs of labels, so the accumulating styles change inside and across the frame ranges
+    names = ['Speech', 'Music', 'Dog', 'Cat', 'Bird', 'Not a label']
+    labels = [names[(i // 3 + i % 2) % len(names)] for i in range(40)]
+    labels3 = [[label, names[i % len(names)], names[(i + 2) % len(names)]] for i, label in enumerate(labels)]
+
+    sequential_dir = tmp_path / 'sequential'
+    parallel_dir = tmp_path / 'parallel'
+    os.makedirs(sequential_dir)
+    os.makedirs(parallel_dir)
+    Visualization(store_path=store_path).create_gifs(labels, labels3, output_name='A_1',
+                                                     output_dir=str(sequential_dir))
+    Visualization(store_path=store_path, render_workers=2, frames_per_task=7, parallel_min_frames=1).create_gifs(
+        labels, labels3, output_name='A_1', output_dir=str(parallel_dir))
+
+    names = sorted(os.listdir(sequential_dir))
+    assert names == ['A_1.gif', 'A_1_circle.gif', 'A_1_circle_detailled.gif', 'A_1_diagonal.gif']
+    assert sorted(os.listdir(parallel_dir)) == names
+    for name in names:
+        assert (parallel_dir / name).read_bytes() == (sequential_dir / name).read_bytes(), name
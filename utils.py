@@ -1,10 +1,151 @@
-import pandas as pd
 import numpy as np
-import librosa as lb
-from mapping import retrieve_blacklist
+from mapping import retrieve_blacklist_mask
+from inference import TaggingResults
+from profiling import profiled
 
+# Decoded after the end of each span, so its truncated length can't cut the last chunk short
+SPAN_MARGIN_SECONDS = 0.01
 
-def read_audio(path_audio, path_metadata, desired_sample_rate=None):
+
+def _slice_chunk(audio, sr, offset, duration, audio_offset=0.):
+    """
+    Returns the samples of a decoded signal between offset and offset + duration,
+    as a view on the signal (no copy is made).
+
+    The sample indexes are truncated the same way `librosa.load` does it, so at the native
+    sample rate the chunk is the one a seek-based load would return. `audio_offset` is the 
+    offset the signal itself was loaded from, the indexes being computed from the start of 
+    the file, as the truncation of a difference is not the difference of the truncations.
+    """
+    start = int(offset * sr) - int(audio_offset * sr)
+    end = start + int(duration * sr)
+    return audio[start:end]
+
+def read_metadata(path_metadata, origin='midnight', time_format=None, drop_edges=True, sort=True):
+    """
+    Reads the metadata of an audio file, without decoding the audio. The offsets and 
+    durations are computed in a single vectorized pass.
+
+    Args:
+        path_metadata (str): Path to the metadata CSV file containing 'summary_start' and 'summary_end' columns.
+        origin (str or datetime-like, optional): Time of the start of the audio file, the offsets are 
+            relative to it. 'midnight' is the midnight of the day of the first row (for time-only columns, 
+            the offset is the time of the day), 'first' is the earliest start of the file. Defaults to 'midnight'.
+        time_format (str, optional): Format of the times (e.g. '%H:%M:%S'). Giving it avoids 
+            inferring the format, which is much faster on large files.
+        drop_edges (bool, optional): If True, the first and the last rows are ignored. Defaults to True.
+        sort (bool, optional): If True, the chunks are sorted by offset. Defaults to True.
+
+    Returns:
+        list of tuples: List of tuples containing offsets (start times) and durations of the audio chunks.
+    """
+    import pandas as pd
+
+    metadata = pd.read_csv(path_metadata, sep=',', usecols=['summary_start', 'summary_end'])
+
+    starts = pd.to_datetime(metadata['summary_start'], format=time_format)
+    ends = pd.to_datetime(metadata['summary_end'], format=time_format)
+
+    if len(starts) == 0:
+        return []
+
+    if isinstance(origin, str) and origin == 'midnight':
+        reference = starts.iloc[0].normalize()
+    elif isinstance(origin, str) and origin == 'first':
+        reference = starts.min()
+    else:
+        reference = pd.Timestamp(origin)
+
+    if drop_edges:
+        starts = starts.iloc[1:-1]
+        ends = ends.iloc[1:-1]
+
+    offsets = ((starts - reference) / pd.Timedelta(1, 's')).to_numpy()
+    durations = ((ends - starts) / pd.Timedelta(1, 's')).to_numpy()
+
+    if sort:
+        order = np.argsort(offsets, kind='stable')
+        offsets = offsets[order]
+        durations = durations[order]
+
+    return list(zip(offsets.tolist(), durations.tolist()))
+
+def _merge_segments(audio_times, max_span_duration=None):
+    """
+    Groups the chunks whose segments overlap or touch each other in spans, so each span
+    is decoded only once. The chunks are taken by offset, so they don't have to be sorted.
+
+    Args:
+        audio_times (list of tuples): Offsets and durations of the chunks.
+        max_span_duration (float, optional): Maximum duration of a span in seconds, to bound 
+            the decoded audio kept in memory. Defaults to no limit.
+
+    Returns:
+        list of list: [start, end, chunk indexes] of each span, sorted by start, the indexes
+        being the positions of the chunks in `audio_times`.
+    """
+    offsets = np.array([offset for offset, _ in audio_times], dtype=np.float64)
+
+    spans = []
+    for i in np.argsort(offsets, kind='stable').tolist():
+        offset, duration = audio_times[i]
+        end = offset + duration
+        if spans:
+            span = spans[-1]
+            span_end = max(span[1], end)
+            if offset <= span[1] and (max_span_duration is None or span_end - span[0] <= max_span_duration):
+                span[1] = span_end
+                span[2].append(i)
+                continue
+
+        spans.append([offset, end, [i]])
+
+    return spans
+
+def iter_audio_chunks(path_audio, path_metadata, desired_sample_rate=None, single_decode=False, 
+                      max_span_duration=600, **metadata_kwargs):
+    """
+    Same as `read_audio`, but yields the chunks one by one as they are decoded, 
+    so they don't all have to be in memory.
+
+    Without `single_decode`, the overlapping or adjacent chunks are merged in spans of at most 
+    `max_span_duration` seconds, and each span is decoded once. With `single_decode`, the whole 
+    file is decoded before the first chunk is yielded, the memory is then bounded by the file 
+    length instead of the span length.
+
+    The chunks are yielded in the order of the metadata. When it is not sorted (`sort=False`),
+    the chunks decoded before their turn are kept until it comes.
+
+    Yields:
+        tuple: ((chunk, sample rate), (offset, duration)) of each chunk.
+    """
+    # Imported here, as it is slow to import and not needed when the results are cached
+    import librosa as lb
+
+    audio_times = read_metadata(path_metadata, **metadata_kwargs)
+
+    if single_decode:
+        audio, sr = lb.load(path_audio, sr=desired_sample_rate)
+        for offset, duration in audio_times:
+            yield (_slice_chunk(audio, sr, offset, duration), sr), (offset, duration)
+        return
+
+    # Chunks decoded ahead of their turn, by index
+    pending = {}
+    next_index = 0
+    for span_start, span_end, indexes in _merge_segments(audio_times, max_span_duration):
+        span_audio, sr = lb.load(path_audio, sr=desired_sample_rate, offset=span_start, 
+                                 duration=span_end - span_start + SPAN_MARGIN_SECONDS)
+        for i in indexes:
+            offset, duration = audio_times[i]
+            pending[i] = (_slice_chunk(span_audio, sr, offset, duration, span_start), sr), (offset, duration)
+
+        while next_index in pending:
+            yield pending.pop(next_index)
+            next_index += 1
+
+@profiled(count=lambda result, args, kwargs: len(result[0]))
+def read_audio(path_audio, path_metadata, desired_sample_rate=None, single_decode=False, **metadata_kwargs):
     """
     Reads an audio file and his metadata, extracting specified chunks based on timestamps.
 
@@ -12,61 +153,80 @@ def read_audio(path_audio, path_metadata, desired_sample_rate=None):
         path_audio (str): Path to the audio file.
         path_metadata (str): Path to the metadata CSV file containing 'summary_start' and 'summary_end' columns.
         desired_sample_rate (int, optional): Desired sample rate for the audio. Defaults to the native sample rate.
+        single_decode (bool, optional): If True, the file is decoded (and resampled) only once and 
+            every chunk is a view on this single buffer. Otherwise the overlapping or adjacent chunks 
+            are decoded together, once per span. Defaults to False.
+        **metadata_kwargs: Options of `read_metadata` (origin, time_format, drop_edges, sort).
 
     Returns:
         tuple: 
             - audio_chunks (list of tuples): List of tuples containing audio chunks and their sample rates.
             - audio_times (list of tuples): List of tuples containing offsets (start times) and durations of the audio chunks.
     """
-    metadata = pd.read_csv(path_metadata, sep=',')
-
-    # Converting to datetime format
-    metadata['summary_start'] = pd.to_datetime(metadata['summary_start'], infer_datetime_format=True).astype('datetime64[s]')
-    metadata['summary_end'] = pd.to_datetime(metadata['summary_end'], infer_datetime_format=True).astype('datetime64[s]')
-
     audio_chunks = []
     audio_times = []
-    for i in range(1, len(metadata) - 1):
-        # The subtraction of the datetimes return a deltatime, that we can convert to float
-        # by dividing it by timedelta64(1, 's')
-        offset = (metadata['summary_start'][i].to_numpy() - np.datetime64('today', 's')) / np.timedelta64(1, 's')    
-        duration = ((metadata['summary_end'][i] - metadata['summary_start'][i]).to_numpy() / np.timedelta64(1, 's'))
+    for audio_chunk, audio_time in iter_audio_chunks(path_audio, path_metadata, desired_sample_rate, single_decode, 
+                                                     **metadata_kwargs):
+        audio_chunks.append(audio_chunk)
+        audio_times.append(audio_time)
 
-        chunk, sr = lb.load(path_audio, sr=desired_sample_rate, offset=offset, duration=duration)
+    return audio_chunks, audio_times
 
-        audio_chunks.append((chunk, sr))
-        audio_times.append((offset, duration))
+def _select_best_labels(results, k):
+    """
+    Returns the class indexes of the k best non blacklisted labels of every chunk, 
+    sorted by score, in a single masked operation over the whole score matrix.
 
-    return audio_chunks, audio_times
+    Raises:
+        ValueError: If less than k labels are not blacklisted.
+    """
+    blacklist_mask = retrieve_blacklist_mask()
+    if len(blacklist_mask) != results.scores.shape[1]:
+        raise ValueError(f'The blacklist has {len(blacklist_mask)} classes but the model outputs {results.scores.shape[1]} scores')
 
+    allowed_count = np.count_nonzero(~blacklist_mask)
+    if allowed_count < k:
+        raise ValueError(f'Only {allowed_count} labels are not blacklisted, cannot select {k} labels per chunk')
+
+    masked_results = TaggingResults(np.where(blacklist_mask, -np.inf, results.scores))
+    best_indexes, _ = masked_results.top_k(k)
+    return best_indexes
+
+@profiled(count=lambda result, args, kwargs: len(result[1]))
 def extract_best_scores(inferences):
-    BLACKLIST = retrieve_blacklist()
-    higher_scores = [higher_score[1] for higher_score, *_ in inferences]
+    """
+    Returns the best score and the best non blacklisted label of each chunk.
+
+    Args:
+        inferences (TaggingResults or list of list of tuple): Inference results, 
+            as returned by `perform_inference`.
 
-    higher_labels = []
-    for scores in inferences:
-        i = 0
-        while scores[i][0] in BLACKLIST:
-            i += 1
-        higher_labels.append(scores[i][0])
+    Returns:
+        tuple: 
+            - higher_scores (list of float): Best score of each chunk.
+            - higher_labels (list of str): Best non blacklisted label of each chunk.
+    """
+    results = TaggingResults.from_sorted_results(inferences)
+    higher_scores = list(results.scores.max(axis=1))
+
+    best_indexes = _select_best_labels(results, 1)
+    higher_labels = list(results.label(best_indexes[:, 0]))
 
     return higher_scores, higher_labels
 
+@profiled()
 def extract_3best_labels(inferences):
-    BLACKLIST = retrieve_blacklist()
-    best_labels = []
-    for i in range(len(inferences)):
-        _best_labels = []
-        count = 0
-        j = 0
-        while count < 3:
-            if inferences[i][j][0] not in BLACKLIST:
-                _best_labels.append(inferences[i][j][0])
-                count += 1
-            j += 1
-        best_labels.append(_best_labels)
-    
-    return best_labels
-            
-        
+    """
+    Returns the 3 best non blacklisted labels of each chunk.
+
+    Args:
+        inferences (TaggingResults or list of list of tuple): Inference results, 
+            as returned by `perform_inference`.
+
+    Returns:
+        list of list of str: The 3 best labels of each chunk, sorted by score.
+    """
+    results = TaggingResults.from_sorted_results(inferences)
+    best_indexes = _select_best_labels(results, 3)
 
+    return [list(labels) for labels in results.label(best_indexes)]
@@ -1,73 +1,148 @@
 import matplotlib.pyplot as plt
+from matplotlib.offsetbox import AnnotationBbox, OffsetImage
+import numpy as np
 import random
 import time
+from collections import deque
 
 class VisualObject:
-    def __init__(self, name, value, x, y, ax):
+    """An emoji at a fixed position, whose size follows its value."""
+    def __init__(self, name, value, x, y, ax, image, full_value):
         self.name = name
-        self.value = value
         self.x = x
         self.y = y
-        self.text = ax.text(x, y, name, fontsize=value, ha='center', va='center')
+        self.full_value = full_value
+        self.image = OffsetImage(image)
+        # Animated artists are left out of the background and drawn by the display
+        self.box = AnnotationBbox(self.image, (x, y), frameon=False, animated=True)
+        ax.add_artist(self.box)
+        self.update_value(value)
 
     def update_value(self, value):
         self.value = value
-        self.text.set_fontsize(value)
+        # A value of `full_value` shows the emoji image at its size
+        self.image.set_zoom(value / self.full_value)
 
     def remove(self):
-        self.text.remove()
-
-
-fig, ax = plt.subplots()
-ax.set_xlim(0, 1)
-ax.set_ylim(0, 1)
-ax.axis('off')
-
-object_list = []
-
-def add_object(name, value):
-    existing_object = next((obj for obj in object_list if obj.name == name), None)
-    if existing_object:
-        existing_object.update_value(value)
-    else:
+        self.box.remove()
+
+
+class LiveDisplay:
+    """
+    Display of the labels of a live stream, as emojis whose sizes follow their values.
+
+    The objects are indexed by name, and the changes of a tick are applied together by
+    `update`, followed by a single redraw. Only the emojis and the frame rate counter are
+    redrawn, over the saved background of the figure (blitting).
+
+    Usage:
+        display = LiveDisplay()
+        # Shows these labels, with these values, and removes the others
+        display.update({'Speech': 30, 'Music': 12})
+    """
+    def __init__(self, visualization=None, emoji_size=64, full_value=40., fps_window=30):
+        if visualization is None:
+            from visualization import Visualization
+            visualization = Visualization()
+
+        self.visualization = visualization
+        self.emoji_size = emoji_size
+        self.full_value = full_value
+        self.objects = {}
+        self._tick_times = deque(maxlen=fps_window)
+
+        self.fig, self.ax = plt.subplots()
+        self.ax.set_xlim(0, 1)
+        self.ax.set_ylim(0, 1)
+        self.ax.axis('off')
+        self.fps_text = self.ax.text(0.01, 0.99, '', fontsize=8, ha='left', va='top',
+                                     transform=self.ax.transAxes, animated=True)
+
+        # Saved at every full draw of the figure (first display, resize)
+        self._background = None
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+
+        plt.show(block=False)
+        plt.pause(0.1)
+
+    def _on_draw(self, event):
+        self._background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_animated()
+
+    def _draw_animated(self):
+        for visual_object in self.objects.values():
+            self.fig.draw_artist(visual_object.box)
+        self.fig.draw_artist(self.fps_text)
+
+    def add_object(self, name, value):
+        """Shows a label, or changes its value if it is shown. The figure is redrawn by `draw`."""
+        existing_object = self.objects.get(name)
+        if existing_object is not None:
+            existing_object.update_value(value)
+            return
+
+        thumbnail = self.visualization.retrieve_label_thumbnail(name, (self.emoji_size, self.emoji_size))
         x, y = random.uniform(0.1, 0.9), random.uniform(0.1, 0.9)
-        new_object = VisualObject(name, value, x, y, ax)
-        object_list.append(new_object)
-
-def remove_object(name):
-    global object_list
-    for obj in object_list:
-        if obj.name == name:
-            obj.remove()
-            object_list.remove(obj)
-            break
-
-def draw():
-    global object_list
-    plt.pause(0.01)
-
-def show():
-    plt.ion()
-
-    for i in range(10):
-        if random.random() > 0.3:
-            obj_name = f"Obj{random.randint(1, 5)}"
-            obj_value = random.randint(10, 40)
-            add_object(obj_name, obj_value)
+        self.objects[name] = VisualObject(name, value, x, y, self.ax, np.asarray(thumbnail), self.full_value)
+
+    def remove_object(self, name):
+        """Removes a label if it is shown. The figure is redrawn by `draw`."""
+        visual_object = self.objects.pop(name, None)
+        if visual_object is not None:
+            visual_object.remove()
+
+    def update(self, values):
+        """
+        Shows the given labels, removes the others, and redraws once.
+
+        Args:
+            values (dict): Value of each label to show.
+        """
+        for name in self.objects.keys() - values.keys():
+            self.remove_object(name)
+        for name, value in values.items():
+            self.add_object(name, value)
+
+        self.draw()
+
+    def fps(self):
+        """Returns the number of redraws per second over the last ticks."""
+        if len(self._tick_times) < 2:
+            return 0.
+        return (len(self._tick_times) - 1) / (self._tick_times[-1] - self._tick_times[0])
+
+    def draw(self):
+        self._tick_times.append(time.perf_counter())
+        self.fps_text.set_text(f'{self.fps():.1f} FPS')
+
+        canvas = self.fig.canvas
+        if self._background is None:
+            # Full draw, which saves the background
+            canvas.draw()
         else:
-            if object_list:
-                obj_to_remove = random.choice(object_list).name
-                remove_object(obj_to_remove)
-        draw()
-        time.sleep(0.5)
-    print(2)
-    plt.ioff()
-    plt.show()
-
-show()
+            canvas.restore_region(self._background)
+            self._draw_animated()
+            canvas.blit(self.fig.bbox)
+        canvas.flush_events()
 
 
+def show(ticks=100, interval=0.05):
+    from mapping import CODEPOINTS_BY_LABEL
 
+    display = LiveDisplay()
+    labels = list(CODEPOINTS_BY_LABEL)[:20]
 
+    values = {}
+    for i in range(ticks):
+        if random.random() > 0.3:
+            values[random.choice(labels)] = random.randint(10, 40)
+        elif values:
+            values.pop(random.choice(list(values)))
+        display.update(values)
+        time.sleep(interval)
 
+    print(f'{display.fps():.1f} FPS')
+    plt.show()
 
+if __name__ == '__main__':
+    show()
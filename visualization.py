@@ -1,29 +1,211 @@
-import matplotlib.pyplot as plt
-from matplotlib.cm import get_cmap
 import numpy as np
-import pandas as pd
-import base64
 import PIL
 from PIL import ImageDraw
-from io import BytesIO
-from mapping import LABELS_MAPPING
+from mapping import CODEPOINTS_BY_LABEL, find_missing_codepoints, retrieve_class_codepoints
+from emoji_store import EmojiStore, DEFAULT_STORE_PATH
+from emoji_cache import EmojiCache
+from gif_writer import GifStreamWriter, index_frame
+from profiling import profiled
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
 import math
+import multiprocessing
+import os
+
+def _count_chunks(result, args, kwargs):
+    labels = [*args[1:3], kwargs.get('best_labels'), kwargs.get('best_labels3')]
+    return max((len(chunk_labels) for chunk_labels in labels if chunk_labels is not None), default=0)
+
+
+def _new_frame(frame_size):
+    return PIL.Image.new("RGBA", frame_size, (255, 255, 255, 1))
+
+def _draw_frames(frame_size, frames, thumbnails, accumulate=False, start_frame=None):
+    """
+    Draws frames described by their pastes, the emoji thumbnails being pasted at their
+    positions on a blank frame, or on the previous frame with `accumulate`.
+
+    Args:
+        frame_size (tuple): Size of the frames.
+        frames (list of list): Pastes of each frame, as (thumbnail key, position) tuples.
+        thumbnails (dict): RGBA thumbnails by key.
+        accumulate (bool, optional): If True, each frame is drawn over the previous one. The
+            same image is then yielded for every frame, it must be used before the next one.
+        start_frame (PIL.Image, optional): With `accumulate`, the frame the first one is drawn
+            over, instead of a blank frame. It is modified.
+
+    Yields:
+        PIL.Image: The RGBA frames.
+    """
+    frame = start_frame if accumulate and start_frame is not None else _new_frame(frame_size)
+    for pastes in frames:
+        if not accumulate:
+            frame = _new_frame(frame_size)
+        for key, position in pastes:
+            frame.paste(thumbnails[key], position, thumbnails[key])
+        yield frame
+
+# Frames to draw and GIF palettes of the rendering processes, set by _init_frame_worker
+_frame_worker = None
+
+def _init_frame_worker(targets, thumbnails):
+    global _frame_worker
+    _frame_worker = (targets, thumbnails)
+
+def _index_frame_range(name, start, end, start_frame=None):
+    targets, thumbnails = _frame_worker
+    frame_size, frames, accumulate, palette_image, alpha_threshold = targets[name]
+    frames_drawn = _draw_frames(frame_size, frames[start:end], thumbnails, accumulate, start_frame)
+    return [index_frame(frame, palette_image, alpha_threshold) for frame in frames_drawn]
+
+def _iter_frame_indexes(num_workers, frames_per_task, targets, thumbnails):
+    """
+    Draws and quantizes the frames of several GIFs in a process pool, by ranges of
+    `frames_per_task` frames.
+
+    Args:
+        num_workers (int): Number of processes.
+        frames_per_task (int): Number of frames drawn by each task.
+        targets (dict): (frame_size, frames, accumulate, palette_image, alpha_threshold) of each GIF, by name.
+        thumbnails (dict): RGBA thumbnails by key, shared by every GIF.
+
+    Yields:
+        tuple: (name, palette indexes) of each frame, the frames of each GIF in their order.
+    """
+    num_frames = max(len(frames) for _, frames, _, _, _ in targets.values())
+
+    # The frames of the accumulating GIFs are drawn over the ones before them: the frame each
+    # range starts from is drawn here, once, and sent with the range. Pasting is cheap compared
+    # to the quantization done by the workers
+    canvases = {name: _new_frame(frame_size)
+                for name, (frame_size, _, accumulate, _, _) in targets.items() if accumulate}
+
+    # Spawned processes, so the workers don't inherit the threads of torch
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(num_workers, mp_context=context, initializer=_init_frame_worker,
+                             initargs=(targets, thumbnails)) as pool:
+        # The ranges are collected in order, and the ones in flight are bounded to bound the memory
+        pending = deque()
+        for start in range(0, num_frames, frames_per_task):
+            end = start + frames_per_task
+            for name, (_, frames, _, _, _) in targets.items():
+                if start >= len(frames):
+                    continue
+                canvas = canvases.get(name)
+                pending.append((name, pool.submit(_index_frame_range, name, start, end,
+                                                  canvas.copy() if canvas is not None else None)))
+                if canvas is not None:
+                    for key, position in (paste for pastes in frames[start:end] for paste in pastes):
+                        canvas.paste(thumbnails[key], position, thumbnails[key])
+            while len(pending) >= 2 * num_workers:
+                name, future = pending.popleft()
+                for indexes in future.result():
+                    yield name, indexes
+
+        while pending:
+            name, future = pending.popleft()
+            for indexes in future.result():
+                yield name, indexes
+
+# Output suffix, labels drawn in each frame (the 'best' label or the 'best3' labels of a chunk),
+# drawing over the previous frame and default options of each GIF style
+GIF_STYLES = {
+    'emoji': {'suffix': '', 'labels': 'best', 'accumulate': False,
+              'options': {'frame_size': (200, 200), 'duration': 500}},
+    'circle': {'suffix': '_circle', 'labels': 'best', 'accumulate': True,
+               'options': {'frame_size': (200, 200), 'duration': 500, 'circle_radius': 70}},
+    'circle_detailled': {'suffix': '_circle_detailled', 'labels': 'best3', 'accumulate': True,
+                         'options': {'frame_size': (200, 200), 'duration': 500, 'circle_radius': 80}},
+    'diagonal': {'suffix': '_diagonal', 'labels': 'best3', 'accumulate': False,
+                 'options': {'frame_size': (300, 300), 'duration': 1000}},
+}
+
 
 class Visualization:
-    def __init__(self, emoji_size=2):
-        self.emoji_data = pd.read_csv('./emojiimage-dataset/full_emoji.csv')
-        self.emoji_data.set_index('unicode', inplace=True)
+    @profiled(count=lambda result, args, kwargs: 1)
+    def __init__(self, emoji_size=2, store_path=DEFAULT_STORE_PATH, emoji_cache=None,
+                 render_workers=1, frames_per_task=64, parallel_min_frames=512):
+        # The store is built from the dataset CSV on the first run only
+        self.emoji_store = EmojiStore.open_or_build(store_path)
         self.emoji_size = emoji_size
 
+        # Shared by every renderer, so an emoji is decoded and resized once per size
+        self.emoji_cache = emoji_cache if emoji_cache is not None else EmojiCache()
+
+        # The GIFs of at least `parallel_min_frames` frames are drawn in `render_workers`
+        # processes, the shorter ones don't pay for starting them
+        self.render_workers = render_workers
+        self.frames_per_task = frames_per_task
+        self.parallel_min_frames = parallel_min_frames
+
         # Placeholder emoji while we don't have the mapping label-emoji
         self.default_emoji = self._retrieve_emoji_as_PIL('U+274C')
 
+        # Labels whose emojis are missing from the store are drawn with the default emoji. They
+        # are reported when the store is built, not by every instance (or rendering process)
+        self.broken_labels = find_missing_codepoints(self.emoji_store)
+
 
     def _retrieve_emoji_as_PIL(self, unicode):
-        # We take the data from index 21 to remove unnecessary header
-        emoji = self.emoji_data.loc[unicode]['Apple'][21:]
-        image_bytes = base64.b64decode(emoji)
-        return PIL.Image.open(BytesIO(image_bytes))
+        return self.emoji_store.get_image(unicode)
+
+    def _retrieve_label_codepoints(self, label):
+        """Returns the emoji codepoints of a label, given by its name or its class index."""
+        if isinstance(label, (int, np.integer)):
+            return retrieve_class_codepoints()[label]
+        return CODEPOINTS_BY_LABEL.get(label, ())
+
+    def _retrieve_label_as_PIL(self, label):
+        """
+        Returns the emoji image of a label. Labels mapped to several emojis are 
+        pasted side by side, and unmapped labels get the default emoji.
+        """
+        codepoints = self._retrieve_label_codepoints(label)
+        if not codepoints or any(codepoint not in self.emoji_store for codepoint in codepoints):
+            return self.default_emoji
+
+        emoji_image = self._retrieve_emoji_as_PIL(codepoints[0])
+        for codepoint in codepoints[1:]:
+            next_emoji = self._retrieve_emoji_as_PIL(codepoint)
+            new_emoji_image = PIL.Image.new("RGBA", (emoji_image.width + next_emoji.width, emoji_image.height)) 
+            new_emoji_image.paste(emoji_image, (0, 0))
+            new_emoji_image.paste(next_emoji, (emoji_image.width, 0))
+            emoji_image = new_emoji_image
+
+        return emoji_image
+
+    def _retrieve_label_thumbnail(self, label, size):
+        """
+        Returns the RGBA emoji image of a label resized to fit in `size`, ready to be pasted.
+        The image comes from the shared cache, so it must not be modified.
+        """
+        def create_thumbnail():
+            thumbnail = self._retrieve_label_as_PIL(label).copy().convert("RGBA")
+            thumbnail.thumbnail(size, PIL.Image.LANCZOS)
+            return thumbnail
+
+        return self.emoji_cache.get((label, tuple(size)), create_thumbnail)
+
+    def retrieve_label_thumbnail(self, label, size):
+        """
+        Returns the RGBA emoji image of a label resized to fit in `size`, from the cache
+        shared with the GIF renderers. The image must not be modified.
+        """
+        return self._retrieve_label_thumbnail(label, size)
+
+    def _build_palette_source(self, labels, size=(32, 32)):
+        """
+        Returns a strip of the emojis of the given labels, from which the palette 
+        shared by every frame of a GIF is computed.
+        """
+        unique_labels = list(dict.fromkeys(labels))
+        strip = PIL.Image.new("RGBA", (size[0] * (len(unique_labels) + 1), size[1]), (255, 255, 255, 255))
+        for i, label in enumerate(unique_labels):
+            thumbnail = self._retrieve_label_thumbnail(label, size)
+            strip.paste(thumbnail, (i * size[0], 0), thumbnail)
+
+        return strip
 
 
     def generate_visualization(self, x, duration, y, labels, figure_name='output.png'):
@@ -36,6 +218,10 @@ class Visualization:
             y (list of float): Scores or heights of the bars.
             figure_name (str, optional): Output file name for the saved figure. Defaults to 'output.png'.
         """
+        # Only this figure needs matplotlib, the GIFs are made with PIL
+        import matplotlib.pyplot as plt
+        from matplotlib.cm import get_cmap
+
         cmap = get_cmap('viridis')  
         colors = [cmap(i / len(x)) for i in range(len(x))]  
         _, ax = plt.subplots()
@@ -58,15 +244,15 @@ class Visualization:
             # the 1.1 is to adjust the position lower than the top of the bar
             emoji_y_pos = y[i] - 1.1*emoji_height 
 
-            emoji_unicode = LABELS_MAPPING.get(labels[i])
+            codepoints = self._retrieve_label_codepoints(labels[i])
 
-            if not emoji_unicode:
+            if not codepoints or codepoints[0] not in self.emoji_store:
                 ax.imshow(self.default_emoji, 
                         extent=[emoji_x_pos, emoji_x_pos + emoji_width, 
                                 emoji_y_pos, emoji_y_pos + emoji_height], 
                         aspect='auto')
             else:
-                emoji = self._retrieve_emoji_as_PIL(emoji_unicode.split('-')[1])
+                emoji = self._retrieve_emoji_as_PIL(codepoints[0])
                 ax.imshow(emoji, 
                         extent=[emoji_x_pos, emoji_x_pos + emoji_width, 
                                 emoji_y_pos, emoji_y_pos + emoji_height], 
@@ -78,217 +264,213 @@ class Visualization:
         plt.savefig(figure_name, dpi=300)
     
 
-    def create_emoji_gif(self, labels, output_name='output', frame_size=(200, 200), duration=500):
-        frames = []
-
-        for label in labels:
-            emoji_image = self.default_emoji
-
-            emoji_unicode = LABELS_MAPPING.get(label)
-            if emoji_unicode:
-                unicodes = emoji_unicode.split('-')
-                for i, unicode in enumerate(unicodes[1:]):
-                    if i == 0:
-                        emoji_image = self._retrieve_emoji_as_PIL(unicode)
-                    else:
-                        next_emoji = self._retrieve_emoji_as_PIL(unicode)
-                        new_emoji_image = PIL.Image.new("RGBA", (emoji_image.width + next_emoji.width, emoji_image.height)) 
-                        new_emoji_image.paste(emoji_image, (0, 0))
-                        new_emoji_image.paste(next_emoji, (emoji_image.width, 0))
-                        emoji_image = new_emoji_image
-
-            frame = PIL.Image.new("RGBA", frame_size, (255, 255, 255, 1))
-
-            emoji_image = emoji_image.copy().convert("RGBA")
-            emoji_image.thumbnail((frame_size[0] // 2, frame_size[1] // 2), PIL.Image.ANTIALIAS)
-
-            x = (frame_size[0] - emoji_image.width) // 2
-            y = (frame_size[1] - emoji_image.height) // 2
-
-            frame.paste(emoji_image, (x, y), emoji_image)
-
-            frames.append(frame)
-
-        frames[0].save(
-            f'output/{output_name}.gif',
-            save_all=True,
-            append_images=frames[1:],
-            duration=duration,
-            loop=0,
-        )
-
-    def create_emoji_circle_gif(self, labels, output_name='output', frame_size=(200, 200), duration=500, circle_radius=70):
-        frames = []
-
-        # Convert labels to emoji images
-        emoji_images = []
-        for label in labels:
-            emoji_unicode = LABELS_MAPPING.get(label)
-            if emoji_unicode:
-                unicodes = emoji_unicode.split('-')
-                for i, unicode in enumerate(unicodes[1:]):
-                    if i == 0:
-                        emoji_image = self._retrieve_emoji_as_PIL(unicode)
-                    else:
-                        next_emoji = self._retrieve_emoji_as_PIL(unicode)
-                        new_emoji_image = PIL.Image.new("RGBA", (emoji_image.width + next_emoji.width, emoji_image.height)) 
-                        new_emoji_image.paste(emoji_image, (0, 0))
-                        new_emoji_image.paste(next_emoji, (emoji_image.width, 0))
-                        emoji_image = new_emoji_image
-
-                emoji_images.append(emoji_image)
-
-        # Determine the number of frames (one for each emoji in the circle)
-        num_frames = len(emoji_images)
-
-        frame = PIL.Image.new("RGBA", frame_size, (255, 255, 255, 1))
+    def _emoji_pastes(self, label, i, num_frames, frame_size):
+        size = (frame_size[0] // 2, frame_size[1] // 2)
+        emoji_image = self._retrieve_label_thumbnail(label, size)
 
+        x = (frame_size[0] - emoji_image.width) // 2
+        y = (frame_size[1] - emoji_image.height) // 2
+
+        return [((label, size), (x, y))]
+
+    def _circle_pastes(self, label, i, num_frames, frame_size, circle_radius):
         # Calculate positions for emojis in a circle
         center_x, center_y = frame_size[0] // 2, frame_size[1] // 2
-        angle_step = 2 * math.pi / num_frames
-
-        for i, emoji_image in enumerate(emoji_images):
-            frame = frame.copy()
-            angle = angle_step * ((i - math.pi / 2))
-
-            emoji_resized = emoji_image.copy().convert("RGBA")
-            emoji_resized.thumbnail((frame_size[0] // 6, frame_size[1] // 6), PIL.Image.ANTIALIAS)
-
-            x = center_x + int(circle_radius * math.cos(angle) - emoji_resized.width // 4)
-            y = center_y + int(circle_radius * math.sin(angle) - emoji_resized.height // 4)
-
-
-            # Paste the emoji onto the frame
-            frame.paste(emoji_resized, (x - int(0.05*frame_size[0]), y - int(0.05*frame_size[1])), emoji_resized)
-            frames.append(frame)
-
-        # Save the frames as a GIF
-        frames[0].save(
-            f'output/{output_name}_circle.gif',
-            save_all=True,
-            append_images=frames[1:],
-            duration=duration,
-            loop=0,
-        )
-
-    def create_emoji_circle_detailled_gif(self, labels, output_name='output', frame_size=(200, 200), duration=500, circle_radius=80):
-        frames = []
-
-        # Convert labels to emoji images
-        emoji_images = []
-        for label in labels:
-            _emoji_images = []
-            for inside_label in label:
-                emoji_unicode = LABELS_MAPPING.get(inside_label)
-                if emoji_unicode:
-                    unicodes = emoji_unicode.split('-')
-                    for i, unicode in enumerate(unicodes[1:]):
-                        if i == 0:
-                            emoji_image = self._retrieve_emoji_as_PIL(unicode)
-                        else:
-                            next_emoji = self._retrieve_emoji_as_PIL(unicode)
-                            new_emoji_image = PIL.Image.new("RGBA", (emoji_image.width + next_emoji.width, emoji_image.height)) 
-                            new_emoji_image.paste(emoji_image, (0, 0))
-                            new_emoji_image.paste(next_emoji, (emoji_image.width, 0))
-                            emoji_image = new_emoji_image
-                _emoji_images.append(emoji_image)
-            
-            emoji_images.append(_emoji_images)
+        angle = 2 * math.pi / num_frames * ((i - math.pi / 2))
+        size = (frame_size[0] // 6, frame_size[1] // 6)
 
-        # Determine the number of frames (one for each emoji in the circle)
-        num_frames = len(emoji_images)
+        emoji_resized = self._retrieve_label_thumbnail(label, size)
 
-        frame = PIL.Image.new("RGBA", frame_size, (255, 255, 255, 1))
+        x = center_x + int(circle_radius * math.cos(angle) - emoji_resized.width // 4)
+        y = center_y + int(circle_radius * math.sin(angle) - emoji_resized.height // 4)
+
+        return [((label, size), (x - int(0.05*frame_size[0]), y - int(0.05*frame_size[1])))]
+
+    def _circle_detailled_pastes(self, labels3, i, num_frames, frame_size, circle_radius):
+        # The best label on the circle, the second one on a circle of half the radius
+        pastes = self._circle_pastes(labels3[0], i, num_frames, frame_size, circle_radius)
 
-        # Calculate positions for emojis in a circle
         center_x, center_y = frame_size[0] // 2, frame_size[1] // 2
-        angle_step = 2 * math.pi / num_frames
-
-        for i in range(num_frames):
-            frame = frame.copy()
-            angle = angle_step * ((i - math.pi / 2))
-
-            emoji_resized = emoji_images[i][0].copy().convert("RGBA")
-            emoji_resized.thumbnail((frame_size[0] // 6, frame_size[1] // 6), PIL.Image.ANTIALIAS)
-
-            x = center_x + int(circle_radius * math.cos(angle) - emoji_resized.width // 4)
-            y = center_y + int(circle_radius * math.sin(angle) - emoji_resized.height // 4)
-
-            # Paste the emoji onto the frame
-            frame.paste(emoji_resized, (x - int(0.05*frame_size[0]), y - int(0.05*frame_size[1])), emoji_resized)
-
-            emoji_resized2 = emoji_images[i][1].copy().convert("RGBA")
-            emoji_resized2.thumbnail((frame_size[0] // 10, frame_size[1] // 10), PIL.Image.ANTIALIAS)
-
-            x = center_x + int(circle_radius/2 * math.cos(angle) - emoji_resized2.width // 4)
-            y = center_y + int(circle_radius/2 * math.sin(angle) - emoji_resized2.height // 4)
-
-            # Paste the emoji onto the frame
-            frame.paste(emoji_resized2, (x - int(0.05*frame_size[0]), y - int(0.05*frame_size[1])), emoji_resized2)
-
-            frames.append(frame)
-
-        # Save the frames as a GIF
-        frames[0].save(
-            f'output/{output_name}_circle_detailled.gif',
-            save_all=True,
-            append_images=frames[1:],
-            duration=duration,
-            loop=0,
-        )
-
-    def create_diagonal_emoji_gif(self, labels, output_name='output', frame_size=(300, 300), duration=1000):
-        frames = []
-
-        # Convert labels to emoji images
-        emoji_images = []
-        for label in labels:
-            _emoji_images = []
-            for inside_label in label:
-                emoji_unicode = LABELS_MAPPING.get(inside_label)
-                if emoji_unicode:
-                    unicodes = emoji_unicode.split('-')
-                    for i, unicode in enumerate(unicodes[1:]):
-                        if i == 0:
-                            emoji_image = self._retrieve_emoji_as_PIL(unicode)
-                        else:
-                            next_emoji = self._retrieve_emoji_as_PIL(unicode)
-                            new_emoji_image = PIL.Image.new("RGBA", (emoji_image.width + next_emoji.width, emoji_image.height)) 
-                            new_emoji_image.paste(emoji_image, (0, 0))
-                            new_emoji_image.paste(next_emoji, (emoji_image.width, 0))
-                            emoji_image = new_emoji_image
-                _emoji_images.append(emoji_image)
-            
-            emoji_images.append(_emoji_images)
+        angle = 2 * math.pi / num_frames * ((i - math.pi / 2))
+        size = (frame_size[0] // 10, frame_size[1] // 10)
+
+        emoji_resized2 = self._retrieve_label_thumbnail(labels3[1], size)
 
-        # Determine the number of frames (one set of 3 emojis per frame)
-        num_frames = len(emoji_images)
+        x = center_x + int(circle_radius/2 * math.cos(angle) - emoji_resized2.width // 4)
+        y = center_y + int(circle_radius/2 * math.sin(angle) - emoji_resized2.height // 4)
 
-        for frame_idx in range(num_frames):
-            # Create a blank frame
-            frame = PIL.Image.new("RGBA", frame_size, (255, 255, 255, 1))
+        pastes.append(((labels3[1], size), (x - int(0.05*frame_size[0]), y - int(0.05*frame_size[1]))))
+        return pastes
 
-            for emoji_idx, emoji in enumerate(emoji_images[frame_idx]):
-                scale_factor = 1 - (emoji_idx * 0.3)
-                emoji_resized = emoji.copy().convert("RGBA")
-                new_size = (frame_size[0] // 5) * scale_factor
-                emoji_resized.thumbnail((new_size, new_size), PIL.Image.ANTIALIAS)
+    def _diagonal_pastes(self, labels3, i, num_frames, frame_size):
+        pastes = []
+        for emoji_idx, label in enumerate(labels3):
+            scale_factor = 1 - (emoji_idx * 0.3)
+            new_size = int((frame_size[0] // 5) * scale_factor)
+            emoji_resized = self._retrieve_label_thumbnail(label, (new_size, new_size))
 
-                center_x = (emoji_idx + 1)  * (frame_size[0] // 4)
-                center_y =  (emoji_idx + 1) * (frame_size[1] // 4)
+            center_x = (emoji_idx + 1)  * (frame_size[0] // 4)
+            center_y =  (emoji_idx + 1) * (frame_size[1] // 4)
 
-                x = center_x - emoji_resized.width
-                y = center_y - emoji_resized.height
+            x = center_x - emoji_resized.width
+            y = center_y - emoji_resized.height
 
-                frame.paste(emoji_resized, (x, y), emoji_resized)
+            pastes.append(((label, (new_size, new_size)), (x, y)))
 
-            frames.append(frame)
+        return pastes
 
-        # Save the frames as a GIF
-        frames[0].save(
-            f'output/{output_name}_diagonal.gif',
-            save_all=True,
-            append_images=frames[1:],
-            duration=duration,
-            loop=0,
-        )
\ No newline at end of file
+    def _write_gifs(self, targets):
+        """
+        Draws frames described by their pastes and writes them in GIFs, each one with
+        its own palette. With `render_workers` above 1 and at least `parallel_min_frames`
+        frames, the frames are drawn in a process pool.
+
+        Args:
+            targets (dict): Path, frame_size, frames (pastes of each frame, as ((label, thumbnail size),
+                position) tuples), durations (of each frame, in milliseconds) and accumulate
+                (drawing each frame over the previous one) of each GIF, by name.
+        """
+        thumbnails = {key: self._retrieve_label_thumbnail(*key)
+                      for target in targets.values() for pastes in target['frames'] for key, _ in pastes}
+        num_frames = max(len(target['frames']) for target in targets.values())
+
+        with ExitStack() as stack:
+            writers = {}
+            for name, target in targets.items():
+                # The palette is made of the emojis drawn in the GIF
+                palette_labels = [label for pastes in target['frames'] for (label, _), _ in pastes]
+                writers[name] = stack.enter_context(GifStreamWriter(target['path'], self._build_palette_source(palette_labels)))
+
+            if self.render_workers > 1 and num_frames >= self.parallel_min_frames:
+                worker_targets = {name: (target['frame_size'], target['frames'], target['accumulate'],
+                                         writers[name].palette_image, writers[name].alpha_threshold)
+                                  for name, target in targets.items()}
+                durations = {name: iter(target['durations']) for name, target in targets.items()}
+                for name, indexes in _iter_frame_indexes(self.render_workers, self.frames_per_task,
+                                                         worker_targets, thumbnails):
+                    writers[name].append_indexes(indexes, next(durations[name]))
+            else:
+                frames_drawn = {name: _draw_frames(target['frame_size'], target['frames'], thumbnails, target['accumulate'])
+                                for name, target in targets.items()}
+                for i in range(num_frames):
+                    for name, target in targets.items():
+                        if i < len(target['frames']):
+                            writers[name].append(next(frames_drawn[name]), target['durations'][i])
+
+    @profiled(count=_count_chunks)
+    def create_gifs(self, best_labels=None, best_labels3=None, output_name='output', styles=None, options=None,
+                    output_dir='output'):
+        """
+        Renders several GIF styles in a single pass over the chunks: the emoji thumbnails are
+        resolved and resized once for every style, and the frames of each style are written
+        to their own GIF, {output_dir}/{output_name}{suffix}.gif.
+
+        Args:
+            best_labels (list, optional): Best label of each chunk, drawn by the 'emoji' and 'circle' styles.
+            best_labels3 (list of list, optional): 3 best labels of each chunk, drawn by the
+                'circle_detailled' and 'diagonal' styles.
+            output_name (str, optional): Name of the GIFs, followed by the suffix of each style.
+            styles (list of str, optional): Styles to render, among GIF_STYLES. Defaults to every
+                style whose labels are given.
+            options (dict, optional): Options of the styles by style, overriding the defaults of GIF_STYLES
+                (frame_size, duration, circle_radius). The duration (ms) can be a list, giving the
+                duration of the frame of each chunk.
+            output_dir (str, optional): Directory of the GIFs.
+
+        A style without any frame is not written, e.g. 'circle' when none of the labels has an emoji.
+        """
+        labels_by_kind = {'best': best_labels, 'best3': best_labels3}
+        if styles is None:
+            styles = [style for style, definition in GIF_STYLES.items() if labels_by_kind[definition['labels']] is not None]
+        options = options or {}
+
+        targets = {}
+        for style in styles:
+            definition = GIF_STYLES[style]
+            labels = labels_by_kind[definition['labels']]
+            if labels is None:
+                raise ValueError(f"The '{style}' style needs the {definition['labels']} labels")
+
+            style_options = {**definition['options'], **options.get(style, {})}
+            targets[style] = {
+                'path': os.path.join(output_dir, f'{output_name}{definition["suffix"]}.gif'),
+                'frame_size': style_options['frame_size'],
+                'accumulate': definition['accumulate'],
+                'labels': labels,
+                'pastes': getattr(self, f'_{style}_pastes'),
+                'options': {name: value for name, value in style_options.items() if name != 'duration'},
+                'duration': style_options['duration'],
+                'frames': [],
+                'durations': [],
+                'num_frames': len(labels),
+            }
+
+        if not targets:
+            return
+
+        # Labels without emoji are not drawn in the circle
+        if 'circle' in targets:
+            targets['circle']['num_frames'] = sum(bool(self._retrieve_label_codepoints(label)) for label in best_labels)
+
+        for i in range(max(len(target['labels']) for target in targets.values())):
+            for style, target in targets.items():
+                if i >= len(target['labels']):
+                    continue
+                label = target['labels'][i]
+                if style == 'circle' and not self._retrieve_label_codepoints(label):
+                    continue
+
+                target['frames'].append(target['pastes'](label, len(target['frames']), target['num_frames'], **target['options']))
+                duration = target['duration']
+                target['durations'].append(duration[i] if isinstance(duration, (list, tuple, np.ndarray)) else duration)
+
+        # e.g. the circle when no label has an emoji, a GIF needs at least a frame
+        targets = {style: target for style, target in targets.items() if target['frames']}
+        if targets:
+            self._write_gifs(targets)
+
+    def create_segment_gifs(self, segments, segment_labels3=None, output_name='output', styles=None, ms_per_second=50,
+                            output_dir='output'):
+        """
+        Renders GIFs with one frame per segment, as returned by `smoothing.extract_segments`,
+        instead of one frame per chunk. Each frame is shown for a time proportional to the
+        duration of its segment.
+
+        Args:
+            segments (list of tuple): (start, end, label, mean score, first chunk, end chunk) of each segment.
+            segment_labels3 (list of list, optional): 3 best labels of each segment
+                (`smoothing.segment_top_labels`), for the 'circle_detailled' and 'diagonal' styles.
+            output_name (str, optional): Name of the GIFs, followed by the suffix of each style.
+            styles (list of str, optional): Styles to render. Defaults to every style whose labels are given.
+            ms_per_second (float, optional): Display duration of a second of audio, in milliseconds.
+            output_dir (str, optional): Directory of the GIFs.
+        """
+        labels = [label for _, _, label, *_ in segments]
+        # GIF durations have a resolution of 10 ms, and browsers slow down shorter frames
+        durations = [max(20, int(round((end - start) * ms_per_second / 10)) * 10) for start, end, *_ in segments]
+
+        self.create_gifs(labels, segment_labels3, output_name, styles,
+                         options={style: {'duration': durations} for style in GIF_STYLES}, output_dir=output_dir)
+
+    def create_emoji_gif(self, labels, output_name='output', frame_size=(200, 200), duration=500, output_dir='output'):
+        # The same label repeated gives identical frames, merged by the writer
+        self.create_gifs(best_labels=labels, output_name=output_name, output_dir=output_dir, styles=['emoji'],
+                         options={'emoji': {'frame_size': frame_size, 'duration': duration}})
+
+    def create_emoji_circle_gif(self, labels, output_name='output', frame_size=(200, 200), duration=500, circle_radius=70,
+                                output_dir='output'):
+        # Each frame adds an emoji to the previous one
+        self.create_gifs(best_labels=labels, output_name=output_name, output_dir=output_dir, styles=['circle'],
+                         options={'circle': {'frame_size': frame_size, 'duration': duration, 'circle_radius': circle_radius}})
+
+    def create_emoji_circle_detailled_gif(self, labels, output_name='output', frame_size=(200, 200), duration=500, circle_radius=80,
+                                          output_dir='output'):
+        # Each frame adds emojis to the previous one
+        self.create_gifs(best_labels3=labels, output_name=output_name, output_dir=output_dir, styles=['circle_detailled'],
+                         options={'circle_detailled': {'frame_size': frame_size, 'duration': duration,
+                                                       'circle_radius': circle_radius}})
+
+    def create_diagonal_emoji_gif(self, labels, output_name='output', frame_size=(300, 300), duration=1000, output_dir='output'):
+        # One set of 3 emojis per frame
+        self.create_gifs(best_labels3=labels, output_name=output_name, output_dir=output_dir, styles=['diagonal'],
+                         options={'diagonal': {'frame_size': frame_size, 'duration': duration}})